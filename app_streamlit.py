@@ -1,27 +1,40 @@
+import json
+import os
+import urllib.request
+
+import pyarrow.dataset as ds
 import streamlit as st
-import pandas as pd
-import mlflow
-import pickle
 
+# The prediction service (see predict_service.py) keeps the model in memory
+PREDICTION_URL = os.getenv("PREDICTION_URL", "http://localhost:9696/predict")
 
-with open("preprocessor/DictVectorizer.b", "rb") as f_in:
-    dv = pickle.load(f_in)
-model = mlflow.pyfunc.load_model("models_mlflow")
 
+# Chargement du DataFrame cleaned_data (seulement les colonnes utiles), une
+# seule fois et non à chaque interaction
+@st.cache_data
+def load_choices(path="1_cleaned_data"):
+    cleaned_data = (
+        ds.dataset(path, format="parquet", partitioning="hive")
+        .to_table(columns=["wilaya", "commune", "category"])
+        .to_pandas()
+    )
+    # Filtrer les communes par wilaya
+    communes_by_wilaya = cleaned_data.groupby("wilaya")["commune"].unique()
+    return cleaned_data, communes_by_wilaya
 
-# Chargement du DataFrame cleaned_data
-cleaned_data = pd.read_parquet(
-    "1_cleaned_data.parquet"
-)  # Remplacez par le chemin correct
 
-# Filtrer les communes par wilaya
-communes_by_wilaya = cleaned_data.groupby("wilaya")["commune"].unique()
+cleaned_data, communes_by_wilaya = load_choices()
 
 
-# Fonction pour prédire le prix en utilisant le modèle chargé
+# Fonction pour prédire le prix en utilisant le service de prédiction
 def predict_price(features_dict):
-    X = dv.transform(features_dict)
-    return model.predict(X)[0]
+    request = urllib.request.Request(
+        PREDICTION_URL,
+        data=json.dumps(features_dict).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)["price"]
 
 
 # Titre de l'application
@@ -0,0 +1,54 @@
+"""
+Throughput of clean_data.clean_records (shards shared with the workers) and
+clean_chunks (chunks pickled to the workers) with an increasing number of
+worker processes, on a synthetic corpus.
+
+    python -m benchmarks.bench_clean_parallel --rows 200000 --workers 1 2 4 8
+"""
+import os
+
+import pandas as pd
+
+from benchmarks.common import make_parser, timeit
+from clean_data import (
+    clean_chunk,
+    clean_chunks,
+    clean_records,
+    concat_cleaned,
+    iter_chunks,
+)
+from tests.synthetic import make_announcements
+
+
+def clean_pickled(records: list, n_workers: int, shard_size: int) -> pd.DataFrame:
+    return concat_cleaned(clean_chunks(iter_chunks(records, shard_size), n_workers))
+
+
+def clean_serial(records: list, n_workers: int, shard_size: int) -> pd.DataFrame:
+    return concat_cleaned(map(clean_chunk, iter_chunks(records, shard_size)))
+
+
+def main(rows: int, workers: list, shard_size: int, repeat: int) -> dict:
+    records = make_announcements(rows)
+    baseline = timeit(clean_serial, records, 1, shard_size, repeat=repeat)
+    print(f"{'serial':<18} {baseline:8.3f}s {rows / baseline:12,.0f} rows/s")
+    results = {"serial": baseline}
+    for func in (clean_records, clean_pickled):
+        for n_workers in workers:
+            name = f"{func.__name__}[{n_workers}]"
+            results[name] = timeit(func, records, n_workers, shard_size, repeat=repeat)
+            print(
+                f"{name:<18} {results[name]:8.3f}s "
+                f"{rows / results[name]:12,.0f} rows/s x{baseline / results[name]:.1f}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = make_parser(__doc__, rows=200_000, repeat=1)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1]
+    )
+    parser.add_argument("--shard-size", type=int, default=10_000)
+    args = parser.parse_args()
+    main(args.rows, sorted(set(args.workers)), args.shard_size, args.repeat)
@@ -0,0 +1,59 @@
+"""
+Check that drift.DriftEngine gives the metrics monitoring keeps from the
+Evidently report of each window, and compare their throughput.
+
+    python -m benchmarks.bench_drift --rows 100000
+"""
+import time
+
+import pandas as pd
+
+from benchmarks.common import make_parser, print_results
+from tests.helpers import (
+    DRIFT_WINDOW_SIZE,
+    assert_drift_metrics,
+    drift_engine_metrics,
+    evidently_metrics,
+    make_drift_data,
+)
+
+
+def check_parity(reference: pd.DataFrame, current: pd.DataFrame) -> float:
+    """Compare the metrics of the windows of `current`, the Evidently time"""
+    start = time.perf_counter()
+    expected = evidently_metrics(reference, current)
+    seconds = time.perf_counter() - start
+    assert_drift_metrics(drift_engine_metrics(reference, current), expected)
+    return seconds / len(expected)
+
+
+def main(rows: int, parity_windows: int) -> dict:
+    data = make_drift_data(max(rows, 4000))
+    current = pd.concat(
+        [
+            data.iloc[2000 : 2000 + parity_windows * DRIFT_WINDOW_SIZE // 2],
+            data.iloc[-parity_windows * DRIFT_WINDOW_SIZE // 2 :],
+        ]
+    )
+    results = {}
+    # ks, chi-square and z-test up to 1000 reference rows, distances above
+    for num_reference in [800, 2000]:
+        seconds = check_parity(data.iloc[:num_reference], current)
+        results[f"evidently windows/s ({num_reference} reference rows)"] = 1 / seconds
+    print("DriftEngine metrics are identical to the Evidently ones")
+
+    for num_reference in [800, 2000]:
+        start = time.perf_counter()
+        metrics = drift_engine_metrics(data.iloc[:num_reference], data)
+        seconds = time.perf_counter() - start
+        name = f"DriftEngine windows/s ({num_reference} reference rows)"
+        results[name] = len(metrics) / seconds
+    print_results(results, width=48, spec="12,.1f")
+    return results
+
+
+if __name__ == "__main__":
+    parser = make_parser(__doc__, repeat=None)
+    parser.add_argument("--parity-windows", type=int, default=20)
+    args = parser.parse_args()
+    main(args.rows, args.parity_windows)
@@ -0,0 +1,54 @@
+"""
+Check that encoder.ColumnEncoder gives the output of the DictVectorizer it
+replaces, fitted here and pickled by a past run, and compare their speed.
+
+    python -m benchmarks.bench_encoder --rows 100000
+"""
+import pickle
+
+from sklearn.feature_extraction import DictVectorizer
+
+from benchmarks.common import make_parser, print_timings, timeit
+from encoder import ColumnEncoder
+from tests.helpers import check_encoder_parity, make_features
+from train_model import categorical, numerical
+
+RUN_DV = (
+    "mlruns/282919090807413278/d032f6cdaf864e5286ca13fe404433a7"
+    "/artifacts/preprocessor/DictVectorizer.b"
+)
+
+
+def main(rows: int, repeat: int) -> dict:
+    data = make_features(rows)
+    columns = categorical + numerical
+
+    # Fitted on the same data
+    train = data.dropna()
+    dv = DictVectorizer().fit(train[columns].to_dict(orient="records"))
+    encoder = ColumnEncoder.fit(train, columns)
+    assert encoder.feature_names_ == dv.feature_names_
+    check_encoder_parity(data, dv, columns)
+    # Pickled by a past run, with a column it does not know (as in monitoring)
+    with open(RUN_DV, "rb") as f_in:
+        run_dv = pickle.load(f_in)
+    check_encoder_parity(data, run_dv, numerical + ["category", "wilaya"])
+    # Without a column
+    check_encoder_parity(data, run_dv, numerical + ["category"])
+    print("ColumnEncoder output is identical to the DictVectorizer output")
+
+    def dict_vectorizer(data):
+        return dv.transform(data[columns].to_dict(orient="records"))
+
+    results = {
+        "DictVectorizer": timeit(dict_vectorizer, data, repeat=repeat),
+        "ColumnEncoder": timeit(encoder.transform, data[columns], repeat=repeat),
+    }
+    print_timings(results, len(data))
+    print(f"speedup x{results['DictVectorizer'] / results['ColumnEncoder']:.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    args = make_parser(__doc__).parse_args()
+    main(args.rows, args.repeat)
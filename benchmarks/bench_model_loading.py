@@ -0,0 +1,80 @@
+"""
+Compare opening the model of a run with mlflow.pyfunc and as a native
+booster (native_model.BoosterModel): cold start time, in a fresh interpreter,
+and prediction latency for one row and for a large batch.
+
+    python -m benchmarks.bench_model_loading --rows 100000
+"""
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import mlflow.pyfunc
+import numpy as np
+
+from benchmarks.common import make_parser, print_results, timeit
+from native_model import BoosterModel
+from tests.helpers import make_features
+
+RUN_ARTIFACTS = Path(
+    "mlruns/282919090807413278/d032f6cdaf864e5286ca13fe404433a7/artifacts"
+)
+COLUMNS = ["location_duree", "superficie", "pieces", "etages", "category", "wilaya"]
+
+# Run in a fresh interpreter, imports included
+COLD_START = {
+    "pyfunc": (
+        "import mlflow.pyfunc; from encoder import load_encoder;"
+        "load_encoder('{dir}/preprocessor');"
+        "mlflow.pyfunc.load_model('{dir}/models_mlflow')"
+    ),
+    "native": "from native_model import BoosterModel; BoosterModel.load('{dir}')",
+}
+
+
+def cold_start(code: str, repeat: int) -> float:
+    """Median wall time of running `code` in a new process"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def row_latency(predict, X, rows: int = 1000) -> float:
+    """Median latency of predicting one row, over the first `rows` rows"""
+    times = []
+    for i in range(min(rows, X.shape[0])):
+        row = X[i : i + 1]
+        start = time.perf_counter()
+        predict(row)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(model_dir: Path, rows: int, repeat: int, nthread: int | None) -> dict:
+    native = BoosterModel.load(model_dir, nthread)
+    pyfunc = mlflow.pyfunc.load_model(str(model_dir / "models_mlflow"))
+    X = native.encoder.transform(make_features(rows)[COLUMNS])
+    np.testing.assert_allclose(pyfunc.predict(X), native.predict_batch(X), rtol=1e-6)
+    print("Native predictions are identical to the pyfunc ones")
+
+    results = {}
+    for name, code in COLD_START.items():
+        results[f"{name} cold start s"] = cold_start(code.format(dir=model_dir), repeat)
+    for name, predict in [("pyfunc", pyfunc.predict), ("native", native.predict_batch)]:
+        results[f"{name} row latency ms"] = row_latency(predict, X) * 1000
+        results[f"{name} batch rows/s"] = X.shape[0] / timeit(predict, X, repeat=repeat)
+    print_results(results, width=28)
+    return results
+
+
+if __name__ == "__main__":
+    parser = make_parser(__doc__)
+    parser.add_argument("--model-dir", type=Path, default=RUN_ARTIFACTS)
+    parser.add_argument("--nthread", type=int, default=None)
+    args = parser.parse_args()
+    main(args.model_dir, args.rows, args.repeat, args.nthread)
@@ -0,0 +1,61 @@
+"""
+Compare the numeric specification parser of clean_data.get_specs with the
+str.extract cleaners it replaced, on a synthetic corpus.
+
+    python -m benchmarks.bench_numeric_specs --rows 100000
+"""
+import pandas as pd
+
+from benchmarks.bench_specs import get_specs_loop
+from benchmarks.common import make_parser, print_timings, timeit
+from clean_data import NUMERIC_SPECS, get_specs
+from tests.synthetic import make_announcements
+
+
+def clean_numeric_specs_extract(column: pd.Series) -> pd.DataFrame:
+    """Previous implementation: str(value) in get_specs, then str.extract"""
+    specs = get_specs_loop(column)
+    return pd.DataFrame(
+        {
+            "location_duree": specs["location_duree"].str.extract("(\\d)")[0],
+            "superficie": specs["superficie"].str.extract("(\\d+)")[0],
+            "pieces": specs["pieces"].str.extract("(\\d{1,2})")[0],
+            "etages": specs["etages"].str.extract("(\\d{1,2})")[0],
+        }
+    ).astype("Int64")
+
+
+def clean_numeric_specs(column: pd.Series) -> pd.DataFrame:
+    return get_specs(column)[list(NUMERIC_SPECS)]
+
+
+def main(rows: int, repeat: int) -> dict:
+    data = pd.DataFrame(make_announcements(rows))
+    specs = data["specs"][data["specs"].notna()].reset_index(drop=True)
+    old = clean_numeric_specs_extract(specs)
+    new = clean_numeric_specs(specs)
+    # Both agree on a single plain number
+    for codename in NUMERIC_SPECS:
+        plain = get_specs_loop(specs)[codename].str.fullmatch("\\d")
+        plain = plain.fillna(False).astype(bool)
+        pd.testing.assert_series_equal(
+            new.loc[plain, codename], old.loc[plain, codename]
+        )
+
+    results = {
+        "str.extract": timeit(clean_numeric_specs_extract, specs, repeat=repeat),
+        "get_specs": timeit(clean_numeric_specs, specs, repeat=repeat),
+    }
+    print_timings(results, rows, width=12)
+    print(f"speedup x{results['str.extract'] / results['get_specs']:.1f}")
+    print("share of values the previous cleaners got wrong or missed:")
+    for codename in NUMERIC_SPECS:
+        changed = (new[codename] != old[codename]).fillna(True)
+        changed &= new[codename].notna() | old[codename].notna()
+        print(f"  {codename:<16} {changed.mean():6.1%}")
+    return results
+
+
+if __name__ == "__main__":
+    args = make_parser(__doc__).parse_args()
+    main(args.rows, args.repeat)
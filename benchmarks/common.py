@@ -0,0 +1,39 @@
+"""
+The harness the benchmarks share: timing a function, their command line and
+the printing of their results.
+"""
+import argparse
+import time
+
+
+def timeit(func, *args, repeat: int = 3) -> float:
+    """Best wall time of `repeat` calls"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_parser(
+    description: str, rows: int = 100_000, repeat: int | None = 3
+) -> argparse.ArgumentParser:
+    """The command line of a benchmark: --rows, and --repeat unless None"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--rows", type=int, default=rows)
+    if repeat is not None:
+        parser.add_argument("--repeat", type=int, default=repeat)
+    return parser
+
+
+def print_timings(results: dict, rows: int, width: int = 16) -> None:
+    """Print the wall time of each benchmark and its throughput on `rows` rows"""
+    for name, seconds in results.items():
+        print(f"{name:<{width}} {seconds:8.3f}s {rows / seconds:12,.0f} rows/s")
+
+
+def print_results(results: dict, width: int, spec: str = "14,.3f") -> None:
+    """Print the values of the results, formatted with `spec`"""
+    for name, value in results.items():
+        print(f"{name:<{width}} {value:{spec}}")
@@ -0,0 +1,127 @@
+"""
+A local stub of the ouedkniss GraphQL endpoint, answering the queries of
+config/pagination.graphql and config/datas.graphql with `rows` synthetic
+announcements (tests.synthetic.make_page), to crawl without the API.
+
+    python -m benchmarks.graphql_stub --rows 100000 --port 8765
+    # fetch_data(url="http://localhost:8765/graphql", ...)
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import socket
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+from tests.synthetic import make_page
+
+
+def make_app(
+    rows: int, seed: int = 42, latency: float = 0.0, cache_pages: int = 128
+) -> web.Application:
+    """
+    The stub serving `rows` announcements, each response delayed by
+    `latency` seconds. The last `cache_pages` pages served (about 2 MB each)
+    are kept rendered, the others are generated again on each request.
+    """
+
+    @functools.lru_cache(maxsize=cache_pages)
+    def render_page(page: int, count: int) -> bytes:
+        last_page = max(1, -(-rows // count))
+        data = make_page(page, count, seed)[: max(0, rows - (page - 1) * count)]
+        result = {
+            "data": {
+                "search": {
+                    "announcements": {
+                        "data": data,
+                        "paginatorInfo": {"hasMorePages": page < last_page},
+                    }
+                }
+            }
+        }
+        return json.dumps(result).encode()
+
+    async def graphql(request: web.Request) -> web.Response:
+        body = await request.json()
+        search_filter = (body.get("variables") or {}).get("filter") or {}
+        count = search_filter.get("count", 1000)
+        if latency:
+            await asyncio.sleep(latency)
+        if "lastPage" in body["query"]:
+            last_page = max(1, -(-rows // count))
+            return web.json_response(
+                {
+                    "data": {
+                        "search": {
+                            "announcements": {
+                                "paginatorInfo": {
+                                    "lastPage": last_page,
+                                    "hasMorePages": last_page > 1,
+                                }
+                            }
+                        }
+                    }
+                }
+            )
+        # The API serves the first page for the page 0 the crawls start at
+        page = max(1, search_filter.get("page", 1))
+        return web.Response(
+            body=render_page(page, count), content_type="application/json"
+        )
+
+    app = web.Application(client_max_size=2**20)
+    app.router.add_post("/graphql", graphql)
+    return app
+
+
+def run(
+    rows: int, port: int, seed: int = 42, latency: float = 0.0, cache_pages: int = 128
+) -> None:
+    web.run_app(make_app(rows, seed, latency, cache_pages), port=port, print=None)
+
+
+@contextmanager
+def serve(
+    rows: int,
+    port: int = 8765,
+    seed: int = 42,
+    latency: float = 0.0,
+    cache_pages: int = 128,
+):
+    """
+    Run the stub in a separate process, so that rendering the pages does not
+    compete with the crawl, and yield its url
+    """
+    process = multiprocessing.Process(
+        target=run, args=(rows, port, seed, latency, cache_pages), daemon=True
+    )
+    process.start()
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("localhost", port), timeout=1).close()
+                break
+            except OSError:
+                if not process.is_alive() or time.monotonic() > deadline:
+                    raise RuntimeError(f"The GraphQL stub did not start on {port}")
+                time.sleep(0.05)
+        yield f"http://localhost:{port}/graphql"
+    finally:
+        process.terminate()
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--cache-pages", type=int, default=128)
+    args = parser.parse_args()
+    run(args.rows, args.port, args.seed, args.latency, args.cache_pages)
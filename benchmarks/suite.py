@@ -0,0 +1,398 @@
+"""
+Benchmark the hot paths of the pipeline offline, on synthetic announcements
+(tests.synthetic) at 10k, 100k and 1M rows by default: crawl (from the
+local GraphQL stub), ingest, clean, feature engineering, encoding, training,
+prediction and drift. The results of a run are written as JSON, and compared
+to a previous run with --compare, which fails on the benchmarks slower by
+more than --threshold.
+
+The crawl and ingest benchmarks write to the `benchmark` database of the
+server of db.DB_PARAMS (see the POSTGRES_* variables), they are skipped when
+it is not reachable.
+
+    python -m benchmarks.suite --sizes 10000 100000
+    python -m benchmarks.suite --sizes 10000 --compare benchmarks/results/<run>.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from importlib.metadata import version
+from pathlib import Path
+
+import pandas as pd
+import psycopg
+import xgboost as xgb
+from gql import Client
+from gql.transport.aiohttp import AIOHTTPTransport
+
+from benchmarks.common import timeit
+from benchmarks.graphql_stub import serve
+from clean_data import clean_chunk, iter_chunks, write_cleaned_dataset
+from db import connection, create_database, database_params
+from drift import DriftEngine, StreamingDrift
+from encoder import ColumnEncoder
+from fetch_data import TokenBucket, crawl_pages, fetch_page_async
+from instrumentation import peak_rss_mb
+from native_model import BoosterModel
+from tests.synthetic import iter_pages
+from train_model import categorical, feature_engineering, numerical
+from utils import (
+    create_table_crawl_state,
+    create_table_rental,
+    ingest_announces,
+    load_query,
+    transform_annonce_data,
+)
+
+SIZES = [10_000, 100_000, 1_000_000]
+RESULTS_DIR = Path("benchmarks/results")
+BENCHMARK_DB = database_params("benchmark")
+QUERY_PATH = Path("config/datas.graphql")
+OPERATION_NAME = "SearchQueryWithoutFilters"
+# The pages of the API, and the chunks cleaned at once by clean_data
+PAGE_SIZE = 1000
+CHUNK_SIZE = 5000
+# Requests per second, no rate limit on the stub
+MAX_RATE = 1e9
+# Fixed parameters and rounds, for the training to do the same work each run
+TRAIN_PARAMS = {
+    "objective": "reg:squarederror",
+    "max_depth": 8,
+    "learning_rate": 0.1,
+    "min_child_weight": 1,
+    "seed": 42,
+}
+NUM_BOOST_ROUND = 100
+# The drift windows of monitoring, and the rows per streaming update
+WINDOW_SIZE = 50
+STREAM_BATCH = 1000
+NUM_REFERENCE = 2000
+# The shortest timing compared for regressions
+MIN_SECONDS = 0.1
+
+logger = logging.getLogger("benchmarks")
+
+
+def database_available() -> bool:
+    """Create the benchmark database, False if the server is not reachable"""
+    try:
+        create_database(BENCHMARK_DB)
+    except psycopg.OperationalError as e:
+        print(f"No database, the crawl and ingest benchmarks are skipped: {e}")
+        return False
+    return True
+
+
+def reset_tables() -> None:
+    with connection(BENCHMARK_DB) as conn:
+        conn.execute(create_table_rental + create_table_crawl_state)
+        conn.execute("TRUNCATE rental, crawl_state")
+
+
+class Results:
+    """The timings of a run, one entry per benchmark and size"""
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, benchmark: str, rows: int, seconds: float, **extra) -> None:
+        entry = {
+            "benchmark": benchmark,
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_second": rows / seconds,
+            "peak_rss_mb": peak_rss_mb(),
+            **extra,
+        }
+        self.entries.append(entry)
+        print(
+            f"{benchmark:<22} {rows:>10,} rows {seconds:9.3f}s"
+            f" {entry['rows_per_second']:12,.0f} rows/s"
+        )
+
+
+async def fetch_pages(url: str, pages: range, concurrency: int) -> int:
+    """Fetch and transform pages without storing them, the rows fetched"""
+    query = load_query(QUERY_PATH)
+    bucket = TokenBucket(rate=MAX_RATE, capacity=concurrency)
+    pages_left = iter(pages)
+    num_rows = 0
+
+    async def fetch(session):
+        nonlocal num_rows
+        for page in pages_left:
+            data_page = await fetch_page_async(
+                session, query, OPERATION_NAME, page, bucket
+            )
+            num_rows += len([transform_annonce_data(row) for row in data_page])
+
+    transport = AIOHTTPTransport(url=url)
+    async with Client(
+        transport=transport, fetch_schema_from_transport=False
+    ) as session:
+        await asyncio.gather(*(fetch(session) for _ in range(concurrency)))
+    return num_rows
+
+
+def bench_crawl(results: Results, rows: int, database: bool, concurrency: int):
+    """Fetch all the pages of the stub, and crawl them into the database"""
+    pages = range(1, -(-rows // PAGE_SIZE) + 1)
+    with serve(rows) as url:
+        # Once for the stub to render the pages, it keeps up to 128 of them
+        asyncio.run(fetch_pages(url, pages, concurrency))
+        start = time.perf_counter()
+        num_rows = asyncio.run(fetch_pages(url, pages, concurrency))
+        results.add(
+            "crawl_fetch",
+            num_rows,
+            time.perf_counter() - start,
+            concurrency=concurrency,
+        )
+        if not database:
+            return
+        reset_tables()
+        state = {
+            "name": "rental",
+            "status": "running",
+            "watermark": None,
+            "high_watermark": None,
+            "last_page": pages.start,
+            "last_id": None,
+        }
+        with connection(BENCHMARK_DB) as conn:
+            start = time.perf_counter()
+            totals = asyncio.run(
+                crawl_pages(
+                    conn,
+                    url,
+                    load_query(QUERY_PATH),
+                    OPERATION_NAME,
+                    pages,
+                    logger,
+                    state,
+                    concurrency=concurrency,
+                    rate=MAX_RATE,
+                )
+            )
+        results.add(
+            "crawl",
+            totals["rows"],
+            time.perf_counter() - start,
+            concurrency=concurrency,
+        )
+
+
+def bench_ingest(results: Results, rows: int) -> None:
+    """
+    Ingest the announcements page by page into an empty table, then again
+    (unchanged announcements, skipped by the upsert)
+    """
+    reset_tables()
+    for benchmark in ["ingest", "ingest_unchanged"]:
+        seconds = 0.0
+        with connection(BENCHMARK_DB) as conn:
+            for page in iter_pages(rows, PAGE_SIZE):
+                transformed = [transform_annonce_data(row) for row in page]
+                start = time.perf_counter()
+                ingest_announces(conn, transformed)
+                seconds += time.perf_counter() - start
+        results.add(benchmark, rows, seconds)
+
+
+def bench_clean(results: Results, rows: int, dataset_path: Path) -> None:
+    """
+    Clean the announcements chunk by chunk, as clean_data does, and write
+    them to the cleaned dataset
+    """
+    seconds = {"generate": 0.0, "clean": 0.0}
+
+    def cleaned_chunks():
+        records = itertools.chain.from_iterable(iter_pages(rows, PAGE_SIZE))
+        chunks = iter_chunks(records, CHUNK_SIZE)
+        while True:
+            start = time.perf_counter()
+            raw_chunk = next(chunks, None)
+            seconds["generate"] += time.perf_counter() - start
+            if raw_chunk is None:
+                return
+            start = time.perf_counter()
+            chunk = clean_chunk(raw_chunk)
+            seconds["clean"] += time.perf_counter() - start
+            yield chunk
+
+    start = time.perf_counter()
+    write_cleaned_dataset(cleaned_chunks(), dataset_path)
+    total = time.perf_counter() - start
+    results.add("clean", rows, seconds["clean"], chunk_size=CHUNK_SIZE)
+    results.add("clean_write", rows, total - seconds["generate"] - seconds["clean"])
+
+
+def bench_model(results: Results, rows: int, dataset_path: Path, repeat: int):
+    """
+    Feature engineering on the cleaned dataset, then encoding, training,
+    prediction and drift on its output, split as prepare_data does
+    """
+    start = time.perf_counter()
+    data, _ = feature_engineering.fn(dataset_path)
+    results.add("feature_engineering", rows, time.perf_counter() - start)
+
+    columns = categorical + numerical
+    num_train = int(0.8 * len(data))
+    train, valid = data[:num_train], data[num_train:]
+    start = time.perf_counter()
+    encoder = ColumnEncoder.fit(train, columns)
+    results.add("encoding_fit", len(train), time.perf_counter() - start)
+    seconds = timeit(encoder.transform, data[columns], repeat=repeat)
+    results.add("encoding_transform", len(data), seconds)
+
+    X_train = encoder.transform(train)
+    start = time.perf_counter()
+    booster = xgb.train(
+        TRAIN_PARAMS,
+        xgb.DMatrix(X_train, label=train["price"].to_numpy()),
+        num_boost_round=NUM_BOOST_ROUND,
+    )
+    results.add(
+        "training",
+        len(train),
+        time.perf_counter() - start,
+        num_boost_round=NUM_BOOST_ROUND,
+    )
+
+    model = BoosterModel(encoder, booster)
+    seconds = timeit(model.predict, data[columns], repeat=repeat)
+    results.add("prediction", len(data), seconds)
+
+    data = data.assign(price_pred=model.predict(data[columns]))
+    reference = valid[:NUM_REFERENCE].assign(
+        price_pred=model.predict(valid[:NUM_REFERENCE][columns])
+    )
+    engine = DriftEngine(reference, numerical, categorical, "price_pred")
+    seconds = timeit(engine.window_metrics, data, WINDOW_SIZE, repeat=repeat)
+    results.add("drift_windows", len(data), seconds, window_size=WINDOW_SIZE)
+
+    def stream(data):
+        monitor = StreamingDrift(
+            reference,
+            numerical,
+            categorical,
+            "price_pred",
+            window=pd.Timedelta(hours=24),
+            bucket=pd.Timedelta(minutes=10),
+        )
+        for start in range(0, len(data), STREAM_BATCH):
+            batch = data[start : start + STREAM_BATCH]
+            monitor.update(batch, batch["createdAt"])
+            monitor.metrics()
+
+    seconds = timeit(stream, data, repeat=repeat)
+    results.add("drift_streaming", len(data), seconds, batch_size=STREAM_BATCH)
+
+
+def run_metadata(sizes: list, database: bool) -> dict:
+    """What the timings depend on: the code, the machine and the libraries"""
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": {
+            package: version(package)
+            for package in ["numpy", "pandas", "pyarrow", "xgboost", "psycopg"]
+        },
+        "sizes": sizes,
+        "database": database,
+    }
+
+
+def compare(previous: dict, current: dict, threshold: float) -> list:
+    """
+    Print the change of throughput of the benchmarks of both runs, and
+    return the ones slower by more than `threshold` (the timings shorter
+    than MIN_SECONDS are too noisy to tell)
+    """
+    before = {
+        (entry["benchmark"], entry["rows"]): entry for entry in previous["results"]
+    }
+    regressions = []
+    print(
+        f"\nCompared to {previous['meta']['commit']} ({previous['meta']['started_at']})"
+    )
+    for entry in current["results"]:
+        old = before.get((entry["benchmark"], entry["rows"]))
+        if old is None:
+            continue
+        ratio = entry["rows_per_second"] / old["rows_per_second"]
+        regressed = ratio < 1 - threshold and entry["seconds"] >= MIN_SECONDS
+        if regressed:
+            regressions.append(entry)
+        print(
+            f"{entry['benchmark']:<22} {entry['rows']:>10,} rows"
+            f" {old['rows_per_second']:12,.0f} -> {entry['rows_per_second']:12,.0f}"
+            f" rows/s x{ratio:.2f}{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main(
+    sizes: list,
+    output: Path,
+    concurrency: int,
+    repeat: int,
+    database: bool,
+) -> dict:
+    database = database and database_available()
+    run = {"meta": run_metadata(sizes, database), "results": []}
+    for rows in sizes:
+        print(f"\n{rows:,} announcements")
+        results = Results()
+        if database:
+            bench_ingest(results, rows)
+        bench_crawl(results, rows, database, concurrency)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dataset_path = Path(tmp_dir) / "1_cleaned_data"
+            bench_clean(results, rows, dataset_path)
+            bench_model(results, rows, dataset_path, repeat)
+        run["results"].extend(results.entries)
+
+    output.mkdir(parents=True, exist_ok=True)
+    name = f"{datetime.now():%Y%m%dT%H%M%S}"
+    if run["meta"]["commit"] is not None:
+        name = f"{name}-{run['meta']['commit']}"
+    path = output / f"{name}.json"
+    with open(path, "w") as f_out:
+        json.dump(run, f_out, indent=2)
+    print(f"\nResults written to {path}")
+    return run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-database", dest="database", action="store_false")
+    parser.add_argument("--compare", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+    run = main(args.sizes, args.output, args.concurrency, args.repeat, args.database)
+    if args.compare is not None:
+        with open(args.compare) as f_in:
+            regressions = compare(json.load(f_in), run, args.threshold)
+        sys.exit(1 if regressions else 0)
@@ -1,8 +1,27 @@
+import functools
 import json
+import multiprocessing
+import operator
+import shutil
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
 from pathlib import Path
+from typing import Iterable, Iterator
 
+import ijson
 import pandas as pd
-from prefect import flow
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from prefect import flow, get_run_logger, task
+from psycopg.rows import dict_row
+
+from db import connection
+from instrumentation import instrument, instrument_flow
+from utils import create_table_crawl_state, get_crawl_state, save_crawl_state
 
 
 def get_commune(x: list):
@@ -32,46 +51,90 @@ def get_medias(column: pd.Series) -> pd.Series:
     In this dataset medias means urls of the announcements.
     We create a new column containing a list of available urls
     """
-
-    media_all = []
-    for index, _ in column.items():
-        media_raw = []
-        for _, media in enumerate(column.loc[index]):
-            try:
-                media_raw.append(media["mediaUrl"])
-            except Exception as e:
-                print(f"thre is an erreur of type {e}")
-                media_raw.append(None)
-        media_all.append(media_raw)
-    return pd.Series(media_all)
-
-
+    return pd.Series(
+        [
+            [media.get("mediaUrl") for media in medias] if medias else []
+            for medias in column
+        ],
+        index=column.index,
+    )
+
+
+# Numeric specifications are parsed once, with pyarrow compute, straight from
+# the raw values: "RDC" is the ground floor, a range ("3-5") keeps its lower
+# bound, thousand separators are dropped ("1 200 m²") and a duration in years
+# is converted to months ("1 an")
+NUMBER_PATTERN = r"(?P<number>\d{1,3}(?:[ .\x{a0}]\d{3})+\b|\d{1,9})"
+NUMERIC_SPECS = {
+    "location_duree": r"(?i)" + NUMBER_PATTERN + r"\s*(?P<year>ans?\b|ann[ée]es?)?",
+    "superficie": NUMBER_PATTERN,
+    "pieces": NUMBER_PATTERN,
+    "etages": r"(?i)(?P<rdc>rdc|rez)|" + NUMBER_PATTERN,
+}
+
+
+def parse_numeric_spec(values: list, codename: str) -> pa.Array:
+    """Parse the raw values of a numeric specification into an int64 array"""
+    groups = pc.extract_regex(
+        pa.array(values, type=pa.string()), NUMERIC_SPECS[codename]
+    )
+
+    def group(name):
+        index = groups.type.get_field_index(name)
+        return pc.struct_field(groups, [index]) if index >= 0 else None
+
+    number = pc.replace_substring_regex(group("number"), r"\D", "")
+    number = pc.cast(
+        pc.if_else(pc.equal(number, ""), pa.scalar(None, pa.string()), number),
+        pa.int64(),
+    )
+    if (year := group("year")) is not None:
+        number = pc.if_else(pc.equal(year, ""), number, pc.multiply(number, 12))
+    if (rdc := group("rdc")) is not None:
+        number = pc.if_else(pc.equal(rdc, ""), number, 0)
+    return number
+
+
+@instrument(rows="column")
 def get_specs(column: pd.Series) -> pd.DataFrame:
     """
     Extract the following specification from the column "specs" :
     location_duree, superficie,	pieces,	asset-in-a-promotional-site,
     property-specification, papers,	etages	sale-by-real-estate-agent,
     property-payment-conditions
-    """
 
+    The specs are read in a single pass into one dict per announcement
+    (one column per codename), aligned on the index of `column`. The
+    NUMERIC_SPECS are returned already parsed, as Int64 columns. A columnar
+    builder on pyarrow (benchmarks/bench_specs.py) is slower: converting the
+    specs dicts to Arrow costs more than this pass.
+    """
     specs_all = []
-    # Loop on all rows
-    for index, _ in column.items():
+    numeric = {codename: [None] * len(column) for codename in NUMERIC_SPECS}
+    for i, specs in enumerate(column):
         specs_raw = {}
-        if column.loc[index] is not None:
-            for i, spec in enumerate(column.loc[index]):
-                label = spec["specification"]["codename"]
-                try:
-                    value = spec["value"]
-                    if len(value) == 1:
-                        value = value[0]
-                except Exception as e:
-                    print(f"thre is an erreur of type {e}")
-                    value = None
-                # TODO: améliorer la prise en charge str(value)
-                specs_raw[label] = str(value)
-            specs_all.append(specs_raw)
-    return pd.DataFrame(specs_all)
+        for spec in specs or ():
+            codename = spec["specification"]["codename"]
+            value = spec.get("value")
+            if codename in numeric:
+                # The first value, as the previous cleaners read it
+                if value:
+                    numeric[codename][i] = str(value[0])
+                continue
+            if value is not None and len(value) == 1:
+                value = value[0]
+            # TODO: améliorer la prise en charge str(value)
+            specs_raw[codename] = value if type(value) is str else str(value)
+        specs_all.append(specs_raw)
+    data = pd.DataFrame(specs_all, index=column.index)
+    for codename, values in numeric.items():
+        data[codename] = pd.Series(
+            parse_numeric_spec(values, codename)
+            .to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+            .array,
+            index=column.index,
+        )
+    return data
 
 
 def clean_priceType(priceType: pd.Series) -> pd.Series:
@@ -115,18 +178,18 @@ def clean_commune(commune: pd.Series) -> pd.Series:
 
 
 def clean_location_duree(location_duree: pd.Series) -> pd.Series:
-    """Convert to a int"""
-    return location_duree.str.extract("(\\d)").astype("Int64")
+    """Already parsed to months by get_specs"""
+    return location_duree.astype("Int64")
 
 
 def clean_superficie(superficie: pd.Series) -> pd.Series:
-    """Convert to int ...."""
-    return superficie.str.extract("(\\d+)").astype("Int64")
+    """Already parsed to int by get_specs"""
+    return superficie.astype("Int64")
 
 
 def clean_pieces(pieces: pd.Series) -> pd.Series:
-    """Convert to int and ..."""
-    return pieces.str.extract("(\\d{1,2})").astype("Int64")
+    """Already parsed to int by get_specs"""
+    return pieces.astype("Int64")
 
 
 def clean_asset_in_a_promotional_site(
@@ -151,9 +214,8 @@ def clean_papers(papers: pd.Series) -> pd.Series:
 
 
 def clean_etages(etages: pd.Series) -> pd.Series:
-    """Convert to integer and keep only digits"""
-    # TODO: prendre en compte RDC
-    return etages.str.extract("(\\d{1,2})").astype("Int64")
+    """Already parsed to int by get_specs, the RDC being 0"""
+    return etages.astype("Int64")
 
 
 def clean_sale_by_real_estate_agent(
@@ -186,21 +248,76 @@ def clean_price(price: pd.Series) -> pd.Series:
     return price
 
 
-@flow()
-def clean_data(raw_data_path=Path("data/0_raw_data.json")) -> pd.DataFrame:
-    """Preprocesses the data of announcements.
-
-    Args:
-        data: Raw data.
-    Returns:
-        data: Intermediate data as a table
-
+JOBS = {
+    "priceType": clean_priceType,
+    "priceUnit": clean_priceUnit,
+    "id": clean_id,
+    "category": clean_category,
+    "createdAt": clean_createdAt,
+    "slug": clean_slug,
+    "wilaya": clean_wilaya,
+    "commune": clean_commune,
+    "location_duree": clean_location_duree,
+    "superficie": clean_superficie,
+    "pieces": clean_pieces,
+    "asset-in-a-promotional-site": clean_asset_in_a_promotional_site,
+    "property-specifications": clean_property_specifications,
+    "papers": clean_papers,
+    "etages": clean_etages,
+    "sale-by-real-estate-agent": clean_sale_by_real_estate_agent,
+    "property-payment-conditions": clean_property_payment_conditions,
+    "medias": clean_medias,
+    "description": clean_description,
+    "price": clean_price,
+}
+
+# Every chunk written by the streaming mode is converted to this schema, so
+# that row groups stay compatible whatever values a chunk happens to hold
+category_type = pa.dictionary(pa.int32(), pa.string())
+CLEANED_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("category", category_type),
+        ("slug", pa.string()),
+        ("description", pa.string()),
+        ("price", pa.float64()),
+        ("priceType", category_type),
+        ("priceUnit", category_type),
+        ("wilaya", category_type),
+        ("commune", category_type),
+        ("createdAt", pa.timestamp("ns", tz="UTC")),
+        ("likeCount", pa.int64()),
+        ("isFromStore", pa.bool_()),
+        ("store", pa.string()),
+        ("location_duree", pa.int64()),
+        ("superficie", pa.int64()),
+        ("pieces", pa.int64()),
+        ("asset-in-a-promotional-site", pa.bool_()),
+        ("property-specifications", category_type),
+        ("papers", category_type),
+        ("etages", pa.int64()),
+        ("sale-by-real-estate-agent", pa.bool_()),
+        ("property-payment-conditions", category_type),
+        ("medias", pa.list_(pa.string())),
+    ]
+)
+
+# The cleaned data is a parquet dataset partitioned by month of createdAt and
+# wilaya (data/1_cleaned_data/month=2023-08/wilaya=Alger/part-....parquet),
+# readers only open the partitions and columns they need
+PARTITIONING = ds.partitioning(
+    pa.schema([("month", pa.string()), ("wilaya", pa.string())]), flavor="hive"
+)
+DATASET_SCHEMA = CLEANED_SCHEMA.set(
+    CLEANED_SCHEMA.get_field_index("wilaya"), pa.field("wilaya", pa.string())
+).append(pa.field("month", pa.string()))
+
+
+def extract_columns(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Flatten raw announcements (one per row of `data`) into one column per
+    field and per specification
     """
-    # Convert Data, which is a list of lists, into one flatten list
-    with open(raw_data_path, "r") as json_file:
-        raw_data = json.load(json_file)
-
-    data = pd.DataFrame([item for sublist in raw_data for item in sublist])
     # Convert each raw of 'category', which is a dict
     # (eg : {"name": "Appartement"}) , to a sting  (eg :"Appartement")
     category = data["category"].apply(lambda x: x["name"])
@@ -233,34 +350,390 @@ def clean_data(raw_data_path=Path("data/0_raw_data.json")) -> pd.DataFrame:
             store,
         ]
     ).T
-    data = df.join(specs)
-
-    jobs = {
-        "priceType": clean_priceType,
-        "priceUnit": clean_priceUnit,
-        "id": clean_id,
-        "category": clean_category,
-        "createdAt": clean_createdAt,
-        "slug": clean_slug,
-        "wilaya": clean_wilaya,
-        "commune": clean_commune,
-        "location_duree": clean_location_duree,
-        "superficie": clean_superficie,
-        "pieces": clean_pieces,
-        "asset-in-a-promotional-site": clean_asset_in_a_promotional_site,
-        "property-specifications": clean_property_specifications,
-        "papers": clean_papers,
-        "etages": clean_etages,
-        "sale-by-real-estate-agent": clean_sale_by_real_estate_agent,
-        "property-payment-conditions": clean_property_payment_conditions,
-        "medias": clean_medias,
-        "description": clean_description,
-        "price": clean_price,
-    }
-
-    for column, func in jobs.items():
+    return df.join(specs)
+
+
+def clean_columns(data: pd.DataFrame) -> pd.DataFrame:
+    """Apply the cleaner of each column"""
+    for column, func in JOBS.items():
         data[column] = func(data[column])
-    data.to_parquet("data/1_cleaned_data.parquet")
+    return data
+
+
+def iter_raw_announcements(raw_data_path: Path) -> Iterator[dict]:
+    """
+    Yield the announcements of a raw dump one by one, without loading it.
+
+    The dump is either the JSON list of pages written by the fetch step
+    (parsed incrementally with ijson) or, for a `.jsonl` file, one page or
+    one announcement per line.
+    """
+    with open(raw_data_path, "rb") as f:
+        if Path(raw_data_path).suffix == ".jsonl":
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield from record if isinstance(record, list) else [record]
+        else:
+            yield from ijson.items(f, "item.item", use_float=True)
+
+
+select_rental_sql = """
+    SELECT id, category_name, slug, description, price, price_type, price_unit,
+        region_name, city_name, created_at, like_count, is_from_store,
+        store_slug, specs, media_url::text[] AS media_url, content_hash, updated_at
+    FROM rental
+"""
+
+
+def iter_rental_rows(
+    conn,
+    since: datetime | None = None,
+    last_id: int | None = None,
+    batch_size: int = 5000,
+) -> Iterator[list]:
+    """
+    Stream the rows of the rental table written after the (updated_at, id)
+    of the last row read, `since` and `last_id` (all rows when None), in
+    batches, through a server side cursor. The rows an upsert rewrote, as an
+    edited annonce keeping its created_at, are read again.
+    """
+    query = select_rental_sql
+    if since is not None:
+        query += " WHERE (updated_at, id) > (%(since)s, %(last_id)s)"
+    query += " ORDER BY updated_at, id"
+    with conn.transaction(), conn.cursor(
+        name="clean_data_rental", row_factory=dict_row
+    ) as curr:
+        curr.itersize = batch_size
+        curr.execute(query, {"since": since, "last_id": last_id})
+        while rows := curr.fetchmany(batch_size):
+            yield rows
+
+
+def rental_rows_to_raw(rows: list) -> pd.DataFrame:
+    """
+    Rebuild the layout of the raw announcements from rows of the rental
+    table, so that they go through the same extraction and cleaning
+    """
+    return pd.DataFrame(
+        [
+            {
+                "id": row["id"],
+                "category": {"name": row["category_name"]},
+                "slug": row["slug"],
+                "description": row["description"],
+                "price": row["price"],
+                "priceType": row["price_type"],
+                "priceUnit": row["price_unit"],
+                "cities": [
+                    {"name": row["city_name"], "region": {"name": row["region_name"]}}
+                ],
+                "createdAt": row["created_at"].isoformat(timespec="milliseconds") + "Z"
+                if row["created_at"]
+                else None,
+                # The table stores NULL instead of 0 / False
+                "likeCount": row["like_count"] or 0,
+                "isFromStore": bool(row["is_from_store"]),
+                "store": {"slug": row["store_slug"]} if row["store_slug"] else None,
+                "medias": [{"mediaUrl": url} for url in row["media_url"] or []],
+                "specs": row["specs"],
+            }
+            for row in rows
+        ]
+    )
+
+
+def iter_chunks(records: Iterable[dict], chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Group raw announcements in DataFrames of `chunk_size` rows"""
+    records = iter(records)
+    while chunk := list(islice(records, chunk_size)):
+        yield pd.DataFrame(chunk)
+
+
+@instrument(rows="raw_chunk")
+def clean_chunk(raw_chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Extract and clean a chunk of raw announcements with the columns of
+    CLEANED_SCHEMA, whichever specifications the chunk contains
+    """
+    data = extract_columns(raw_chunk).reindex(columns=CLEANED_SCHEMA.names)
+    return clean_columns(data)
+
+
+def clean_chunks(
+    chunks: Iterable[pd.DataFrame], n_workers: int = 1
+) -> Iterator[pd.DataFrame]:
+    """
+    Clean raw chunks, in order, in a pool of `n_workers` processes when there
+    is more than one. At most two chunks per worker are in flight, so that a
+    streamed dump is not read faster than it is cleaned. The chunks are
+    pickled to the workers, so this pays off with several cores only.
+    """
+    if n_workers <= 1:
+        yield from map(clean_chunk, chunks)
+        return
+    with ProcessPoolExecutor(n_workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(clean_chunk, chunk))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Raw announcements shared with the cleaning workers. They are inherited by
+# fork instead of being pickled with every shard, which costs more than the
+# cleaning itself for nested records
+_raw_records: list = []
+
+
+def _share_records(records: list) -> None:
+    global _raw_records
+    _raw_records = records
+
+
+def clean_shard(shard: slice) -> pd.DataFrame:
+    """Extract and clean a shard of the raw announcements shared with a worker"""
+    return clean_chunk(pd.DataFrame(_raw_records[shard]))
+
+
+def clean_records(
+    records: list, n_workers: int, shard_size: int | None = None
+) -> pd.DataFrame:
+    """
+    Extract and clean raw announcements in a pool of `n_workers` processes,
+    split in shards of `shard_size` announcements (a few per worker by
+    default), and concatenate the cleaned shards.
+    """
+    shard_size = shard_size or -(-len(records) // (4 * n_workers)) or 1
+    shards = [slice(i, i + shard_size) for i in range(0, len(records), shard_size)]
+    fork = "fork" in multiprocessing.get_all_start_methods()
+    with ProcessPoolExecutor(
+        n_workers,
+        mp_context=multiprocessing.get_context("fork") if fork else None,
+        initializer=_share_records,
+        initargs=(records,),
+    ) as pool:
+        return concat_cleaned(pool.map(clean_shard, shards))
+
+
+def concat_cleaned(chunks: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate cleaned chunks. Each categorical column is given the sorted
+    union of its categories in every chunk first, otherwise pandas falls back
+    to object for the columns whose categories differ between chunks.
+    """
+    chunks = list(chunks)
+    for column in CLEANED_SCHEMA.names:
+        if pa.types.is_dictionary(CLEANED_SCHEMA.field(column).type):
+            categories = sorted(
+                set().union(*(chunk[column].cat.categories for chunk in chunks))
+            )
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def to_dataset_table(chunk: pd.DataFrame) -> pa.Table:
+    """Convert a cleaned chunk to DATASET_SCHEMA, with its partition keys"""
+    chunk = chunk.assign(
+        wilaya=chunk["wilaya"].astype("string"),
+        month=chunk["createdAt"].dt.strftime("%Y-%m"),
+    )
+    return pa.Table.from_pandas(chunk, schema=DATASET_SCHEMA, preserve_index=False)
+
+
+def write_cleaned_dataset(
+    chunks: Iterable[pd.DataFrame], dataset_path: Path, append: bool = False
+) -> int:
+    """
+    Write cleaned chunks to the partitioned dataset and return the number of
+    rows written.
+
+    Each run adds one file per partition it touches. Unless `append`, the
+    dataset is written next to the previous one and swapped in at the end.
+    """
+    dataset_path = Path(dataset_path)
+    target = dataset_path
+    if not append:
+        target = dataset_path.with_name(f"{dataset_path.name}.tmp")
+        shutil.rmtree(target, ignore_errors=True)
+    num_rows = 0
+
+    def batches():
+        nonlocal num_rows
+        for chunk in chunks:
+            num_rows += len(chunk)
+            yield from to_dataset_table(chunk).to_batches()
+
+    ds.write_dataset(
+        batches(),
+        target,
+        schema=DATASET_SCHEMA,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    if not append:
+        shutil.rmtree(dataset_path, ignore_errors=True)
+        target.rename(dataset_path)
+    return num_rows
+
+
+def read_cleaned_data(
+    path=Path("data/1_cleaned_data"),
+    columns: list | None = None,
+    since: datetime | None = None,
+    wilayas: list | None = None,
+) -> pd.DataFrame:
+    """
+    Read cleaned announcements, opening only the partitions and columns needed.
+
+    An announcement cleaned by several incremental runs is kept once, in its
+    most recent version among the loaded partitions.
+
+    Args:
+        path: The cleaned dataset, or a parquet file written by older runs
+        columns: The columns to load, all of them when None
+        since: Only load announcements refreshed from this date
+        wilayas: Only load announcements of these wilayas
+
+    Returns:
+        data: The cleaned announcements
+    """
+    partitioning = PARTITIONING if Path(path).is_dir() else None
+    dataset = ds.dataset(path, format="parquet", partitioning=partitioning)
+    filters = []
+    if since is not None:
+        since = pd.Timestamp(since)
+        since = since.tz_localize("UTC") if since.tzinfo is None else since
+        filters.append(ds.field("createdAt") >= since.tz_convert("UTC"))
+        if partitioning is not None:
+            filters.append(ds.field("month") >= since.strftime("%Y-%m"))
+    if wilayas is not None:
+        filters.append(ds.field("wilaya").isin(list(wilayas)))
+    load = None
+    if columns is not None:
+        load = list(dict.fromkeys(list(columns) + ["id", "createdAt"]))
+    table = dataset.to_table(
+        columns=load,
+        filter=None if not filters else functools.reduce(operator.and_, filters),
+    )
+    data = table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    data = data.sort_values("createdAt", kind="stable")
+    data = data.drop_duplicates("id", keep="last").reset_index(drop=True)
+    if "wilaya" in data.columns:
+        data["wilaya"] = data["wilaya"].astype("category")
+    return data[CLEANED_SCHEMA.names if columns is None else list(columns)]
+
+
+@task(name="Clean the rental table")
+@instrument()
+def clean_rental_table(
+    conn, output_path: Path, batch_size: int, incremental: bool, n_workers: int = 1
+) -> int:
+    """
+    Clean the rows of the rental table, streamed from a server side cursor.
+
+    In incremental mode only the rows written since the last cleaned
+    snapshot are appended to the dataset. The (updated_at, id) of the last
+    row cleaned is kept in the crawl_state table under the name `clean_data`.
+    """
+    logger = get_run_logger()
+    conn.execute(create_table_crawl_state)
+    state = get_crawl_state(conn, "clean_data") if incremental else None
+    since = state["watermark"] if state is not None else None
+    # The states saved before last_id was kept, a strict updated_at bound
+    last_id = state["last_id"] if state is not None else None
+    logger.info(f"Cleaning the rental rows written after {since}, {last_id}")
+
+    position = {"watermark": since, "last_id": last_id}
+
+    def raw_chunks():
+        for rows in iter_rental_rows(conn, since, last_id, batch_size):
+            # The rows without updated_at come last, and are not kept track of
+            last = next((row for row in reversed(rows) if row["updated_at"]), None)
+            if last is not None:
+                position.update(watermark=last["updated_at"], last_id=last["id"])
+            yield rental_rows_to_raw(rows)
+
+    num_rows = write_cleaned_dataset(
+        clean_chunks(raw_chunks(), n_workers), output_path, append=since is not None
+    )
+    save_crawl_state(
+        conn,
+        {
+            "name": "clean_data",
+            "status": "done",
+            "watermark": position["watermark"],
+            "high_watermark": position["watermark"],
+            "last_page": None,
+            "last_id": position["last_id"],
+        },
+    )
+    logger.info(f"{num_rows} announcements cleaned into {output_path}")
+    return num_rows
+
+
+@flow()
+@instrument_flow
+def clean_data(
+    raw_data_path=Path("data/0_raw_data.json"),
+    output_path=Path("data/1_cleaned_data"),
+    chunk_size: int | None = None,
+    db_params: dict | None = None,
+    incremental: bool = False,
+    n_workers: int = 1,
+) -> pd.DataFrame:
+    """Preprocesses the data of announcements.
+
+    Args:
+        data: Raw data.
+        output_path: The cleaned parquet dataset, partitioned by month and
+            wilaya. Only the columns of CLEANED_SCHEMA are kept.
+        chunk_size: When set, the raw dump is streamed and cleaned
+            `chunk_size` announcements at a time, so memory does not grow
+            with the size of the dump.
+        db_params: When set, the announcements are read from the rental
+            table of this database instead of the raw dump, in batches of
+            `chunk_size` (5000 by default) rows.
+        incremental: With `db_params`, only append the rows written since
+            the previous incremental run to the dataset.
+        n_workers: Number of processes extracting and cleaning the
+            announcements, the dump being split in shards (or in chunks when
+            streamed) between them.
+    Returns:
+        data: Intermediate data as a table
+
+    """
+    if db_params is not None:
+        with connection(db_params) as conn:
+            clean_rental_table(
+                conn, output_path, chunk_size or 5000, incremental, n_workers
+            )
+        return None
+
+    if chunk_size is not None:
+        logger = get_run_logger()
+        chunks = iter_chunks(iter_raw_announcements(raw_data_path), chunk_size)
+        num_rows = write_cleaned_dataset(clean_chunks(chunks, n_workers), output_path)
+        logger.info(f"{num_rows} announcements cleaned into {output_path}")
+        return None
+
+    # Convert Data, which is a list of lists, into one flatten list
+    with open(raw_data_path, "r") as json_file:
+        raw_data = json.load(json_file)
+
+    if n_workers > 1:
+        records = [item for sublist in raw_data for item in sublist]
+        data = clean_records(records, n_workers)
+    else:
+        data = pd.DataFrame([item for sublist in raw_data for item in sublist])
+        data = clean_columns(extract_columns(data))
+    write_cleaned_dataset([data], output_path)
     return None
 
 
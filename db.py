@@ -0,0 +1,91 @@
+"""
+Connections to the PostgreSQL databases of the project.
+
+Each database gets one psycopg_pool.ConnectionPool per process, opened on
+first use: the flows, their tasks and the monitoring take warm connections
+from it instead of connecting on each call. The pooled connections are in
+autocommit mode and are checked before being handed out. The ingest and
+upsert statements are prepared server side on their first run
+(`execute(..., prepare=True)`), the others after psycopg's default of 5 runs.
+"""
+import atexit
+import os
+import threading
+
+import psycopg
+from psycopg import sql
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import ConnectionPool
+
+# The server, configurable from the environment (as in Docker-compose.yml)
+DB_PARAMS = {
+    "host": os.getenv("POSTGRES_HOST", "localhost"),
+    "port": os.getenv("POSTGRES_PORT", "5432"),
+    "user": os.getenv("POSTGRES_USER", "postgres"),
+    "password": os.getenv("POSTGRES_PASSWORD", "example"),
+    "dbname": os.getenv("POSTGRES_DB", "realestate"),
+}
+# The size of each pool
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 4))
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def database_params(dbname: str) -> dict:
+    """The connection parameters of another database of the server"""
+    return {**DB_PARAMS, "dbname": dbname}
+
+
+def get_pool(db_params: dict = DB_PARAMS) -> ConnectionPool:
+    """The pool of connections to a database, opened on first use"""
+    conninfo = make_conninfo(**db_params)
+    with _lock:
+        if conninfo not in _pools:
+            _pools[conninfo] = ConnectionPool(
+                conninfo,
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                kwargs={"autocommit": True},
+                check=ConnectionPool.check_connection,
+                name=db_params["dbname"],
+                open=True,
+            )
+        return _pools[conninfo]
+
+
+def connection(db_params: dict = DB_PARAMS, timeout: float | None = None):
+    """
+    A connection of the pool of a database, to use in a `with` block which
+    gives it back to the pool. Waits `timeout` seconds at most (30 by
+    default) for a connection.
+    """
+    return get_pool(db_params).connection(timeout=timeout)
+
+
+def create_database(db_params: dict = DB_PARAMS) -> bool:
+    """Create the database of `db_params` if it does not exist, True if created"""
+    # CREATE DATABASE runs from the maintenance database, outside the pools
+    with psycopg.connect(
+        **{**db_params, "dbname": "postgres"}, autocommit=True
+    ) as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM pg_database WHERE datname = %s", (db_params["dbname"],)
+        ).fetchone()
+        if exists is None:
+            conn.execute(
+                sql.SQL("CREATE DATABASE {}").format(
+                    sql.Identifier(db_params["dbname"])
+                )
+            )
+        return exists is None
+
+
+@atexit.register
+def close_pools() -> None:
+    """Close the pools of the process"""
+    with _lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,487 @@
+"""
+Drift metrics of many windows at once, with the statistical tests Evidently
+(0.4.1) chooses by default, so that they can replace one Report per window.
+
+The reference side of each test (sorted values, value counts, quantiles) is
+computed once, and each test runs with NumPy over all the windows together.
+
+StreamingDrift keeps the same metrics over a sliding time window of streamed
+rows, from histograms on bins of the reference updated row by row.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+import scipy.special
+import scipy.stats
+
+# The thresholds of the Evidently tests: p-values under (or at, for ks) the
+# threshold and distances from the threshold on are drifts
+P_VALUE_THRESHOLD = 0.05
+DISTANCE_THRESHOLD = 0.1
+# Above this many reference rows, Evidently uses distances instead of tests
+MAX_ROWS_FOR_TESTS = 1000
+# Numerical columns with this many values at most are tested as categories
+MAX_VALUES_AS_CATEGORIES = 5
+PSI_BINS = 10
+
+
+def to_windows(values: np.ndarray, window_size: int, fill) -> np.ndarray:
+    """Cut `values` in rows of `window_size`, the last one padded with `fill`"""
+    num_windows = -(-len(values) // window_size)
+    windows = np.full(num_windows * window_size, fill, dtype=values.dtype)
+    windows[: len(values)] = values
+    return windows.reshape(num_windows, window_size)
+
+
+def numeric_values(column: pd.Series) -> np.ndarray:
+    """The values of a column as floats, the missing and infinite ones NaN"""
+    # A copy, to_numpy may return a view of the column
+    values = column.to_numpy(dtype="float64", na_value=np.nan, copy=True)
+    values[np.isinf(values)] = np.nan
+    return values
+
+
+def missing_cells(column: pd.Series) -> np.ndarray:
+    """
+    The missing cells of a column: null, infinite or empty strings, as
+    DatasetMissingValuesMetric counts them
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        return ~np.isfinite(column.to_numpy(dtype="float64", na_value=np.nan))
+    return (column.isna() | (column.astype(object) == "")).to_numpy()
+
+
+def share_missing(data: pd.DataFrame, window_size: int) -> np.ndarray:
+    """Share of the missing cells of each window"""
+    missing = np.zeros(len(data))
+    for _, column in data.items():
+        missing += missing_cells(column)
+    counts = to_windows(missing, window_size, 0).sum(axis=1)
+    rows = to_windows(np.ones(len(data)), window_size, 0).sum(axis=1)
+    return counts / (rows * data.shape[1])
+
+
+def ks_statistic(reference: np.ndarray, windows: np.ndarray, sizes: np.ndarray):
+    """
+    The two-sample Kolmogorov-Smirnov statistic of the sorted `reference` and
+    of each sorted row of `windows` of `sizes` values, as scipy.stats.ks_2samp
+    computes it
+    """
+    positions = np.arange(windows.shape[1])
+    present = positions < sizes[:, None]
+    # Count of the window values lower than, and lower or equal to each value
+    equal_previous = np.zeros(windows.shape, dtype=bool)
+    equal_previous[:, 1:] = windows[:, 1:] == windows[:, :-1]
+    below = np.maximum.accumulate(np.where(equal_previous, 0, positions), axis=1)
+    equal_next = np.zeros(windows.shape, dtype=bool)
+    equal_next[:, :-1] = equal_previous[:, 1:]
+    up_to = np.where(equal_next, windows.shape[1], positions + 1)
+    up_to = np.minimum.accumulate(up_to[:, ::-1], axis=1)[:, ::-1]
+    # The difference of the two cdfs at each window value, and just before it
+    # (at the last reference value under it): its extrema are among these
+    num_reference = len(reference)
+    at = (
+        np.searchsorted(reference, windows, side="right") / num_reference
+        - up_to / sizes[:, None]
+    )
+    before = (
+        np.searchsorted(reference, windows, side="left") / num_reference
+        - below / sizes[:, None]
+    )
+    max_diff = np.maximum(
+        np.where(present, at, -np.inf).max(axis=1),
+        np.where(present, before, -np.inf).max(axis=1),
+    )
+    min_diff = np.clip(-np.where(present, at, np.inf).min(axis=1), 0, 1)
+    return np.maximum(max_diff, min_diff)
+
+
+def sorted_windows(windows: np.ndarray):
+    """
+    Sort each row of `windows` (NaN being absent, last), with the mask of the
+    present values and of the first of each run of equal values
+    """
+    windows = np.sort(windows, axis=1)
+    sizes = (~np.isnan(windows)).sum(axis=1)
+    present = np.arange(windows.shape[1]) < sizes[:, None]
+    equal_previous = np.zeros(windows.shape, dtype=bool)
+    equal_previous[:, 1:] = windows[:, 1:] == windows[:, :-1]
+    return windows, sizes, present, present & ~equal_previous
+
+
+def category_counts(codes: np.ndarray, num_keys: int) -> np.ndarray:
+    """Counts of each code (-1 being absent) in each row of `codes`"""
+    rows = np.broadcast_to(np.arange(len(codes))[:, None], codes.shape)
+    present = codes >= 0
+    counts = np.bincount(
+        rows[present] * num_keys + codes[present], minlength=len(codes) * num_keys
+    )
+    return counts.reshape(len(codes), num_keys)
+
+
+class ColumnDrift:
+    """
+    The reference side of the drift tests of a column, and the tests of
+    windows of the same column. `kind` is "num" or "cat", as in Evidently.
+    """
+
+    def __init__(self, reference: pd.Series, kind: str, num_stattest: str = None):
+        self.kind = kind
+        self.num_stattest = num_stattest
+        if kind == "num":
+            values = numeric_values(reference)
+            self.reference = np.sort(values[~np.isnan(values)])
+            self.reference_counts = pd.Series(self.reference).value_counts()
+            self.std = max(np.std(self.reference), 0.001)
+            quantiles = np.quantile(self.reference, np.linspace(0, 1, PSI_BINS + 1))
+            self.psi_edges = np.unique(quantiles)[1:-1]
+            self.psi_reference = self.psi_share(self.reference[None, :])[0]
+        else:
+            self.reference_counts = reference.dropna().astype(object).value_counts()
+        self.reference_counts = self.reference_counts.sort_index()
+        self.num_reference = int(self.reference_counts.sum())
+        # p-values of the exact Kolmogorov-Smirnov test, which only depend on
+        # the window size and the statistic
+        self.ks_p_values = {}
+
+    def encode(self, windows: np.ndarray):
+        """
+        The sorted values of the reference and the windows, their counts in
+        the reference and the codes of the windows (-1 being absent)
+        """
+        present = pd.notna(windows)
+        keys = self.reference_counts.index.union(pd.unique(windows[present]))
+        reference_counts = self.reference_counts.reindex(keys, fill_value=0)
+        codes = np.full(windows.shape, -1)
+        codes[present] = keys.get_indexer(windows[present])
+        return keys, reference_counts.to_numpy(), codes
+
+    def drift(self, windows: np.ndarray):
+        """
+        The drift score of each window (p-value or distance) and whether it
+        drifted, NaN and False for the windows without any value
+        """
+        num_windows = len(windows)
+        scores = np.full(num_windows, np.nan)
+        drifted = np.zeros(num_windows, dtype=bool)
+        small = self.num_reference <= MAX_ROWS_FOR_TESTS
+        if self.kind == "num":
+            sorted_, sizes, present, distinct = sorted_windows(windows)
+            if self.num_stattest == "psi":
+                rows = np.flatnonzero(sizes > 0)
+                scores[rows] = self.psi(windows[rows])
+                return scores, scores >= DISTANCE_THRESHOLD
+            # Distinct values of each window missing from the reference
+            unique = self.reference_counts.index.to_numpy()
+            index = np.searchsorted(unique, sorted_).clip(max=len(unique) - 1)
+            new = distinct & (unique[index] != sorted_)
+            num_values = len(unique) + new.sum(axis=1)
+            rows = np.flatnonzero((num_values > MAX_VALUES_AS_CATEGORIES) & (sizes > 0))
+            if small:
+                scores[rows] = self.ks(sorted_[rows], sizes[rows])
+                drifted[rows] = scores[rows] <= P_VALUE_THRESHOLD
+            else:
+                scores[rows] = self.wasserstein(sorted_[rows], sizes[rows])
+                drifted[rows] = scores[rows] >= DISTANCE_THRESHOLD
+            rows = np.flatnonzero(
+                (num_values <= MAX_VALUES_AS_CATEGORIES) & (sizes > 0)
+            )
+        else:
+            rows = np.flatnonzero(pd.notna(windows).any(axis=1))
+        if len(rows) == 0:
+            return scores, drifted
+        # The columns tested as categories
+        keys, reference_counts, codes = self.encode(windows[rows])
+        counts = category_counts(codes, len(keys))
+        num_values = ((reference_counts > 0) | (counts > 0)).sum(axis=1)
+        if small:
+            z = num_values <= 2
+            scores[rows[z]] = self.z_test(reference_counts, counts[z])
+            scores[rows[~z]] = self.chi_square(reference_counts, counts[~z])
+            drifted[rows] = scores[rows] < P_VALUE_THRESHOLD
+        else:
+            scores[rows] = self.jensen_shannon(reference_counts, counts)
+            drifted[rows] = scores[rows] >= DISTANCE_THRESHOLD
+        return scores, drifted
+
+    def ks(self, windows: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+        """
+        p-values of the two-sided Kolmogorov-Smirnov test of each sorted
+        window, as scipy.stats.ks_2samp computes them
+        """
+        statistics = ks_statistic(self.reference, windows, sizes)
+        p_values = np.empty(len(windows))
+        for i, (statistic, size) in enumerate(zip(statistics, sizes)):
+            lcm = math.lcm(self.num_reference, int(size))
+            key = (int(size), round(statistic * lcm))
+            if key not in self.ks_p_values:
+                self.ks_p_values[key] = scipy.stats.ks_2samp(
+                    self.reference, windows[i, :size]
+                ).pvalue
+            p_values[i] = self.ks_p_values[key]
+        return p_values
+
+    def wasserstein(self, windows: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+        """Wasserstein distance of each window, normed by the reference std"""
+        distances = [
+            scipy.stats.wasserstein_distance(self.reference, row[:size])
+            for row, size in zip(windows, sizes)
+        ]
+        return np.array(distances) / self.std
+
+    def psi_share(self, windows: np.ndarray) -> np.ndarray:
+        """Share of the values of each window in the bins of the reference deciles"""
+        bins = np.searchsorted(self.psi_edges, windows, side="right")
+        counts = category_counts(np.where(np.isnan(windows), -1, bins), PSI_BINS)
+        return counts / counts.sum(axis=1, keepdims=True)
+
+    def psi(self, windows: np.ndarray) -> np.ndarray:
+        """Population stability index of each window on the reference deciles"""
+        return self.psi_of_shares(self.psi_share(windows))
+
+    def psi_of_shares(self, shares: np.ndarray) -> np.ndarray:
+        """Population stability index of rows of shares of the reference deciles"""
+        expected = np.maximum(self.psi_reference, 1e-4)
+        actual = np.maximum(shares, 1e-4)
+        return ((actual - expected) * np.log(actual / expected)).sum(axis=1)
+
+    def chi_square(self, reference_counts: np.ndarray, counts: np.ndarray):
+        """p-values of the chi-square test of the counts of each window"""
+        expected = reference_counts * counts.sum(axis=1, keepdims=True)
+        expected = expected / self.num_reference
+        keys = (reference_counts > 0) | (counts > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terms = np.where(keys, (counts - expected) ** 2 / expected, 0)
+        return scipy.stats.chi2.sf(terms.sum(axis=1), keys.sum(axis=1) - 1)
+
+    def z_test(self, reference_counts: np.ndarray, counts: np.ndarray):
+        """p-values of the z-test of the share of the first of the two values"""
+        p_values = np.ones(len(counts))
+        keys = (reference_counts > 0) | (counts > 0)
+        first = np.argmax(keys, axis=1)
+        num_reference, num_current = self.num_reference, counts.sum(axis=1)
+        p1 = 1 - reference_counts[first] / num_reference
+        p2 = 1 - counts[np.arange(len(counts)), first] / num_current
+        pooled = (p1 * num_reference + p2 * num_current) / (num_reference + num_current)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = (p1 - p2) / np.sqrt(
+                pooled * (1 - pooled) * (1 / num_reference + 1 / num_current)
+            )
+        # The same single value on both sides does not drift
+        tested = keys.sum(axis=1) > 1
+        p_values[tested] = 2 * (1 - scipy.stats.norm.cdf(np.abs(z[tested])))
+        return p_values
+
+    def jensen_shannon(self, reference_counts: np.ndarray, counts: np.ndarray):
+        """Jensen-Shannon distance of the value shares of each window"""
+        reference = reference_counts / reference_counts.sum()
+        current = counts / counts.sum(axis=1, keepdims=True)
+        middle = (reference + current) / 2
+        divergence = scipy.special.rel_entr(reference, middle).sum(axis=1)
+        divergence += scipy.special.rel_entr(current, middle).sum(axis=1)
+        return np.sqrt(divergence / 2)
+
+
+class DriftEngine:
+    """
+    The metrics kept from the Evidently report of each window: the drift
+    score of the prediction, the number of drifted columns (prediction,
+    numerical and categorical features) and the share of missing values
+    """
+
+    def __init__(
+        self,
+        reference: pd.DataFrame,
+        num_features: list,
+        cat_features: list,
+        prediction: str,
+        num_stattest: str = None,
+    ):
+        self.prediction = prediction
+        self.columns = {
+            prediction: ColumnDrift(reference[prediction], "num", num_stattest),
+            **{
+                column: ColumnDrift(reference[column], "num", num_stattest)
+                for column in num_features
+            },
+            **{
+                column: ColumnDrift(reference[column], "cat") for column in cat_features
+            },
+        }
+
+    def window_metrics(self, data: pd.DataFrame, window_size: int) -> pd.DataFrame:
+        """The metrics of the windows of `window_size` consecutive rows of `data`"""
+        num_windows = -(-len(data) // window_size)
+        num_drifted_columns = np.zeros(num_windows)
+        empty = np.zeros(num_windows, dtype=bool)
+        for column, column_drift in self.columns.items():
+            if column_drift.kind == "num":
+                values = numeric_values(data[column])
+                windows = to_windows(values, window_size, np.nan)
+            else:
+                values = data[column].astype(object).to_numpy()
+                windows = to_windows(values, window_size, None)
+            scores, drifted = column_drift.drift(windows)
+            num_drifted_columns += drifted
+            # Evidently fails on windows without any value of a column
+            empty |= np.isnan(scores)
+            if column == self.prediction:
+                prediction_drift = scores
+        metrics = pd.DataFrame(
+            {
+                "prediction_drift": prediction_drift,
+                "num_drifted_columns": num_drifted_columns,
+                "share_missing_values": share_missing(data, window_size),
+            }
+        )
+        metrics[empty] = np.nan
+        return metrics
+
+
+class SlidingHistogram:
+    """
+    Counts of values in `num_bins` bins over a sliding time window: a ring of
+    `num_buckets` time buckets, the oldest one being emptied when the window
+    moves past it. Counting a value costs O(1) whatever the window length,
+    and `counts` always holds the counts of the whole window.
+    """
+
+    def __init__(self, num_bins: int, num_buckets: int):
+        self.buckets = np.zeros((num_buckets, num_bins), dtype=np.int64)
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+        # The number of the most recent time bucket of the window
+        self.newest = None
+
+    def advance(self, bucket: int) -> None:
+        """Move the end of the window to the time bucket `bucket`"""
+        if self.newest is None:
+            self.newest = bucket
+        if bucket <= self.newest:
+            return
+        num_buckets = len(self.buckets)
+        for expired in range(
+            self.newest + 1, min(bucket, self.newest + num_buckets) + 1
+        ):
+            self.counts -= self.buckets[expired % num_buckets]
+            self.buckets[expired % num_buckets] = 0
+        self.newest = bucket
+
+    def add(self, buckets: np.ndarray, bins: np.ndarray) -> None:
+        """
+        Count values in their time bucket and bin (-1 being absent), the
+        values older than the window being dropped
+        """
+        if len(buckets) == 0:
+            return
+        self.advance(int(buckets.max()))
+        num_buckets, num_bins = self.buckets.shape
+        keep = (buckets > self.newest - num_buckets) & (bins >= 0)
+        np.add.at(self.buckets, (buckets[keep] % num_buckets, bins[keep]), 1)
+        self.counts += np.bincount(bins[keep], minlength=num_bins)
+
+
+class StreamingDrift:
+    """
+    The metrics of DriftEngine over the rows of the last `window`, updated
+    as rows stream in. Each column is sketched by a SlidingHistogram on bins
+    of the reference: the deciles of the numerical columns, compared with
+    the population stability index, and the values of the categorical ones
+    (plus one bin for the new values), compared with the Jensen-Shannon
+    distance. Columns drift from DISTANCE_THRESHOLD on.
+    """
+
+    def __init__(
+        self,
+        reference: pd.DataFrame,
+        num_features: list,
+        cat_features: list,
+        prediction: str,
+        window: pd.Timedelta,
+        bucket: pd.Timedelta,
+    ):
+        self.prediction = prediction
+        self.bucket_ns = pd.Timedelta(bucket).value
+        num_buckets = -(-pd.Timedelta(window).value // self.bucket_ns)
+        self.columns = {
+            prediction: ColumnDrift(reference[prediction], "num", "psi"),
+            **{
+                column: ColumnDrift(reference[column], "num", "psi")
+                for column in num_features
+            },
+            **{
+                column: ColumnDrift(reference[column], "cat") for column in cat_features
+            },
+        }
+        self.histograms = {
+            column: SlidingHistogram(
+                PSI_BINS
+                if column_drift.kind == "num"
+                else len(column_drift.reference_counts) + 1,
+                num_buckets,
+            )
+            for column, column_drift in self.columns.items()
+        }
+        # The present and the missing cells of all the columns
+        self.missing = SlidingHistogram(2, num_buckets)
+        self.timestamp = None
+
+    def bins(self, column: str, values: pd.Series) -> np.ndarray:
+        """The bin of each value of a column, -1 for the missing ones"""
+        column_drift = self.columns[column]
+        if column_drift.kind == "num":
+            values = numeric_values(values)
+            bins = np.searchsorted(column_drift.psi_edges, values, side="right")
+            return np.where(np.isnan(values), -1, bins)
+        values = values.astype(object)
+        bins = column_drift.reference_counts.index.get_indexer(values)
+        bins[bins == -1] = len(column_drift.reference_counts)
+        return np.where(values.isna().to_numpy(), -1, bins)
+
+    def update(self, data: pd.DataFrame, timestamps: pd.Series) -> None:
+        """
+        Add rows created at `timestamps`. The missing cells are counted over
+        all the columns of `data`, as share_missing does.
+        """
+        if len(data) == 0:
+            return
+        buckets = timestamps.to_numpy("datetime64[ns]").astype("int64")
+        buckets = buckets // self.bucket_ns
+        for column, histogram in self.histograms.items():
+            histogram.add(buckets, self.bins(column, data[column]))
+        for _, column in data.items():
+            self.missing.add(buckets, missing_cells(column).astype("int64"))
+        newest = timestamps.max()
+        self.timestamp = (
+            newest if self.timestamp is None else max(self.timestamp, newest)
+        )
+
+    def metrics(self) -> tuple:
+        """
+        The drift score of the prediction, the number of drifted columns and
+        the share of missing values of the window, Nones when it is empty
+        """
+        if self.histograms[self.prediction].counts.sum() == 0:
+            return None, None, None
+        scores = {}
+        for column, column_drift in self.columns.items():
+            counts = self.histograms[column].counts
+            if counts.sum() == 0:
+                continue
+            if column_drift.kind == "num":
+                shares = counts / counts.sum()
+                scores[column] = column_drift.psi_of_shares(shares[None, :])[0]
+            else:
+                reference_counts = np.append(column_drift.reference_counts, 0)
+                scores[column] = column_drift.jensen_shannon(
+                    reference_counts, counts[None, :]
+                )[0]
+        num_drifted_columns = sum(
+            score >= DISTANCE_THRESHOLD for score in scores.values()
+        )
+        present, missing = self.missing.counts
+        return (
+            float(scores[self.prediction]),
+            int(num_drifted_columns),
+            float(missing / (present + missing)),
+        )
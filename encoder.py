@@ -0,0 +1,130 @@
+"""
+Columnar replacement of the DictVectorizer used to encode the features of the
+model, working on DataFrame columns instead of one dict per row.
+"""
+import json
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+# Bumped when the encoding changes, caches of encoded data depend on it
+ENCODER_VERSION = 1
+
+
+class ColumnEncoder:
+    """
+    One-hot encode the categorical columns ("column=value" features) and pass
+    the numerical ones through, with the output of a fitted DictVectorizer:
+    features sorted by name, unknown values and missing columns skipped,
+    missing numbers kept as NaN and zeros stored explicitly.
+
+    The vocabulary is frozen at fit time and mapped to index arrays, so a
+    DataFrame is encoded with a few NumPy operations per column.
+    """
+
+    def __init__(self, feature_names: list, separator: str = "="):
+        self.feature_names_ = sorted(feature_names)
+        self.separator = separator
+        self.vocabulary_ = {name: i for i, name in enumerate(self.feature_names_)}
+        self.numerical = {}
+        self.categorical = {}
+        for name, index in self.vocabulary_.items():
+            column, sep, value = name.partition(separator)
+            if sep:
+                self.categorical.setdefault(column, {})[value] = index
+            else:
+                self.numerical[name] = index
+        self.categorical = {
+            column: (pd.Index(list(values)), np.array(list(values.values())))
+            for column, values in self.categorical.items()
+        }
+
+    @property
+    def columns(self) -> list:
+        """The columns read by transform"""
+        return list(dict.fromkeys([*self.categorical, *self.numerical]))
+
+    @classmethod
+    def fit(cls, data: pd.DataFrame, columns: list, separator: str = "="):
+        """
+        Build the vocabulary of `columns`: the numerical columns are kept as
+        they are, the others give one feature per value
+        """
+        feature_names = []
+        for column in columns:
+            values = data[column]
+            if pd.api.types.is_numeric_dtype(values):
+                feature_names.append(column)
+            else:
+                feature_names.extend(
+                    f"{column}{separator}{value}" for value in values.dropna().unique()
+                )
+        return cls(feature_names, separator)
+
+    @classmethod
+    def from_dict_vectorizer(cls, dv):
+        """The encoder of a fitted DictVectorizer, for the runs logged with it"""
+        return cls(dv.feature_names_, dv.separator)
+
+    def transform(self, data: pd.DataFrame, sparse: bool = True):
+        """
+        Encode `data` as a CSR matrix, or as a dense array (absent features
+        being 0) when not `sparse`
+        """
+        columns = [column for column in self.columns if column in data.columns]
+        num_rows = len(data)
+        indices = np.full((num_rows, len(columns)), -1, dtype=np.int32)
+        values = np.zeros((num_rows, len(columns)))
+        for j, column in enumerate(columns):
+            if column in self.numerical:
+                indices[:, j] = self.numerical[column]
+                values[:, j] = pd.to_numeric(data[column]).astype("float64")
+            else:
+                known, index = self.categorical[column]
+                codes = known.get_indexer(data[column].astype(object))
+                indices[:, j] = np.where(codes >= 0, index[codes], -1)
+                values[:, j] = 1.0
+        # Order the features of each row by index, the absent ones first
+        order = np.argsort(indices, axis=1, kind="stable")
+        indices = np.take_along_axis(indices, order, axis=1)
+        values = np.take_along_axis(values, order, axis=1)
+        present = indices >= 0
+        indptr = np.zeros(num_rows + 1, dtype=np.int32)
+        np.cumsum(present.sum(axis=1), out=indptr[1:])
+        matrix = scipy.sparse.csr_matrix(
+            (values[present], indices[present], indptr),
+            shape=(num_rows, len(self.feature_names_)),
+        )
+        return matrix if sparse else matrix.toarray()
+
+    def to_dict(self) -> dict:
+        return {
+            "version": ENCODER_VERSION,
+            "separator": self.separator,
+            "feature_names": self.feature_names_,
+        }
+
+    def save(self, path: Path) -> None:
+        with open(path, "w") as f_out:
+            json.dump(self.to_dict(), f_out, ensure_ascii=False, indent=1)
+
+    @classmethod
+    def load(cls, path: Path):
+        with open(path) as f_in:
+            config = json.load(f_in)
+        return cls(config["feature_names"], config["separator"])
+
+
+def load_encoder(preprocessor_dir: Path) -> ColumnEncoder:
+    """
+    Load the encoder of a run from its preprocessor artifacts: encoder.json,
+    or the DictVectorizer.b of the runs logged before it
+    """
+    preprocessor_dir = Path(preprocessor_dir)
+    if (preprocessor_dir / "encoder.json").exists():
+        return ColumnEncoder.load(preprocessor_dir / "encoder.json")
+    with open(preprocessor_dir / "DictVectorizer.b", "rb") as f_in:
+        return ColumnEncoder.from_dict_vectorizer(pickle.load(f_in))
@@ -1,21 +1,206 @@
-from datetime import datetime
+import asyncio
+import random
+import time
 from pathlib import Path
 
-import psycopg
+import aiohttp
 from gql import Client
 from gql.transport.aiohttp import AIOHTTPTransport
+from gql.transport.exceptions import TransportServerError
 from prefect import flow, get_run_logger, task
 
-from utils import (connect_to_database, create_table_rental, ingest_announce,
-                   load_query, transform_annonce_data)
+from db import connection, create_database, database_params
+from instrumentation import instrument, instrument_flow
+from utils import (
+    count_newer,
+    create_table_crawl_state,
+    create_table_rental,
+    get_crawl_state,
+    get_watermark,
+    ingest_announces,
+    load_query,
+    parse_created_at,
+    save_crawl_state,
+    skip_ingested,
+    transform_annonce_data,
+)
 
-db_params = {
-    "dbname": "realestate",
-    "user": "postgres",
-    "password": "example",
-    "host": "localhost",
-    "port": "5432",
-}
+db_params = database_params("realestate")
+
+
+def search_variables(page: int, count: int = 1000) -> dict:
+    """
+    Variables of the search query for one page of rental announcements
+    """
+    return {
+        "mediaSize": "LARGE",
+        "q": None,
+        "filter": {
+            "categorySlug": "immobilier-location",
+            "origin": None,
+            "hasPrice": True,
+            "fields": [],
+            "page": page,
+            "count": count,
+        },
+    }
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: `rate` requests per second on average,
+    with bursts of at most `capacity` requests. `clock` and `sleep` measure
+    and wait for the time, the monotonic clock and asyncio.sleep by default.
+    """
+
+    def __init__(
+        self, rate: float, capacity: int, clock=time.monotonic, sleep=asyncio.sleep
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(capacity)
+        self.updated_at = clock()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it. The token is reserved
+        under the lock, the wait for it happens outside of it.
+        """
+        async with self.lock:
+            now = self.clock()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            # The tokens go negative for the requests waiting their turn
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            await self.sleep(wait)
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed request may succeed again: network errors, timeouts and
+    server errors (5xx, 429). The errors of the query itself are not retried.
+    """
+    if isinstance(error, TransportServerError):
+        return error.code is None or error.code == 429 or error.code >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+async def fetch_page_async(
+    session,
+    query,
+    operationName: str,
+    page: int,
+    bucket: TokenBucket,
+    retries: int = 5,
+    backoff: float = 1.0,
+) -> list:
+    """
+    Fetch one page of announcements, retrying the network and server errors
+    with an exponential backoff
+    """
+    for attempt in range(retries + 1):
+        await bucket.acquire()
+        try:
+            result = await session.execute(
+                query,
+                operation_name=operationName,
+                variable_values=search_variables(page),
+            )
+            return result["search"]["announcements"]["data"]
+        except (TransportServerError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            await asyncio.sleep(backoff * 2**attempt + random.uniform(0, backoff))
+
+
+async def crawl_pages(
+    conn,
+    url: str,
+    query,
+    operationName: str,
+    pages: range,
+    logger,
+    state: dict,
+    concurrency: int = 8,
+    rate: float = 4.0,
+    queue_size: int = 16,
+) -> dict:
+    """
+    Fetch pages concurrently and ingest them as they arrive.
+
+    `concurrency` fetchers share the page range and a token bucket of `rate`
+    requests per second. Fetched pages go through a queue to a single
+    ingestion worker, so network and database work overlap. Pages complete
+    out of order, the crawl state is checkpointed at the end of the ingested
+    prefix. At most `queue_size` pages are held at once, fetching, queued or
+    ingested ahead of the prefix: the fetchers wait for a slot before taking
+    the next page.
+    """
+    bucket = TokenBucket(rate=rate, capacity=concurrency)
+    queue = asyncio.Queue()
+    # A slot is taken before a page and released once it is checkpointed.
+    # Taken in page order, the first page not checkpointed always has one.
+    slots = asyncio.Semaphore(queue_size)
+    totals = {"pages": 0, "rows": 0, "rejected": 0}
+    ingested = {}
+    next_page = pages.start
+
+    async def fetch(session, pages):
+        while True:
+            await slots.acquire()
+            page = next(pages, None)
+            if page is None:
+                slots.release()
+                return
+            data_page = await fetch_page_async(
+                session, query, operationName, page, bucket
+            )
+            await queue.put((page, data_page))
+
+    async def ingest():
+        nonlocal next_page
+        while (item := await queue.get()) is not None:
+            page, data_page = item
+            if page == state["last_page"]:
+                data_page = skip_ingested(data_page, state["last_id"])
+            report = await asyncio.to_thread(
+                ingest_announces, conn, map(transform_annonce_data, data_page)
+            )
+            log_ingest_report(logger, page, report)
+            totals["pages"] += 1
+            totals["rows"] += report["rows"]
+            totals["rejected"] += len(report["rejected"])
+            ingested[page] = data_page
+            while next_page in ingested:
+                await asyncio.to_thread(
+                    checkpoint, conn, state, next_page, ingested.pop(next_page)
+                )
+                next_page += 1
+                slots.release()
+
+    transport = AIOHTTPTransport(url=url)
+    async with Client(
+        transport=transport, fetch_schema_from_transport=False
+    ) as session:
+        async with asyncio.TaskGroup() as tg:
+            ingestion = tg.create_task(ingest())
+            pages_left = iter(pages)
+            await asyncio.gather(
+                *(
+                    tg.create_task(fetch(session, pages_left))
+                    for _ in range(concurrency)
+                )
+            )
+            await queue.put(None)
+            await ingestion
+    return totals
 
 
 @task(name="Prepare database")
@@ -24,70 +209,76 @@ def prep_db(db_params: dict, sql_request: str):
     Create a database and table if not exists
     """
     logger = get_run_logger()
-    with psycopg.connect(
-        f"host={db_params['host']} port={db_params['port']} user={db_params['user']} password={db_params['password']}",
-        autocommit=True,
-    ) as conn:
-        res = conn.execute(
-            f"SELECT 1 FROM pg_database WHERE datname='{db_params['dbname']}'"
+    if create_database(db_params):
+        logger.info(f"Creating the db {db_params['dbname']}")
+    with connection(db_params) as conn:
+        conn.execute(sql_request)
+
+
+def log_ingest_report(logger, page: int, report: dict) -> None:
+    """
+    Log the timing of an ingested page and the rows rejected by the database
+    """
+    logger.info(
+        f"Page {page}: {report['rows']} rows written in {report['seconds']:.2f}s"
+        f" ({len(report['batches'])} batches, {report['unchanged']} unchanged,"
+        f" {len(report['rejected'])} rejected)"
+    )
+    for rejected in report["rejected"]:
+        logger.warning(
+            f"Rejected annonce id={rejected['annonce']['id']}: {rejected['error']}"
         )
-        if len(res.fetchall()) == 0:
-            logger.info(f"Creating the db {db_params['dbname']}")
-            conn.execute(f"create database {db_params['dbname']};")
-        with psycopg.connect(
-            f"host={db_params['host']} port={db_params['port']} dbname={db_params['dbname']}  user={db_params['user']} password={db_params['password']}",
-            autocommit=True,
-        ) as conn:
-            conn.execute(sql_request)
+
+
+def checkpoint(conn, state: dict, page: int, ingested: list) -> None:
+    """
+    Record that a page was ingested up to the last annonce of `ingested`
+    """
+    state["last_page"] = page
+    state["last_id"] = int(ingested[-1]["id"]) if ingested else None
+    if ingested:
+        newest = parse_created_at(ingested[0]["createdAt"])
+        if state["high_watermark"] is None or newest > state["high_watermark"]:
+            state["high_watermark"] = newest
+    save_crawl_state(conn, state)
 
 
 @task(name="fetch new data")
-def fetch_new_data(conn, url: str, query, operationName, lastPage, last_date) -> None:
+@instrument()
+def fetch_new_data(conn, url: str, query, operationName, lastPage, state) -> dict:
     """
-    Fetch data into the database
+    Fetch the annonces refreshed since the watermark into the database,
+    starting at the page where the crawl stopped and stopping at the first
+    page reaching the watermark
     """
     logger = get_run_logger()
-    logger.info(f"The Timestamp of the most recent annouce in the table is {last_date}")
+    watermark = state["watermark"]
+    logger.info(f"The Timestamp of the most recent annouce in the table is {watermark}")
     transport = AIOHTTPTransport(url=url)
     client = Client(transport=transport, fetch_schema_from_transport=False)
-    for i in range(lastPage):
+    for i in range(state["last_page"], lastPage + 1):
         result = client.execute(
             query,
             operation_name=operationName,
-            variable_values={
-                "mediaSize": "LARGE",
-                "q": None,
-                "filter": {
-                    "categorySlug": "immobilier-location",
-                    "origin": None,
-                    "hasPrice": True,
-                    "fields": [],
-                    "page": i,
-                    "count": 1000,
-                },
-            },
+            variable_values=search_variables(i),
         )
         data_page = result["search"]["announcements"]["data"]
-        recent_date_page = datetime.strptime(
-            data_page[0]["createdAt"], "%Y-%m-%dT%H:%M:%S.%fZ"
+        if i == state["last_page"]:
+            data_page = skip_ingested(data_page, state["last_id"])
+        num_new = count_newer(data_page, watermark)
+        report = ingest_announces(
+            conn, map(transform_annonce_data, data_page[:num_new])
         )
-        if recent_date_page > last_date:
-            for j in range(len(data_page)):
-                recent_date_annonce = datetime.strptime(
-                    data_page[j]["createdAt"], "%Y-%m-%dT%H:%M:%S.%fZ"
-                )
-                if recent_date_annonce > last_date:
-                    logger.info(
-                        f"Fetching page{i} announce {j} created at {recent_date_annonce}"
-                    )
-                    ingest_announce(conn, transform_annonce_data(data_page[j]))
-            del data_page
-        else:
+        log_ingest_report(logger, i, report)
+        checkpoint(conn, state, i, data_page[:num_new])
+        if num_new < len(data_page):
             break
+    return state
 
 
 @task(name="fetch all data")
-def fetch_all_data(conn, url: str, query, operationName, lastPage):
+@instrument()
+def fetch_all_data(conn, url: str, query, operationName, lastPage, state) -> dict:
     """
     fetching all data in the website and save it in a parquet file
     """
@@ -95,37 +286,82 @@ def fetch_all_data(conn, url: str, query, operationName, lastPage):
     logger.info(f"Fetching all data till the page {lastPage}")
     transport = AIOHTTPTransport(url=url)
     client = Client(transport=transport, fetch_schema_from_transport=False)
-    for i in range(lastPage + 1):
+    for i in range(state["last_page"], lastPage + 1):
         logger.info(f" Fetching page {i}/{lastPage}")
         result = client.execute(
             query,
             operation_name=operationName,
-            variable_values={
-                "mediaSize": "LARGE",
-                "q": None,
-                "filter": {
-                    "categorySlug": "immobilier-location",
-                    "origin": None,
-                    "hasPrice": True,
-                    "fields": [],
-                    "page": i,
-                    "count": 1000,
-                },
-            },
+            variable_values=search_variables(i),
         )
         data_page = result["search"]["announcements"]["data"]
-        for data_announce in data_page:
-            ingest_announce(conn, transform_annonce_data(data_announce))
-    return None
+        if i == state["last_page"]:
+            data_page = skip_ingested(data_page, state["last_id"])
+        report = ingest_announces(conn, map(transform_annonce_data, data_page))
+        log_ingest_report(logger, i, report)
+        checkpoint(conn, state, i, data_page)
+    return state
+
+
+@task(name="fetch all data concurrently")
+@instrument()
+def fetch_all_data_async(
+    conn,
+    url: str,
+    query,
+    operationName,
+    lastPage,
+    state: dict,
+    concurrency: int = 8,
+    rate: float = 4.0,
+) -> dict:
+    """
+    fetching all data in the website with concurrent requests
+    """
+    logger = get_run_logger()
+    logger.info(
+        f"Fetching all data till the page {lastPage}"
+        f" ({concurrency} concurrent requests, {rate} requests/s)"
+    )
+    start = time.perf_counter()
+    totals = asyncio.run(
+        crawl_pages(
+            conn,
+            url,
+            query,
+            operationName,
+            range(state["last_page"], lastPage + 1),
+            logger,
+            state,
+            concurrency=concurrency,
+            rate=rate,
+        )
+    )
+    logger.info(
+        f"Crawled {totals['pages']} pages, {totals['rows']} rows"
+        f" ({totals['rejected']} rejected) in {time.perf_counter() - start:.1f}s"
+    )
+    return state
 
 
 @flow(name="fetch data")
-def fetch_data(url: str, query_path: Path, query_last_page_path: Path, db_params: dict):
+@instrument_flow
+def fetch_data(
+    url: str,
+    query_path: Path,
+    query_last_page_path: Path,
+    db_params: dict,
+    concurrency: int = 0,
+    rate: float = 4.0,
+):
     """
     Main flow for getting date (all fo only fetch)
+
+    A full crawl runs with `concurrency` parallel requests limited to `rate`
+    requests per second when `concurrency` > 0, and page by page otherwise.
+    Progress is checkpointed in the `crawl_state` table after every page, an
+    interrupted run is resumed from its last ingested annonce.
     """
-    prep_db(db_params, create_table_rental)
-    conn = connect_to_database(db_params)
+    prep_db(db_params, create_table_rental + create_table_crawl_state)
     logger = get_run_logger()
     transport = AIOHTTPTransport(url=url)
     client = Client(transport=transport, fetch_schema_from_transport=False)
@@ -134,37 +370,45 @@ def fetch_data(url: str, query_path: Path, query_last_page_path: Path, db_params
     result_last_page = client.execute(
         query_last_page,
         operation_name=operationName,
-        variable_values={
-            "mediaSize": "LARGE",
-            "q": None,
-            "filter": {
-                "categorySlug": "immobilier-location",
-                "origin": None,
-                "hasPrice": True,
-                "fields": [],
-                "page": 1,
-                "count": 1000,
-            },
-        },
+        variable_values=search_variables(1),
     )
     query = load_query(query_path)
     lastPage = result_last_page["search"]["announcements"]["paginatorInfo"]["lastPage"]
-    try:
-        cursor = conn.cursor()
-        select_query = (
-            "SELECT created_at FROM rental ORDER BY created_at DESC LIMIT 1 ;"
-        )
-        cursor.execute(select_query)
-        last_date = cursor.fetchone()
-    except conn.Error as e:
-        logger.info("Error executing query:", e)
-
-    if last_date is None:
-        fetch_all_data(conn, url, query, operationName, lastPage)
-    else:
-        last_date = last_date[0]
-        fetch_new_data(conn, url, query, operationName, lastPage, last_date)
-    conn.close()
+
+    with connection(db_params) as conn:
+        state = get_crawl_state(conn)
+        if state is not None and state["status"] == "running":
+            logger.info(
+                f"Resuming the interrupted crawl at page {state['last_page']}"
+                f" after the annonce {state['last_id']}"
+            )
+        else:
+            watermark = state["watermark"] if state is not None else None
+            watermark = watermark or get_watermark(conn)
+            state = {
+                "name": "rental",
+                "status": "running",
+                "watermark": watermark,
+                "high_watermark": watermark,
+                "last_page": 0,
+                "last_id": None,
+            }
+            save_crawl_state(conn, state)
+
+        if state["watermark"] is None and concurrency > 0:
+            state = fetch_all_data_async(
+                conn, url, query, operationName, lastPage, state, concurrency, rate
+            )
+        elif state["watermark"] is None:
+            state = fetch_all_data(conn, url, query, operationName, lastPage, state)
+        else:
+            state = fetch_new_data(conn, url, query, operationName, lastPage, state)
+
+        state["status"] = "done"
+        state["watermark"] = state["high_watermark"]
+        state["last_page"] = 0
+        state["last_id"] = None
+        save_crawl_state(conn, state)
     return None
 
 
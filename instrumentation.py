@@ -0,0 +1,327 @@
+"""
+Instrumentation of the pipeline stages: the duration of each call of the
+instrumented functions, the rows it handled and the peak memory of the
+process. The stages measured during a flow run are reported at its end, as
+the metrics of a run of the pipeline-instrumentation MLflow experiment and as
+rows of the pipeline_metrics table charted in Grafana.
+
+    @instrument(rows="column")
+    def get_specs(column: pd.Series) -> pd.DataFrame: ...
+
+    with measure("copy", rows=len(batch)): ...
+
+Set PIPELINE_PROFILE=1 to also dump a cProfile of the instrumented stages of
+each flow run in PROFILE_DIR (to open with pstats or snakeviz).
+"""
+import bisect
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import os
+import pstats
+import random
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import psycopg
+from psycopg_pool import PoolTimeout
+
+from db import DB_PARAMS, connection
+
+EXPERIMENT_NAME = "pipeline-instrumentation"
+PROFILE = os.getenv("PIPELINE_PROFILE", "0") not in ("", "0")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = [0.001, 0.01, 0.1, 1, 10, 60, 600, float("inf")]
+# The durations kept per stage for the percentiles, a uniform sample beyond
+MAX_SAMPLES = 10_000
+
+logger = logging.getLogger(__name__)
+
+create_table_pipeline_metrics = """
+    CREATE TABLE IF NOT EXISTS pipeline_metrics(
+        timestamp TIMESTAMP,
+        flow TEXT,
+        mlflow_run_id TEXT,
+        stage TEXT,
+        calls INTEGER,
+        seconds FLOAT,
+        num_rows BIGINT,
+        rows_per_second FLOAT,
+        p50_ms FLOAT,
+        p95_ms FLOAT,
+        p99_ms FLOAT,
+        max_ms FLOAT,
+        latency_histogram JSONB,
+        peak_rss_mb FLOAT
+    );
+    CREATE INDEX IF NOT EXISTS pipeline_metrics_timestamp_idx
+        ON pipeline_metrics (timestamp);
+"""
+
+PIPELINE_METRICS_COLUMNS = [
+    "timestamp",
+    "flow",
+    "mlflow_run_id",
+    "stage",
+    "calls",
+    "seconds",
+    "num_rows",
+    "rows_per_second",
+    "p50_ms",
+    "p95_ms",
+    "p99_ms",
+    "max_ms",
+    "latency_histogram",
+    "peak_rss_mb",
+]
+
+insert_pipeline_metrics = f"""
+    INSERT INTO pipeline_metrics({", ".join(PIPELINE_METRICS_COLUMNS)})
+    VALUES ({", ".join(f"%({column})s" for column in PIPELINE_METRICS_COLUMNS)})
+"""
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """The peak resident memory of the process (or of its largest child)"""
+    peak = resource.getrusage(who).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class StageStats:
+    """The calls of a stage during a flow run"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+        self.samples = []
+        self.max_seconds = 0.0
+        self.peak_rss_mb = 0.0
+
+    def add(self, seconds: float, rows: int) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.rows += rows
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        elif (index := random.randrange(self.calls)) < MAX_SAMPLES:
+            self.samples[index] = seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.peak_rss_mb = max(self.peak_rss_mb, peak_rss_mb())
+
+    def summary(self) -> dict:
+        """The metrics of the stage, durations in milliseconds"""
+        p50, p95, p99 = np.percentile(self.samples, [50, 95, 99]) * 1000
+        return {
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "num_rows": self.rows,
+            "rows_per_second": self.rows / self.seconds if self.rows else None,
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "p99_ms": p99,
+            "max_ms": self.max_seconds * 1000,
+            "latency_histogram": {
+                str(bound): count
+                for bound, count in zip(LATENCY_BUCKETS, self.histogram)
+            },
+            "peak_rss_mb": self.peak_rss_mb,
+        }
+
+
+_stats = {}
+_lock = threading.Lock()
+# The profilers of the threads of the current flow run, and the number of
+# nested stages running in this thread
+_profiles = []
+_local = threading.local()
+# The number of nested instrumented flows running, only the outermost reports
+_flow_depth = 0
+
+
+def _start_profile() -> None:
+    depth = getattr(_local, "depth", 0)
+    if depth == 0:
+        _local.profiler = cProfile.Profile()
+        with _lock:
+            _profiles.append(_local.profiler)
+        _local.profiler.enable()
+    _local.depth = depth + 1
+
+
+def _stop_profile() -> None:
+    _local.depth -= 1
+    if _local.depth == 0:
+        _local.profiler.disable()
+
+
+@contextmanager
+def measure(stage: str, rows: int | None = None):
+    """
+    Measure the block as a call of `stage` handling `rows` rows. The yielded
+    dict lets the block set its "rows" once known.
+    """
+    call = {"rows": rows}
+    if PROFILE:
+        _start_profile()
+    start = time.perf_counter()
+    try:
+        yield call
+    finally:
+        seconds = time.perf_counter() - start
+        if PROFILE:
+            _stop_profile()
+        with _lock:
+            _stats.setdefault(stage, StageStats()).add(seconds, call["rows"] or 0)
+
+
+def instrument(stage: str | None = None, rows: int | str | None = None):
+    """
+    Measure the calls of the decorated function as `stage` (its name by
+    default). `rows` is the number of rows of a call, or the name of the
+    argument whose length it is.
+    """
+
+    def decorator(func):
+        name = stage or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            count = rows
+            if isinstance(rows, str):
+                count = len(signature.bind(*args, **kwargs).arguments[rows])
+            with measure(name, count):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_flow(func):
+    """
+    Measure a flow (decorated under @flow) as a whole and report the stages
+    measured during its run, once it ended
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _flow_depth
+        with _lock:
+            if _flow_depth == 0:
+                _stats.clear()
+                _profiles.clear()
+            _flow_depth += 1
+        try:
+            with measure(func.__name__):
+                return func(*args, **kwargs)
+        finally:
+            with _lock:
+                _flow_depth -= 1
+                outermost = _flow_depth == 0
+            if outermost:
+                report(func.__name__)
+
+    return wrapper
+
+
+def dump_profile(flow: str, timestamp: datetime) -> Path | None:
+    """Merge the profiles of the threads of the run into a .prof file"""
+    with _lock:
+        profiles = [profile for profile in _profiles if profile.getstats()]
+    if not profiles:
+        return None
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f"{flow}-{timestamp:%Y%m%dT%H%M%S}.prof"
+    stats.dump_stats(path)
+    return path
+
+
+def log_to_mlflow(flow: str, summaries: dict, profile: Path | None) -> str:
+    """Log the metrics of the stages in a new run, without changing the active one"""
+    # Imported here, the instrumented stages run without mlflow
+    import mlflow
+    from mlflow.entities import Metric
+
+    client = mlflow.MlflowClient()
+    experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
+    experiment_id = (
+        experiment.experiment_id
+        if experiment is not None
+        else client.create_experiment(EXPERIMENT_NAME)
+    )
+    run = client.create_run(experiment_id, tags={"flow": flow})
+    now = int(time.time() * 1000)
+    metrics = [
+        Metric("peak_rss_mb", peak_rss_mb(), now, 0),
+        Metric("children_peak_rss_mb", peak_rss_mb(resource.RUSAGE_CHILDREN), now, 0),
+    ]
+    for stage, summary in summaries.items():
+        for name, value in summary.items():
+            if isinstance(value, (int, float)):
+                metrics.append(Metric(f"{stage}.{name}", value, now, 0))
+    client.log_batch(run.info.run_id, metrics=metrics)
+    client.log_dict(
+        run.info.run_id,
+        {stage: summary["latency_histogram"] for stage, summary in summaries.items()},
+        "latency_histograms.json",
+    )
+    if profile is not None:
+        client.log_artifact(run.info.run_id, str(profile))
+    client.set_terminated(run.info.run_id)
+    return run.info.run_id
+
+
+def write_pipeline_metrics(rows: list, db_params: dict = DB_PARAMS) -> None:
+    """Append the metrics of the stages of a run to pipeline_metrics"""
+    with connection(db_params, timeout=5) as conn, conn.transaction():
+        conn.execute(create_table_pipeline_metrics)
+        with conn.cursor() as curr:
+            curr.executemany(insert_pipeline_metrics, rows)
+
+
+def report(flow: str) -> dict:
+    """Report the stages measured during the run of `flow`"""
+    from mlflow.exceptions import MlflowException
+
+    timestamp = datetime.now()
+    with _lock:
+        summaries = {stage: stats.summary() for stage, stats in _stats.items()}
+    profile = dump_profile(flow, timestamp) if PROFILE else None
+    try:
+        run_id = log_to_mlflow(flow, summaries, profile)
+    except MlflowException as e:
+        logger.warning(f"The pipeline metrics were not logged to MLflow: {e}")
+        run_id = None
+    rows = [
+        {
+            **summary,
+            "timestamp": timestamp,
+            "flow": flow,
+            "mlflow_run_id": run_id,
+            "stage": stage,
+            "latency_histogram": json.dumps(summary["latency_histogram"]),
+        }
+        for stage, summary in summaries.items()
+    ]
+    try:
+        write_pipeline_metrics(rows)
+    except (psycopg.Error, PoolTimeout) as e:
+        logger.warning(f"The pipeline metrics were not written to the database: {e}")
+    return summaries
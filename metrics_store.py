@@ -0,0 +1,186 @@
+"""
+Storage of the drift metrics shown in Grafana.
+
+The metrics of each batch go to dummy_metrics, appended in time order and
+indexed with a BRIN index on timestamp, a few pages for months of rows. Each
+write also updates hourly and daily rollups (count, sum and max of each
+metric per bucket), so that the dashboards read a row per hour or per day
+over long time ranges, through the metrics_hourly and metrics_daily views.
+"""
+from datetime import timedelta
+
+ROLLUPS = {"hourly": "hour", "daily": "day"}
+
+create_metrics_table = """
+create table if not exists dummy_metrics(
+    timestamp timestamp,
+    prediction_drift float,
+    num_drifted_columns integer,
+    share_missing_values float
+);
+alter table dummy_metrics add column if not exists id bigserial;
+do $$
+begin
+    if not exists (
+        select 1 from pg_constraint
+        where conrelid = 'dummy_metrics'::regclass and contype = 'p'
+    ) then
+        alter table dummy_metrics add primary key (id);
+    end if;
+end $$;
+create index if not exists dummy_metrics_timestamp_brin
+    on dummy_metrics using brin (timestamp) with (pages_per_range = 16, autosummarize = on);
+"""
+
+# `batches` counts the metrics rows of the bucket, `measured` those with
+# metrics (the others had no value to test)
+create_rollup_table = """
+create table if not exists dummy_metrics_{name}(
+    bucket timestamp primary key,
+    batches integer not null default 0,
+    measured integer not null default 0,
+    prediction_drift_sum float not null default 0,
+    prediction_drift_max float,
+    num_drifted_columns_sum bigint not null default 0,
+    num_drifted_columns_max integer,
+    share_missing_values_sum float not null default 0,
+    share_missing_values_max float
+);
+create or replace view metrics_{name} as
+select
+    bucket as timestamp,
+    batches,
+    prediction_drift_sum / nullif(measured, 0) as prediction_drift,
+    prediction_drift_max,
+    num_drifted_columns_sum::float / nullif(measured, 0) as num_drifted_columns,
+    num_drifted_columns_max,
+    share_missing_values_sum / nullif(measured, 0) as share_missing_values,
+    share_missing_values_max
+from dummy_metrics_{name};
+"""
+
+# The rows of the rollup buckets of the `new` rows, added to the existing ones
+upsert_rollup = """
+insert into dummy_metrics_{name} as rollup
+select
+    date_trunc('{unit}', timestamp),
+    count(*),
+    count(prediction_drift),
+    coalesce(sum(prediction_drift), 0),
+    max(prediction_drift),
+    coalesce(sum(num_drifted_columns), 0),
+    max(num_drifted_columns),
+    coalesce(sum(share_missing_values), 0),
+    max(share_missing_values)
+from new
+where timestamp is not null
+group by 1
+on conflict (bucket) do update set
+    batches = rollup.batches + excluded.batches,
+    measured = rollup.measured + excluded.measured,
+    prediction_drift_sum = rollup.prediction_drift_sum
+        + excluded.prediction_drift_sum,
+    prediction_drift_max = greatest(
+        rollup.prediction_drift_max, excluded.prediction_drift_max
+    ),
+    num_drifted_columns_sum = rollup.num_drifted_columns_sum
+        + excluded.num_drifted_columns_sum,
+    num_drifted_columns_max = greatest(
+        rollup.num_drifted_columns_max, excluded.num_drifted_columns_max
+    ),
+    share_missing_values_sum = rollup.share_missing_values_sum
+        + excluded.share_missing_values_sum,
+    share_missing_values_max = greatest(
+        rollup.share_missing_values_max, excluded.share_missing_values_max
+    )
+"""
+
+# The rollups of the rows written before the rollup table existed
+backfill_rollup = (
+    """
+with new as (
+    select timestamp, prediction_drift, num_drifted_columns, share_missing_values
+    from dummy_metrics
+)
+"""
+    + upsert_rollup
+)
+
+# One statement per batch of rows: the rows are sent as four arrays, and
+# inserted with their rollups in the same transaction
+insert_metrics_statement = (
+    """
+with new as (
+    insert into dummy_metrics(
+        timestamp, prediction_drift, num_drifted_columns, share_missing_values
+    )
+    select * from unnest(
+        %s::timestamp[], %s::float[], %s::integer[], %s::float[]
+    )
+    returning timestamp, prediction_drift, num_drifted_columns,
+        share_missing_values
+), hourly as (
+"""
+    + upsert_rollup.format(name="hourly", unit=ROLLUPS["hourly"])
+    + """
+)
+"""
+    + upsert_rollup.format(name="daily", unit=ROLLUPS["daily"])
+)
+
+# Rows older than the retention before the most recent bucket, read from the
+# primary key of the hourly rollup
+prune_statement = """
+delete from {table}
+where {column} < (select max(bucket) from dummy_metrics_hourly) - %s
+"""
+
+
+def create_metrics_tables(conn) -> None:
+    """Create the metrics table, its index and its rollups if needed"""
+    conn.execute(create_metrics_table)
+    for name, unit in ROLLUPS.items():
+        table = f"dummy_metrics_{name}"
+        exists = conn.execute("select to_regclass(%s)", (table,)).fetchone()[0]
+        conn.execute(create_rollup_table.format(name=name))
+        if exists is None:
+            conn.execute(backfill_rollup.format(name=name, unit=unit))
+
+
+def write_metrics(conn, rows: list, batch_size: int = 10_000) -> None:
+    """
+    Insert rows (timestamp, prediction_drift, num_drifted_columns,
+    share_missing_values) of dummy_metrics and update the rollups, with one
+    statement per `batch_size` rows
+    """
+    for start in range(0, len(rows), batch_size):
+        columns = zip(*rows[start : start + batch_size])
+        conn.execute(insert_metrics_statement, [list(column) for column in columns])
+
+
+def prune_metrics(
+    conn,
+    keep: timedelta = timedelta(days=90),
+    keep_hourly: timedelta = timedelta(days=730),
+) -> None:
+    """
+    Delete the metrics of the batches older than `keep`, and the hourly
+    rollups older than `keep_hourly`, before the most recent metrics. The
+    daily rollups are kept. The remaining pages are summarized in the index.
+    """
+    conn.execute(
+        prune_statement.format(table="dummy_metrics", column="timestamp"), (keep,)
+    )
+    conn.execute(
+        prune_statement.format(table="dummy_metrics_hourly", column="bucket"),
+        (keep_hourly,),
+    )
+    summarize_metrics(conn)
+
+
+def summarize_metrics(conn) -> None:
+    """
+    Summarize the pages of dummy_metrics written since the last vacuum in
+    its BRIN index, which otherwise reads them on every query
+    """
+    conn.execute("select brin_summarize_new_values('dummy_metrics_timestamp_brin')")
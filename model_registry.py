@@ -0,0 +1,96 @@
+"""
+Resolve and load the current best model: the version of the registered model
+pointed to by an alias, which the trainings move. The loaded model is kept in
+memory until the alias points to another run.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import mlflow
+from mlflow.exceptions import MlflowException
+
+from encoder import load_encoder
+from native_model import BoosterModel, load_booster
+
+EXPERIMENT_NAME = "project-train-best-model-experiment"
+# The models trained by train_model are registered as versions of this model
+MODEL_NAME = "real-estate-dz-price"
+# The alias of the version to monitor and serve
+MODEL_ALIAS = os.getenv("MODEL_ALIAS", "champion")
+# How often, in seconds, load_model checks whether the alias moved
+CHECK_INTERVAL = float(os.getenv("MODEL_CHECK_INTERVAL", 60))
+# Before any model was registered: the best run of the experiment, searched
+# once and written here
+MANIFEST_PATH = Path("models/best_model.json")
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def search_best_run(experiment_name: str = EXPERIMENT_NAME) -> str:
+    """The run of the best logged model of the experiment (lowest rmse)"""
+    experiment = mlflow.get_experiment_by_name(experiment_name)
+    runs = mlflow.search_runs([experiment.experiment_id], order_by=["metrics.rmse"])
+    return runs[runs["tags.mlflow.log-model.history"].notna()]["run_id"].values[0]
+
+
+def alias_run() -> str | None:
+    """The run of the version of the alias, None before any registration"""
+    try:
+        version = mlflow.MlflowClient().get_model_version_by_alias(
+            MODEL_NAME, MODEL_ALIAS
+        )
+        return version.run_id
+    except MlflowException:
+        return None
+
+
+def resolve_model() -> str:
+    """The run of the current best model: the one of the alias, or the manifest"""
+    run_id = alias_run()
+    if run_id is not None:
+        return run_id
+    if not MANIFEST_PATH.exists():
+        MANIFEST_PATH.parent.mkdir(exist_ok=True)
+        with open(MANIFEST_PATH, "w") as f_out:
+            json.dump({"run_id": search_best_run()}, f_out)
+    with open(MANIFEST_PATH) as f_in:
+        return json.load(f_in)["run_id"]
+
+
+def load_run_model(run_id: str, nthread: int | None = None) -> BoosterModel:
+    """The encoder and the booster logged by a training run"""
+    preprocessor_dir, model_dir = (
+        mlflow.artifacts.download_artifacts(run_id=run_id, artifact_path=path)
+        for path in ["preprocessor", "models_mlflow"]
+    )
+    return BoosterModel(
+        load_encoder(preprocessor_dir), load_booster(model_dir, nthread)
+    )
+
+
+def load_model() -> BoosterModel:
+    """
+    The encoder and the booster of the current best model, loaded on first
+    use and again only once the alias moved to another run
+    """
+    with _lock:
+        now = time.monotonic()
+        if not _cache or now - _cache["checked"] >= CHECK_INTERVAL:
+            run_id = resolve_model()
+            if _cache.get("run_id") != run_id:
+                print(f"Loading the model of run = {run_id}")
+                _cache.update(run_id=run_id, model=load_run_model(run_id))
+            _cache["checked"] = now
+        return _cache["model"]
+
+
+def register_best_model(model_uri: str) -> None:
+    """Register the model logged at `model_uri` and point the alias to it"""
+    version = mlflow.register_model(model_uri, MODEL_NAME)
+    mlflow.MlflowClient().set_registered_model_alias(
+        MODEL_NAME, MODEL_ALIAS, version.version
+    )
@@ -1,18 +1,45 @@
 import datetime
-import pickle
+import multiprocessing
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 
-import mlflow
+import numpy as np
 import pandas as pd
-import psycopg
 from evidently import ColumnMapping
-from evidently.metrics import (ColumnDriftMetric, DatasetDriftMetric,
-                               DatasetMissingValuesMetric)
+from evidently.metrics import (
+    ColumnDriftMetric,
+    DatasetDriftMetric,
+    DatasetMissingValuesMetric,
+)
 from evidently.report import Report
 from prefect import flow, get_run_logger, task
+from psycopg.rows import dict_row
+
+from clean_data import clean_chunk, rental_rows_to_raw, select_rental_sql
+from db import connection, create_database, database_params
+from drift import DriftEngine, StreamingDrift
+from instrumentation import instrument, instrument_flow
+from metrics_store import (
+    create_metrics_tables,
+    prune_metrics,
+    summarize_metrics,
+    write_metrics,
+)
+from model_registry import load_model
+from utils import (
+    create_table_crawl_state,
+    get_crawl_state,
+    get_watermark,
+    save_crawl_state,
+)
 
 SEND_TIMEOUT = 10
-EXPERIMENT_NAME = "project-train-best-model-experiment"
+
+# The database of the metrics shown in Grafana, and the one of the rental
+# table filled by fetch_data, which the streaming monitor follows
+metrics_db = database_params("test")
+rental_db = database_params("realestate")
 
 # create_table_statement = """
 # drop table if exists dummy_metrics;
@@ -24,17 +51,23 @@ EXPERIMENT_NAME = "project-train-best-model-experiment"
 # )
 # """
 
-create_table_statement = """
-create table if not exists dummy_metrics(
-    timestamp timestamp,
-    prediction_drift float,
-    num_drifted_columns integer,
-    share_missing_values float
-)
+# The rows of the rental table ingested after the (created_at, id) of the last
+# row read, in order. The created_at bound lets the index be used.
+select_new_rental_sql = (
+    select_rental_sql
+    + """
+    WHERE created_at >= %(watermark)s
+        AND (created_at, id) > (%(watermark)s, %(last_id)s)
+    ORDER BY created_at, id
+    LIMIT %(limit)s
 """
+)
 
 num_features = ["location_duree", "superficie", "pieces", "etages"]
 cat_features = ["category", "wilaya"]
+# The columns of the monitored windows: the share of missing values is counted
+# over them, by the backfill and the streaming monitoring alike
+monitored_columns = ["createdAt", *num_features, *cat_features, "price_pred"]
 
 # Create evidently report
 column_mapping = ColumnMapping(
@@ -53,42 +86,17 @@ report = Report(
 )
 
 
-def load_best_model_dictvec(experiment_name: str):
-    """Load the best model which is saved as in artifacts/models_mlflow"""
-    experiment = mlflow.get_experiment_by_name(experiment_name)
-    EXPERIMENT_ID = experiment.experiment_id
-    df = mlflow.search_runs([EXPERIMENT_ID], order_by=["metrics.rmse"])
-    RUN_ID = df[df["tags.mlflow.log-model.history"].notna()]["run_id"].values[0]
-    best_model = f"runs:/{RUN_ID}/models_mlflow"
-    with open(
-        f"mlruns/{EXPERIMENT_ID}/{RUN_ID}/artifacts/preprocessor/DictVectorizer.b",
-        "rb",
-    ) as f_in:
-        dv = pickle.load(f_in)
-    print(f"Loading the model of run  = {RUN_ID}")
-    return dv, mlflow.pyfunc.load_model(best_model)
-
-
-dv, model = load_best_model_dictvec(EXPERIMENT_NAME)
-
-
 @task
 def prep_db():
-    with psycopg.connect(
-        "host=localhost port=5432 user=postgres password=example",
-        autocommit=True,
-    ) as conn:
-        res = conn.execute("SELECT 1 FROM pg_database WHERE datname='test'")
-        if len(res.fetchall()) == 0:
-            conn.execute("create database test;")
-        with psycopg.connect(
-            "host=localhost port=5432 dbname=test user=postgres password=example"
-        ) as conn:
-            conn.execute(create_table_statement)
+    create_database(metrics_db)
+    with connection(metrics_db) as conn:
+        create_metrics_tables(conn)
+        prune_metrics(conn)
 
 
 @task
-def prep_data(model, dv) -> (pd.DataFrame, pd.DataFrame):
+@instrument()
+def prep_data(model) -> (pd.DataFrame, pd.DataFrame):
     data = pd.read_parquet("data/reference_data.parquet")
     data["createdAt"] = data["createdAt"].dt.tz_localize(None)
     data = data.reset_index(drop=True)
@@ -96,77 +104,259 @@ def prep_data(model, dv) -> (pd.DataFrame, pd.DataFrame):
     total_rows = len(data)
     num_rows_first_df = int(total_rows * 0.8)
     num_rows_second_df = total_rows - num_rows_first_df
+    # One prediction for all the rows, the windows are slices of it
     X = data[num_features + cat_features]
-    X = X.to_dict("records")
-    data["price_pred"] = model.predict(dv.transform(X))
+    data["price_pred"] = model.predict(X)
+    data = data[monitored_columns]
     reference_data = data.head(num_rows_first_df)
-    raw_data = data.drop("price_pred", axis=1).tail(num_rows_second_df)
+    raw_data = data.tail(num_rows_second_df)
     return raw_data, reference_data
 
 
-@task(log_prints=False)
-def calculate_metrics_postgresql(curr, current_data, reference_data):
-    X = current_data[num_features + cat_features]
-    X = X.to_dict("records")
-    current_data["price_pred"] = model.predict(dv.transform(X))
+def calculate_metrics(current_data, reference_data) -> tuple:
+    """The row of dummy_metrics of a window of predicted announcements"""
     report.run(
         reference_data=reference_data,
         current_data=current_data,
         column_mapping=column_mapping,
     )
     result = report.as_dict()
-    prediction_drift = result["metrics"][0]["result"]["drift_score"]
-    num_drifted_columns = result["metrics"][1]["result"]["number_of_drifted_columns"]
-    share_missing_values = result["metrics"][2]["result"]["current"][
-        "share_of_missing_values"
-    ]
+    # Plain Python values, which psycopg adapts
     try:
-        curr.execute(
-            "insert into dummy_metrics(timestamp, prediction_drift,"
-            " num_drifted_columns, share_missing_values) values (%s, %s, %s, %s)",
-            (
-                current_data["createdAt"].max(),
-                prediction_drift,
-                num_drifted_columns,
-                share_missing_values,
-            ),
+        prediction_drift = float(result["metrics"][0]["result"]["drift_score"])
+        num_drifted_columns = int(
+            result["metrics"][1]["result"]["number_of_drifted_columns"]
         )
-    except:
-        curr.execute(
-            "insert into dummy_metrics(timestamp, prediction_drift,"
-            " num_drifted_columns, share_missing_values) values (%s, %s, %s, %s)",
-            (current_data["createdAt"].max(), None, None, None),
+        share_missing_values = float(
+            result["metrics"][2]["result"]["current"]["share_of_missing_values"]
         )
+    except (KeyError, TypeError, ValueError):
+        prediction_drift = num_drifted_columns = share_missing_values = None
+    return (
+        current_data["createdAt"].max(),
+        prediction_drift,
+        num_drifted_columns,
+        share_missing_values,
+    )
+
+
+@task(log_prints=False)
+@instrument(rows="current_data")
+def calculate_metrics_postgresql(curr, current_data, reference_data):
+    write_metrics(curr, [calculate_metrics(current_data, reference_data)])
     return None
 
 
+def _init_metrics_worker(reference_data: pd.DataFrame) -> None:
+    global _reference_data
+    _reference_data = reference_data
+
+
+def _calculate_window_metrics(current_data: pd.DataFrame) -> tuple:
+    return calculate_metrics(current_data, _reference_data)
+
+
+@task
+@instrument()
+def calculate_metrics_backfill(
+    windows: list, reference_data: pd.DataFrame, n_workers: int | None = None
+) -> list:
+    """
+    The dummy_metrics rows of all the windows, computed by `n_workers`
+    processes (one per core by default) which receive the reference data once
+    """
+    n_workers = n_workers or os.cpu_count()
+    chunksize = max(1, len(windows) // (4 * n_workers))
+    # Forked workers can hang at exit on the threads of the prefect engine
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_metrics_worker,
+        initargs=(reference_data,),
+    ) as executor:
+        return list(
+            executor.map(_calculate_window_metrics, windows, chunksize=chunksize)
+        )
+
+
+@task
+@instrument(rows="raw_data")
+def calculate_metrics_vectorized(
+    raw_data: pd.DataFrame, reference_data: pd.DataFrame, batch_size: int
+) -> list:
+    """
+    The dummy_metrics rows of all the windows, computed together by
+    drift.DriftEngine with the tests of the Evidently report
+    """
+    engine = DriftEngine(reference_data, num_features, cat_features, "price_pred")
+    metrics = engine.window_metrics(raw_data, batch_size)
+    windows = np.arange(len(raw_data)) // batch_size
+    metrics["timestamp"] = raw_data["createdAt"].groupby(windows).max().to_numpy()
+    rows = []
+    for row in metrics.itertuples(index=False):
+        if np.isnan(row.prediction_drift):
+            rows.append((row.timestamp, None, None, None))
+        else:
+            rows.append(
+                (
+                    row.timestamp,
+                    float(row.prediction_drift),
+                    int(row.num_drifted_columns),
+                    float(row.share_missing_values),
+                )
+            )
+    return rows
+
+
 @flow()
-def batch_monitoring_backfill(batch_size: int) -> None:
+@instrument_flow
+def batch_monitoring_backfill(
+    batch_size: int,
+    paced: bool = False,
+    engine: str = "numpy",
+    n_workers: int | None = None,
+) -> None:
+    """
+    Compute the metrics of the windows of `batch_size` announcements, as fast
+    as possible and written with one insert, or sent every SEND_TIMEOUT
+    seconds when `paced`, to watch them live in Grafana. The backfill runs
+    the tests of all the windows together with drift.DriftEngine (`engine`
+    "numpy"), or one Evidently report per window on `n_workers` processes
+    ("evidently").
+    """
     logger = get_run_logger()
     prep_db()
-    raw_data, reference_data = prep_data(model, dv)
-    num_batches = (len(raw_data) + batch_size - 1) // batch_size
-    # Initialiser les variables
-    start_index = 0
-    end_index = 0
-    last_send = datetime.datetime.now() - datetime.timedelta(seconds=10)
-    with psycopg.connect(
-        "host=localhost port=5432 dbname=test user=postgres password=example",
-        autocommit=True,
-    ) as conn:
-        for i in range(num_batches):
-            end_index = start_index + batch_size
-            current_data = raw_data.iloc[start_index:end_index]
+    raw_data, reference_data = prep_data(load_model())
+    windows = [
+        raw_data.iloc[start : start + batch_size]
+        for start in range(0, len(raw_data), batch_size)
+    ]
+    with connection(metrics_db) as conn:
+        if not paced:
+            if engine == "evidently":
+                rows = calculate_metrics_backfill(windows, reference_data, n_workers)
+            else:
+                rows = calculate_metrics_vectorized(
+                    raw_data, reference_data, batch_size
+                )
+            write_metrics(conn, rows)
+            summarize_metrics(conn)
+            logger.info(f"metrics of {len(rows)} batches were sent")
+            return
+        last_send = datetime.datetime.now() - datetime.timedelta(seconds=10)
+        for i, current_data in enumerate(windows):
             with conn.cursor() as curr:
                 calculate_metrics_postgresql(curr, current_data, reference_data)
-            start_index = end_index
             new_send = datetime.datetime.now()
             seconds_elapsed = (new_send - last_send).total_seconds()
             if seconds_elapsed < SEND_TIMEOUT:
                 time.sleep(SEND_TIMEOUT - seconds_elapsed)
             while last_send < new_send:
                 last_send = last_send + datetime.timedelta(seconds=10)
-            logger.info(f"data of the batch {i}/{num_batches} was sent")
+            logger.info(f"data of the batch {i}/{len(windows)} was sent")
+
+
+@task
+def prep_reference(model) -> pd.DataFrame:
+    """The reference announcements of the model, with their predictions"""
+    data = pd.read_parquet("data/reference_data.parquet")
+    data["price_pred"] = model.predict(data[num_features + cat_features])
+    return data[monitored_columns]
+
+
+def prep_rental_rows(rows: list, model) -> pd.DataFrame:
+    """
+    Clean rows of the rental table as clean_data does and predict the
+    announcements priced in millions, those the model is trained on
+    """
+    data = clean_chunk(rental_rows_to_raw(rows))
+    data = data[data["priceUnit"] == "MILLION"].reset_index(drop=True)
+    data["createdAt"] = data["createdAt"].dt.tz_localize(None)
+    data["price_pred"] = model.predict(data[num_features + cat_features])
+    return data[monitored_columns]
+
+
+@flow()
+def streaming_monitoring(
+    window_hours: float = 24,
+    bucket_minutes: float = 10,
+    poll_interval: float = SEND_TIMEOUT,
+    batch_size: int = 1000,
+    max_polls: int | None = None,
+) -> None:
+    """
+    Follow the announcements ingested in the rental table and write the
+    drift metrics of the last `window_hours` to dummy_metrics, for Grafana.
+
+    The table is polled every `poll_interval` seconds from a watermark, the
+    (created_at, id) of the last row read, kept in the crawl_state table
+    under the name `drift_monitor`. Each batch of new rows updates the
+    sliding histograms of drift.StreamingDrift, in buckets of
+    `bucket_minutes`, and one metrics row is written per batch. The
+    histograms are rebuilt at start, and when the best model changes, from
+    the rows of the window before the watermark. `max_polls` stops the
+    monitor after that many polls without new rows.
+    """
+    logger = get_run_logger()
+    prep_db()
+    window = pd.Timedelta(hours=window_hours)
+    polls = 0
+    with connection(rental_db) as rental_conn, connection(metrics_db) as conn:
+        rental_conn.execute(create_table_crawl_state)
+        state = get_crawl_state(rental_conn, "drift_monitor")
+        if state is None:
+            newest = get_watermark(rental_conn) or datetime.datetime.now()
+            state = {
+                "name": "drift_monitor",
+                "status": "running",
+                "watermark": newest - window,
+                "high_watermark": newest - window,
+                "last_page": None,
+                "last_id": 0,
+            }
+        while max_polls is None or polls < max_polls:
+            model = load_model()
+            drift = StreamingDrift(
+                prep_reference(model),
+                num_features,
+                cat_features,
+                "price_pred",
+                window,
+                pd.Timedelta(minutes=bucket_minutes),
+            )
+            position = {"watermark": state["watermark"] - window, "last_id": 0}
+            logger.info(f"Following the rental rows created after {state['watermark']}")
+            while model is load_model() and (max_polls is None or polls < max_polls):
+                with rental_conn.cursor(row_factory=dict_row) as curr:
+                    curr.execute(
+                        select_new_rental_sql, {**position, "limit": batch_size}
+                    )
+                    rows = curr.fetchall()
+                if not rows:
+                    polls += 1
+                    time.sleep(poll_interval)
+                    continue
+                position = {
+                    "watermark": rows[-1]["created_at"],
+                    "last_id": rows[-1]["id"],
+                }
+                data = prep_rental_rows(rows, model)
+                drift.update(data, data["createdAt"])
+                # Rows read before the watermark only rebuild the histograms
+                if (position["watermark"], position["last_id"]) <= (
+                    state["watermark"],
+                    state["last_id"],
+                ):
+                    continue
+                if drift.timestamp is not None:
+                    write_metrics(conn, [(drift.timestamp, *drift.metrics())])
+                state.update(
+                    watermark=position["watermark"],
+                    high_watermark=position["watermark"],
+                    last_id=position["last_id"],
+                )
+                save_crawl_state(rental_conn, state)
+                logger.info(f"metrics of {len(rows)} new rental rows were sent")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+"""
+Open the model of a training run straight from its artifacts, as an
+xgb.Booster and its encoder, without mlflow.pyfunc: no environment checks at
+load time and no DataFrame conversion on each prediction.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+import yaml
+
+from encoder import load_encoder
+
+
+def load_booster(model_dir: Path, nthread: int | None = None) -> xgb.Booster:
+    """
+    Open the Booster logged by mlflow.xgboost in `model_dir` (models_mlflow),
+    whose model file is named in MLmodel, predicting with `nthread` threads
+    if given
+    """
+    model_dir = Path(model_dir)
+    with open(model_dir / "MLmodel") as f_in:
+        flavor = yaml.safe_load(f_in)["flavors"]["xgboost"]
+    booster = xgb.Booster(model_file=str(model_dir / flavor["data"]))
+    if nthread is not None:
+        booster.set_param({"nthread": nthread})
+    return booster
+
+
+class BoosterModel:
+    """The encoder and the booster of a training run"""
+
+    def __init__(self, encoder, booster: xgb.Booster):
+        self.encoder = encoder
+        self.booster = booster
+
+    @classmethod
+    def load(cls, artifacts_dir: Path, nthread: int | None = None):
+        """Open the preprocessor/ and models_mlflow/ artifacts of a run"""
+        artifacts_dir = Path(artifacts_dir)
+        return cls(
+            load_encoder(artifacts_dir / "preprocessor"),
+            load_booster(artifacts_dir / "models_mlflow", nthread),
+        )
+
+    def predict_batch(self, X) -> np.ndarray:
+        """Predict the prices of encoded features, a dense array or a CSR matrix"""
+        return self.booster.inplace_predict(X)
+
+    def predict(self, data: pd.DataFrame) -> np.ndarray:
+        """Predict the prices of announcements, encoding their features"""
+        return self.predict_batch(self.encoder.transform(data))
@@ -0,0 +1,172 @@
+"""
+Prediction service: keeps the best model in memory and predicts the price of
+announcements over HTTP.
+
+    MODEL_DIR=mlruns/282919090807413278/d032f6cdaf864e5286ca13fe404433a7/artifacts \
+        uvicorn predict_service:app --port 9696
+
+The requests arriving together are gathered in one call to the booster.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, suppress
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from native_model import BoosterModel
+
+# The artifacts of the training run: models_mlflow/ and preprocessor/
+MODEL_DIR = Path(os.getenv("MODEL_DIR", "."))
+# Largest number of announcements predicted in one booster call
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 512))
+# How long the first request of a batch waits for others to join it
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", 2))
+# Threads of each booster call, all the cores by default
+NTHREAD = int(os.getenv("NTHREAD")) if os.getenv("NTHREAD") else None
+
+
+class Announcement(BaseModel):
+    """The features of an announcement, the missing ones are left out"""
+
+    location_duree: float | None = None
+    superficie: float | None = None
+    pieces: float | None = None
+    etages: float | None = None
+    category: str | None = None
+    wilaya: str | None = None
+    commune: str | None = None
+
+
+class MicroBatcher:
+    """
+    Gather the rows of the concurrent requests into one prediction, of at
+    most `max_batch_size` rows, run in a thread so the event loop keeps
+    accepting requests meanwhile
+    """
+
+    def __init__(self, predict, max_batch_size: int, max_wait: float):
+        self.predict_rows = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.batch_sizes = deque(maxlen=10_000)
+
+    async def predict(self, rows: list) -> list:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((rows, future))
+        return await future
+
+    async def next_batch(self) -> list:
+        """Wait for a request, then for the ones joining it"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        size = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+        while size < self.max_batch_size:
+            if self.queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self.queue.get_nowait()
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def run(self) -> None:
+        while True:
+            batch = await self.next_batch()
+            rows = [row for request_rows, _ in batch for row in request_rows]
+            self.batch_sizes.append(len(rows))
+            try:
+                prices = await asyncio.to_thread(self.predict_rows, rows)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            start = 0
+            for request_rows, future in batch:
+                if not future.done():
+                    future.set_result(prices[start : start + len(request_rows)])
+                start += len(request_rows)
+
+
+class LatencyStats:
+    """Latencies of the last requests, in milliseconds"""
+
+    def __init__(self, size: int = 10_000):
+        self.latencies = deque(maxlen=size)
+        self.count = 0
+
+    def record(self, seconds: float) -> None:
+        self.latencies.append(seconds * 1000)
+        self.count += 1
+
+    def summary(self) -> dict:
+        p50, p99 = (
+            np.percentile(self.latencies, [50, 99]).tolist()
+            if self.latencies
+            else (None, None)
+        )
+        return {"requests": self.count, "p50_ms": p50, "p99_ms": p99}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    model = BoosterModel.load(MODEL_DIR, NTHREAD)
+
+    def predict(rows: list) -> list:
+        return model.predict(pd.DataFrame.from_records(rows)).tolist()
+
+    app.state.batcher = MicroBatcher(predict, MAX_BATCH_SIZE, MAX_WAIT_MS / 1000)
+    app.state.latency = LatencyStats()
+    worker = asyncio.create_task(app.state.batcher.run())
+    yield
+    worker.cancel()
+    with suppress(asyncio.CancelledError):
+        await worker
+
+
+app = FastAPI(title="real estate dz price prediction", lifespan=lifespan)
+
+
+async def predict_rows(announcements: list) -> list:
+    start = time.perf_counter()
+    rows = [announcement.dict(exclude_none=True) for announcement in announcements]
+    prices = await app.state.batcher.predict(rows)
+    app.state.latency.record(time.perf_counter() - start)
+    return prices
+
+
+@app.post("/predict")
+async def predict(announcement: Announcement) -> dict:
+    """Predict the price of one announcement"""
+    [price] = await predict_rows([announcement])
+    return {"price": price}
+
+
+@app.post("/predict/batch")
+async def predict_batch(announcements: list[Announcement]) -> dict:
+    """Predict the prices of a list of announcements"""
+    return {"prices": await predict_rows(announcements) if announcements else []}
+
+
+@app.get("/metrics")
+async def metrics() -> dict:
+    """Latency percentiles of the last requests and mean batch size"""
+    batch_sizes = app.state.batcher.batch_sizes
+    return {
+        **app.state.latency.summary(),
+        "mean_batch_size": float(np.mean(batch_sizes)) if batch_sizes else None,
+    }
@@ -0,0 +1,173 @@
+"""
+Score the announcements of the rental table with the current best model and
+store their predicted prices in rental_predictions, one row per announcement
+and model run. A rerun only scores the announcements added or edited (with
+another content hash) since the run last scored them.
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+import numpy as np
+from prefect import flow, get_run_logger
+from psycopg.rows import dict_row
+
+from clean_data import clean_chunk, rental_rows_to_raw, select_rental_sql
+from db import DB_PARAMS, connection
+from model_registry import load_run_model, resolve_model
+from train_model import categorical, numerical, run_outlier_bounds
+
+# `price_pred` is NULL for the announcements the model is not trained on, so
+# that they are not read again either
+create_table_predictions = """
+    CREATE TABLE IF NOT EXISTS rental_predictions(
+        id BIGINT,
+        run_id TEXT,
+        content_hash TEXT,
+        price_pred REAL,
+        scored_at TIMESTAMP DEFAULT now(),
+        PRIMARY KEY (id, run_id)
+    );
+"""
+
+PREDICTION_COLUMNS = ["id", "run_id", "content_hash", "price_pred"]
+
+create_predictions_stage = """
+    CREATE TEMP TABLE IF NOT EXISTS rental_predictions_stage
+    (LIKE rental_predictions INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+"""
+
+copy_predictions_sql = (
+    f"COPY rental_predictions_stage({', '.join(PREDICTION_COLUMNS)}) FROM STDIN"
+)
+
+upsert_predictions_sql = f"""
+    INSERT INTO rental_predictions({", ".join(PREDICTION_COLUMNS)})
+    SELECT {", ".join(PREDICTION_COLUMNS)} FROM rental_predictions_stage
+    ON CONFLICT (id, run_id) DO UPDATE SET
+        content_hash = EXCLUDED.content_hash,
+        price_pred = EXCLUDED.price_pred,
+        scored_at = now()
+"""
+
+# The announcements the run never scored, or scored in another version
+select_unscored_sql = (
+    select_rental_sql
+    + """
+    WHERE NOT EXISTS (
+        SELECT 1 FROM rental_predictions p
+        WHERE p.id = rental.id AND p.run_id = %(run_id)s
+            AND p.content_hash IS NOT DISTINCT FROM rental.content_hash
+    )
+"""
+)
+
+
+def iter_unscored_rows(conn, run_id: str, batch_size: int = 5000) -> Iterator[list]:
+    """
+    Stream the rows of the rental table to score with the model of `run_id`
+    in batches, through a server side cursor
+    """
+    with conn.transaction(), conn.cursor(
+        name="score_rental", row_factory=dict_row
+    ) as curr:
+        curr.itersize = batch_size
+        curr.execute(select_unscored_sql, {"run_id": run_id})
+        while rows := curr.fetchmany(batch_size):
+            yield rows
+
+
+def score_rows(model, rows: list, bounds: dict | None = None) -> list:
+    """
+    The predictions (id, content_hash, price_pred) of rows of the rental
+    table, cleaned as clean_data does, price_pred being None for the
+    announcements filtered out of the training data: those not priced in
+    millions, missing a feature, or with a superficie out of the outlier
+    `bounds` of the model (see train_model.outlier_bounds)
+    """
+    data = clean_chunk(rental_rows_to_raw(rows))
+    features = numerical + categorical
+    scored = (data["priceUnit"] == "MILLION") & data[features].notna().all(axis=1)
+    if bounds is not None:
+        lower_bound, upper_bound = bounds["superficie"]
+        inside = data["superficie"].between(lower_bound, upper_bound)
+        scored &= inside.fillna(False).astype(bool)
+    price_pred = np.full(len(data), np.nan)
+    if scored.any():
+        price_pred[scored.to_numpy()] = model.predict(data.loc[scored, features])
+    return [
+        (row["id"], row["content_hash"], None if np.isnan(price) else float(price))
+        for row, price in zip(rows, price_pred)
+    ]
+
+
+def score_batches(
+    model, batches: Iterable[list], n_workers: int = 1, bounds: dict | None = None
+) -> Iterator[list]:
+    """
+    Score batches of rows, in order, in a pool of `n_workers` threads. At
+    most two batches per thread are in flight, so that the table is not read
+    faster than it is scored.
+    """
+    with ThreadPoolExecutor(n_workers) as pool:
+        pending = deque()
+        for rows in batches:
+            pending.append(pool.submit(score_rows, model, rows, bounds))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_predictions(conn, run_id: str, predictions: list) -> int:
+    """
+    COPY predictions into a temporary stage table and merge them into
+    rental_predictions, in one transaction
+    """
+    with conn.transaction(), conn.cursor() as curr:
+        curr.execute(create_predictions_stage)
+        with curr.copy(copy_predictions_sql) as copy:
+            for id_, content_hash, price_pred in predictions:
+                copy.write_row((id_, run_id, content_hash, price_pred))
+        curr.execute(upsert_predictions_sql, prepare=True)
+        return curr.rowcount
+
+
+@flow(name="score rental")
+def score_rental(
+    db_params: dict = DB_PARAMS,
+    run_id: str | None = None,
+    batch_size: int = 5000,
+    n_workers: int = 2,
+) -> int:
+    """
+    Predict the price of the announcements of the rental table with the model
+    of `run_id` (the current best model by default) and write them to
+    rental_predictions.
+
+    The rows to score are streamed in batches of `batch_size`, cleaned and
+    predicted by `n_workers` threads, each booster prediction using its share
+    of the cores, while the scored batches are written back.
+    """
+    logger = get_run_logger()
+    run_id = run_id or resolve_model()
+    nthread = max(1, (os.cpu_count() or 1) // n_workers)
+    model = load_run_model(run_id, nthread)
+    # The superficies out of the bounds of the training data are not predicted
+    bounds = run_outlier_bounds(run_id)
+    if bounds is None:
+        logger.warning(f"No outlier bounds logged by the run {run_id}")
+    with connection(db_params) as conn:
+        conn.execute(create_table_predictions)
+    num_rows = num_scored = 0
+    with connection(db_params) as read_conn, connection(db_params) as write_conn:
+        batches = iter_unscored_rows(read_conn, run_id, batch_size)
+        for predictions in score_batches(model, batches, n_workers, bounds):
+            num_rows += write_predictions(write_conn, run_id, predictions)
+            num_scored += sum(price is not None for _, _, price in predictions)
+    logger.info(
+        f"{num_rows} announcements scored by the run {run_id},"
+        f" {num_scored} of them with a price"
+    )
+    return num_rows
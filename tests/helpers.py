@@ -0,0 +1,185 @@
+"""The reference implementations and data the tests compare the pipeline with"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction import DictVectorizer
+
+from clean_data import clean_chunk, concat_cleaned, iter_chunks
+from drift import DriftEngine
+from encoder import ColumnEncoder
+from tests.synthetic import make_announcements
+from train_model import categorical, numerical
+
+
+def clean_serial(records: list, chunk_size: int) -> pd.DataFrame:
+    """Clean raw announcements chunk after chunk, in this process"""
+    return concat_cleaned(map(clean_chunk, iter_chunks(records, chunk_size)))
+
+
+def make_features(rows: int) -> pd.DataFrame:
+    """
+    The features of cleaned synthetic announcements, as the model sees them:
+    floats, a few zeros (explicitly stored), missing and new values
+    """
+    data = clean_chunk(pd.DataFrame(make_announcements(rows)))
+    data = data[categorical + numerical + ["wilaya"]].dropna()
+    data[numerical] = data[numerical].astype("float64")
+    data.iloc[::97, data.columns.get_loc("etages")] = 0.0
+    data.iloc[::89, data.columns.get_loc("pieces")] = np.nan
+    data["commune"] = data["commune"].cat.add_categories(["Nowhere"])
+    data.iloc[::101, data.columns.get_loc("commune")] = "Nowhere"
+    return data.reset_index(drop=True)
+
+
+def assert_same_matrix(left, right) -> None:
+    """Two CSR matrices hold the same values, stored at the same places"""
+    assert left.shape == right.shape, (left.shape, right.shape)
+    np.testing.assert_array_equal(left.indptr, right.indptr)
+    np.testing.assert_array_equal(left.indices, right.indices)
+    np.testing.assert_array_equal(left.data, right.data)
+
+
+def check_encoder_parity(data: pd.DataFrame, dv: DictVectorizer, columns: list) -> None:
+    """The ColumnEncoder of `dv` encodes the `columns` of `data` as `dv` does"""
+    encoder = ColumnEncoder.from_dict_vectorizer(dv)
+    assert encoder.feature_names_ == dv.feature_names_
+    assert_same_matrix(
+        encoder.transform(data[columns]),
+        dv.transform(data[columns].to_dict(orient="records")),
+    )
+
+
+# The columns of the drift tests, "meuble" has two values for the z-test
+DRIFT_NUM_FEATURES = ["location_duree", "superficie", "pieces", "etages"]
+DRIFT_CAT_FEATURES = ["category", "wilaya", "meuble"]
+DRIFT_WINDOW_SIZE = 50
+# The metrics of Evidently 0.4.1 on make_drift_data, see write_drift_golden
+DRIFT_GOLDEN = Path(__file__).parent / "data" / "drift_evidently.json"
+DRIFT_METRICS = ["prediction_drift", "num_drifted_columns", "share_missing_values"]
+
+
+def make_drift_data(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Announcements with a prediction, drifting after the first half, with
+    missing, infinite and empty values
+    """
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(
+        {
+            # Few values, tested as categories
+            "location_duree": rng.choice([1.0, 3.0, 6.0, 12.0], rows),
+            "superficie": rng.normal(100, 30, rows).round(),
+            "pieces": rng.integers(1, 8, rows).astype("float64"),
+            "etages": rng.integers(0, 11, rows).astype("float64"),
+            "category": pd.Categorical(
+                rng.choice(["Appartement", "Villa", "Studio", "Local", ""], rows)
+            ),
+            "wilaya": pd.Categorical(
+                rng.choice(["Alger", "Oran", "Blida", "Sétif"], rows)
+            ),
+            "meuble": rng.choice(["Meublé", "Vide"], rows),
+        }
+    )
+    data["price_pred"] = (data["superficie"] * 2 + rng.normal(0, 50, rows)).astype(
+        "float32"
+    )
+    drifting = np.arange(rows) >= rows // 2
+    data.loc[drifting, "superficie"] += 40
+    data.loc[drifting & (rng.random(rows) < 0.5), "price_pred"] *= 1.5
+    data.loc[rng.random(rows) < 0.02, "pieces"] = np.nan
+    data.loc[drifting & (rng.random(rows) < 0.01), "superficie"] = np.inf
+    return data
+
+
+def drift_golden_case() -> (pd.DataFrame, dict):
+    """
+    The current windows of the golden drift metrics, and the references they
+    are compared with: under and above the rows Evidently runs tests up to
+    """
+    data = make_drift_data(4000)
+    current = pd.concat([data.iloc[2000:2500], data.iloc[-500:]])
+    references = {"800": data.iloc[:800], "2000": data.iloc[:2000]}
+    return current, references
+
+
+def drift_engine_metrics(reference: pd.DataFrame, current: pd.DataFrame):
+    """The metrics of DriftEngine for each window of `current`"""
+    engine = DriftEngine(
+        reference, DRIFT_NUM_FEATURES, DRIFT_CAT_FEATURES, "price_pred"
+    )
+    return engine.window_metrics(current, DRIFT_WINDOW_SIZE)
+
+
+def evidently_metrics(reference: pd.DataFrame, current: pd.DataFrame) -> list:
+    """The metrics of monitoring.calculate_metrics, window by window"""
+    # Evidently is only needed to check the parity or write the golden file
+    from evidently import ColumnMapping
+    from evidently.metrics import (
+        ColumnDriftMetric,
+        DatasetDriftMetric,
+        DatasetMissingValuesMetric,
+    )
+    from evidently.report import Report
+
+    column_mapping = ColumnMapping(
+        prediction="price_pred",
+        numerical_features=DRIFT_NUM_FEATURES,
+        categorical_features=DRIFT_CAT_FEATURES,
+        target=None,
+    )
+    report = Report(
+        metrics=[
+            ColumnDriftMetric(column_name="price_pred"),
+            DatasetDriftMetric(),
+            DatasetMissingValuesMetric(),
+        ]
+    )
+    metrics = []
+    for start in range(0, len(current), DRIFT_WINDOW_SIZE):
+        report.run(
+            reference_data=reference,
+            current_data=current.iloc[start : start + DRIFT_WINDOW_SIZE],
+            column_mapping=column_mapping,
+        )
+        result = report.as_dict()["metrics"]
+        metrics.append(
+            (
+                result[0]["result"]["drift_score"],
+                result[1]["result"]["number_of_drifted_columns"],
+                result[2]["result"]["current"]["share_of_missing_values"],
+            )
+        )
+    return metrics
+
+
+def assert_drift_metrics(metrics: pd.DataFrame, expected: list) -> None:
+    """The metrics of DriftEngine are the ones Evidently gave"""
+    expected = pd.DataFrame(expected, columns=DRIFT_METRICS)
+    np.testing.assert_allclose(
+        metrics["prediction_drift"], expected["prediction_drift"], rtol=1e-6
+    )
+    np.testing.assert_array_equal(
+        metrics["num_drifted_columns"], expected["num_drifted_columns"]
+    )
+    np.testing.assert_allclose(
+        metrics["share_missing_values"], expected["share_missing_values"]
+    )
+
+
+def write_drift_golden(path: Path = DRIFT_GOLDEN) -> None:
+    """
+    Write the metrics Evidently gives on drift_golden_case, with Evidently
+    0.4.1 installed:
+
+        python -c "from tests.helpers import write_drift_golden; write_drift_golden()"
+    """
+    current, references = drift_golden_case()
+    golden = {
+        rows: evidently_metrics(reference, current)
+        for rows, reference in references.items()
+    }
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "w") as f_out:
+        json.dump(golden, f_out, indent=1)
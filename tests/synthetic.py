@@ -0,0 +1,166 @@
+"""
+Synthetic announcements with the shape of the ouedkniss search API
+(see config/datas.graphql), used to test and benchmark the pipeline offline.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Iterator
+
+WILAYAS = {
+    "Alger": ["Bab Ezzouar", "Hydra", "Kouba", "Cheraga", "Dely Brahim", "Birkhadem"],
+    "Oran": ["Bir El Djir", "Es Senia", "Oran", "Ain Turk"],
+    "Constantine": ["Constantine", "El Khroub", "Hamma Bouziane"],
+    "Blida": ["Blida", "Ouled Yaich", "Boufarik"],
+    "Tizi Ouzou": ["Tizi Ouzou", "Draa Ben Khedda", "Azazga"],
+    "Béjaïa": ["Béjaïa", "Akbou", "Tichy"],
+    "Sétif": ["Sétif", "El Eulma"],
+    "Annaba": ["Annaba", "El Bouni"],
+    "Boumerdès": ["Boumerdès", "Boudouaou", "Corso"],
+    "Tipaza": ["Tipaza", "Kolea", "Bou Ismail"],
+}
+CATEGORIES = [
+    "Appartement",
+    "Villa",
+    "Niveau de villa",
+    "Local",
+    "Studio",
+    "Bungalow",
+    "Terrain",
+    "Hangar",
+]
+PRICE_UNITS = ["MILLION", "MILLION", "MILLION", "UNIT", "BILLION"]
+PRICE_TYPES = ["FIXED", "NEGOTIABLE", "OFFERED"]
+SUPERFICIES = ["{} m²", "{}", "{} m2", "{},5 m²"]
+PIECES = ["F{}", "{}", "{} pièces"]
+ETAGES = ["RDC", "{}", "{}", "{}-{}"]
+DUREES = ["{} mois", "{} mois", "1 an", "{}"]
+PAPERS = ["Acte notarié", "Livret foncier", "Décision", "Papier timbré"]
+
+
+def make_spec(codename: str, value: list) -> dict:
+    return {
+        "specification": {"label": codename, "codename": codename, "type": "text"},
+        "value": value,
+        "valueText": None,
+    }
+
+
+def make_specs(rng: random.Random) -> list:
+    floor = rng.randint(1, 12)
+    specs = [
+        make_spec("superficie", [rng.choice(SUPERFICIES).format(rng.randint(20, 400))]),
+        make_spec("pieces", [rng.choice(PIECES).format(rng.randint(1, 8))]),
+        make_spec("etages", [rng.choice(ETAGES).format(floor, floor + 2)]),
+        make_spec(
+            "location_duree", [rng.choice(DUREES).format(rng.choice([1, 3, 6, 12]))]
+        ),
+        make_spec("papers", rng.sample(PAPERS, rng.randint(1, 2))),
+        make_spec("property-specifications", [rng.choice(["Meublé", "Vide"])]),
+        make_spec("asset-in-a-promotional-site", [rng.choice(["true", "false"])]),
+        make_spec("sale-by-real-estate-agent", [rng.choice(["true", "false"])]),
+        make_spec(
+            "property-payment-conditions",
+            [rng.choice(["Paiement par tranche", "Paiement comptant"])],
+        ),
+    ]
+    # Real announcements rarely fill every specification
+    return [spec for spec in specs if rng.random() > 0.1]
+
+
+def make_announcement(
+    rng: random.Random, announcement_id: int, created_at: datetime
+) -> dict:
+    """One announcement as returned by the SearchQueryWithoutFilters query"""
+    wilaya = rng.choice(list(WILAYAS))
+    commune = rng.choice(WILAYAS[wilaya])
+    has_store = rng.random() < 0.3
+    price = round(rng.lognormvariate(3.5, 0.8), 1)
+    return {
+        "id": str(announcement_id),
+        "title": f"Location {rng.choice(CATEGORIES)} {commune}",
+        "slug": f"location-{announcement_id}",
+        "description": " ".join(rng.choices(["lorem", "ipsum", "dolor"], k=40)),
+        "showAnalytics": rng.random() < 0.5,
+        "createdAt": created_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "isFromStore": has_store,
+        "category": {"name": rng.choice(CATEGORIES)},
+        "likeCount": rng.randint(0, 20),
+        "status": "PUBLISHED",
+        "cities": [
+            {
+                "id": str(rng.randint(1, 1500)),
+                "name": commune,
+                "slug": commune.lower().replace(" ", "-"),
+                "region": {
+                    "id": str(list(WILAYAS).index(wilaya) + 1),
+                    "name": wilaya,
+                    "slug": wilaya.lower().replace(" ", "-"),
+                },
+            }
+        ],
+        "medias": [
+            {"mediaUrl": f"https://cdn.ouedkniss.com/{announcement_id}/{i}.jpg"}
+            for i in range(rng.randint(0, 8))
+        ],
+        "specs": make_specs(rng) if rng.random() > 0.02 else None,
+        "store": {
+            "id": str(rng.randint(1, 500)),
+            "name": "Agence",
+            "slug": f"agence-{rng.randint(1, 500)}",
+            "imageUrl": "https://cdn.ouedkniss.com/store.jpg",
+        }
+        if has_store
+        else None,
+        "user": {"id": str(rng.randint(1, 50000))},
+        "price": price,
+        "pricePreview": round(price),
+        "priceUnit": rng.choice(PRICE_UNITS),
+        "oldPrice": None,
+        "priceType": rng.choice(PRICE_TYPES),
+        "exchangeType": None,
+        "smallDescription": [{"valueText": "120 m²"}],
+    }
+
+
+def make_announcements(
+    n: int, seed: int = 42, newest: datetime = datetime(2023, 9, 1)
+) -> list:
+    """
+    `n` announcements sorted from the most to the least recently refreshed,
+    like the pages of the search API
+    """
+    rng = random.Random(seed)
+    return [
+        make_announcement(rng, 10_000_000 + i, newest - timedelta(minutes=7 * i))
+        for i in range(n)
+    ]
+
+
+def make_pages(announcements: list, count: int = 1000) -> list:
+    """Split announcements in pages, the layout of data/0_raw_data.json"""
+    return [announcements[i : i + count] for i in range(0, len(announcements), count)]
+
+
+def make_page(
+    page: int,
+    count: int = 1000,
+    seed: int = 42,
+    newest: datetime = datetime(2023, 9, 1),
+) -> list:
+    """
+    The `page`-th page (from 1) of `count` announcements of an endless
+    search, generated on its own so that any page can be served or
+    regenerated without the previous ones
+    """
+    rng = random.Random(f"{seed}:{page}")
+    first = (page - 1) * count
+    return [
+        make_announcement(rng, 10_000_000 + i, newest - timedelta(minutes=7 * i))
+        for i in range(first, first + count)
+    ]
+
+
+def iter_pages(n: int, count: int = 1000, seed: int = 42) -> Iterator[list]:
+    """The pages of make_page holding the `n` most recent announcements"""
+    for page in range(1, -(-n // count) + 1):
+        yield make_page(page, count, seed)[: n - (page - 1) * count]
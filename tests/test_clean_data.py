@@ -0,0 +1,124 @@
+import pandas as pd
+import psycopg
+import pyarrow.dataset as ds
+import pytest
+
+from clean_data import (
+    NUMERIC_SPECS,
+    clean_chunks,
+    clean_data,
+    clean_records,
+    concat_cleaned,
+    get_specs,
+    iter_chunks,
+    parse_numeric_spec,
+)
+from db import connection, create_database, database_params
+from tests.helpers import clean_serial
+from tests.synthetic import make_announcements
+from utils import (
+    content_hash,
+    create_table_crawl_state,
+    create_table_rental,
+    ingest_announces,
+    transform_annonce_data,
+)
+
+TEST_DB = database_params("test_clean_data")
+
+
+def spec(codename: str, value: list | None) -> dict:
+    return {
+        "specification": {"label": codename, "codename": codename, "type": "text"},
+        "value": value,
+        "valueText": None,
+    }
+
+
+@pytest.mark.parametrize(
+    "codename, value, expected",
+    [
+        ("etages", "RDC", 0),
+        ("etages", "rez-de-chaussée", 0),
+        ("etages", "3-5", 3),
+        ("etages", "12", 12),
+        ("etages", "x", None),
+        ("superficie", "120 m²", 120),
+        ("superficie", "1 200 m²", 1200),
+        ("superficie", "1.200", 1200),
+        ("superficie", "120,5 m²", 120),
+        ("pieces", "F3", 3),
+        ("pieces", "3 pièces", 3),
+        ("pieces", "10", 10),
+        ("location_duree", "6 mois", 6),
+        ("location_duree", "12 mois", 12),
+        ("location_duree", "1 an", 12),
+        ("location_duree", "2 ans", 24),
+    ],
+)
+def test_parse_numeric_spec(codename, value, expected):
+    assert parse_numeric_spec([value], codename).to_pylist() == [expected]
+
+
+def test_get_specs_numeric_multi_values():
+    column = pd.Series(
+        [
+            [spec("superficie", ["1", "200"]), spec("etages", ["3 5"])],
+            [spec("pieces", ["F3", "F4"]), spec("etages", ["RDC", "2"])],
+            [spec("superficie", []), spec("pieces", None)],
+            None,
+        ]
+    )
+    specs = get_specs(column)
+    expected = pd.DataFrame(
+        {
+            "location_duree": [None, None, None, None],
+            "superficie": [1, None, None, None],
+            "pieces": [None, 3, None, None],
+            "etages": [3, 0, None, None],
+        },
+        dtype="Int64",
+    )
+    pd.testing.assert_frame_equal(specs[list(NUMERIC_SPECS)], expected)
+
+
+def test_parallel_cleaning_matches_serial():
+    records = make_announcements(2000)
+    expected = clean_serial(records, 300)
+    # Shards shared with the workers
+    pd.testing.assert_frame_equal(clean_records(records, 2, 300), expected)
+    # Chunks pickled to the workers
+    pd.testing.assert_frame_equal(
+        concat_cleaned(clean_chunks(iter_chunks(records, 300), 2)), expected
+    )
+
+
+@pytest.fixture
+def rental_db():
+    try:
+        create_database(TEST_DB)
+    except psycopg.OperationalError as e:
+        pytest.skip(f"No database: {e}")
+    with connection(TEST_DB) as conn:
+        conn.execute(create_table_rental + create_table_crawl_state)
+        conn.execute("TRUNCATE rental, crawl_state")
+        yield conn
+
+
+def test_incremental_cleaning_reads_edited_rows_again(rental_db, tmp_path, monkeypatch):
+    # The runs of the instrumented flow are logged out of the repository
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", (tmp_path / "mlruns").as_uri())
+    output_path = tmp_path / "cleaned"
+    annonces = [transform_annonce_data(a) for a in make_announcements(3)]
+    ingest_announces(rental_db, annonces)
+    clean_data(output_path=output_path, db_params=TEST_DB, incremental=True)
+    # Edited, the annonce keeps its created_at and only its content changes
+    edited = {**annonces[0], "description": "edited"}
+    edited["content_hash"] = content_hash(edited)
+    ingest_announces(rental_db, [edited])
+    clean_data(output_path=output_path, db_params=TEST_DB, incremental=True)
+
+    cleaned = ds.dataset(output_path, format="parquet").to_table().to_pandas()
+    assert len(cleaned) == len(annonces) + 1
+    again = cleaned[cleaned["description"] == "edited"]
+    assert again["id"].tolist() == [int(annonces[0]["id"])]
@@ -0,0 +1,153 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from drift import (
+    DriftEngine,
+    SlidingHistogram,
+    StreamingDrift,
+    missing_cells,
+    numeric_values,
+    share_missing,
+)
+from tests.helpers import (
+    DRIFT_GOLDEN,
+    assert_drift_metrics,
+    drift_engine_metrics,
+    drift_golden_case,
+    evidently_metrics,
+)
+
+
+def test_numeric_values_does_not_change_the_column():
+    column = pd.Series([1.0, np.inf, np.nan, -np.inf])
+    values = numeric_values(column)
+    np.testing.assert_array_equal(values, [1.0, np.nan, np.nan, np.nan])
+    np.testing.assert_array_equal(column, [1.0, np.inf, np.nan, -np.inf])
+
+
+def test_missing_cells():
+    np.testing.assert_array_equal(
+        missing_cells(pd.Series([1.0, np.inf, np.nan, -np.inf])),
+        [False, True, True, True],
+    )
+    np.testing.assert_array_equal(
+        missing_cells(pd.Series([1, None], dtype="Int64")), [False, True]
+    )
+    np.testing.assert_array_equal(
+        missing_cells(pd.Series(["a", "", None], dtype="category")),
+        [False, True, True],
+    )
+
+
+def test_share_missing():
+    data = pd.DataFrame(
+        {"x": [1.0, np.inf, 3.0, np.nan, 5.0], "y": ["a", "", "b", "c", None]}
+    )
+    np.testing.assert_allclose(share_missing(data, 2), [2 / 4, 1 / 4, 1 / 2])
+
+
+@pytest.mark.parametrize("reference_rows", ["800", "2000"])
+def test_drift_engine_matches_evidently_golden(reference_rows):
+    # Statistical tests up to 1000 reference rows, distances above
+    with open(DRIFT_GOLDEN) as f_in:
+        expected = json.load(f_in)[reference_rows]
+    current, references = drift_golden_case()
+    metrics = drift_engine_metrics(references[reference_rows], current)
+    assert_drift_metrics(metrics, expected)
+
+
+@pytest.mark.parametrize("reference_rows", ["800", "2000"])
+def test_drift_engine_matches_evidently(reference_rows):
+    pytest.importorskip("evidently")
+    current, references = drift_golden_case()
+    reference = references[reference_rows]
+    metrics = drift_engine_metrics(reference, current)
+    assert_drift_metrics(metrics, evidently_metrics(reference, current))
+
+
+def test_sliding_histogram_counts_the_window():
+    rng = np.random.default_rng(0)
+    num_bins, num_buckets = 4, 5
+    histogram = SlidingHistogram(num_bins, num_buckets)
+    seen = []
+    now = 0
+    for _ in range(300):
+        now += int(rng.integers(0, 3))
+        # Some rows late, some older than the window
+        buckets = now - rng.integers(0, num_buckets + 2, size=5)
+        bins = rng.integers(-1, num_bins, size=5)
+        histogram.add(buckets, bins)
+        seen.extend(zip(buckets, bins))
+        newest = max(bucket for bucket, _ in seen)
+        expected = np.zeros(num_bins, dtype=np.int64)
+        for bucket, bin_ in seen:
+            if bucket > newest - num_buckets and bin_ >= 0:
+                expected[bin_] += 1
+        np.testing.assert_array_equal(histogram.counts, expected)
+
+
+def make_stream(rows: int, seed: int, start: str) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(
+        {
+            "x": rng.normal(size=rows),
+            "c": pd.Series(rng.choice(["a", "b", "c", ""], rows), dtype="category"),
+            "price_pred": rng.normal(size=rows),
+        }
+    )
+    data.loc[::17, "x"] = np.inf
+    data.loc[::13, "price_pred"] = np.nan
+    data["timestamp"] = pd.Timestamp(start) + pd.to_timedelta(
+        np.sort(rng.uniform(0, 20, rows)), unit="h"
+    )
+    return data
+
+
+def make_monitor(reference: pd.DataFrame) -> StreamingDrift:
+    return StreamingDrift(
+        reference,
+        ["x"],
+        ["c"],
+        "price_pred",
+        window=pd.Timedelta(hours=24),
+        bucket=pd.Timedelta(minutes=10),
+    )
+
+
+def test_streaming_drift_keeps_the_last_window():
+    reference = make_stream(1000, 0, "2023-08-01")
+    yesterday = make_stream(500, 1, "2023-08-02")
+    today = make_stream(500, 2, "2023-08-03 12:00")
+    columns = ["x", "c", "price_pred"]
+
+    monitor = make_monitor(reference)
+    for start in range(0, 500, 100):
+        for batch in [yesterday[start : start + 100], today[start : start + 100]]:
+            monitor.update(batch[columns], batch["timestamp"])
+    only_today = make_monitor(reference)
+    only_today.update(today[columns], today["timestamp"])
+    # The rows of yesterday are older than the window once today streamed in
+    assert monitor.metrics() == pytest.approx(only_today.metrics())
+    _, _, share = monitor.metrics()
+    assert share == pytest.approx(share_missing(today[columns], len(today))[0])
+    # The streamed data is left as it was
+    assert np.isinf(today["x"].iloc[0])
+
+
+def test_streaming_and_backfill_count_the_same_missing_values():
+    reference = make_stream(1000, 0, "2023-08-01")
+    today = make_stream(500, 2, "2023-08-03")
+    # A column that is neither a feature nor the prediction, as the timestamp
+    today["note"] = np.where(np.arange(500) % 3 == 0, None, "x")
+    columns = ["timestamp", "x", "c", "price_pred", "note"]
+
+    monitor = make_monitor(reference)
+    monitor.update(today[columns], today["timestamp"])
+    engine = DriftEngine(reference, ["x"], ["c"], "price_pred")
+    backfill = engine.window_metrics(today[columns], len(today))
+    assert monitor.metrics()[2] == pytest.approx(
+        backfill["share_missing_values"].iloc[0]
+    )
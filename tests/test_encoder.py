@@ -0,0 +1,38 @@
+import pickle
+
+import pytest
+from sklearn.feature_extraction import DictVectorizer
+
+from encoder import ColumnEncoder
+from tests.helpers import check_encoder_parity, make_features
+from train_model import categorical, numerical
+
+# The DictVectorizer pickled by the training run of the repository
+RUN_DV = (
+    "mlruns/282919090807413278/d032f6cdaf864e5286ca13fe404433a7"
+    "/artifacts/preprocessor/DictVectorizer.b"
+)
+
+
+@pytest.fixture(scope="module")
+def data():
+    return make_features(3000)
+
+
+def test_fitted_encoder_matches_dict_vectorizer(data):
+    columns = categorical + numerical
+    train = data.dropna()
+    dv = DictVectorizer().fit(train[columns].to_dict(orient="records"))
+    assert ColumnEncoder.fit(train, columns).feature_names_ == dv.feature_names_
+    check_encoder_parity(data, dv, columns)
+
+
+@pytest.mark.parametrize(
+    "columns",
+    [numerical + ["category", "wilaya"], numerical + ["category"]],
+    ids=["unknown column", "missing column"],
+)
+def test_encoder_matches_the_dict_vectorizer_of_a_run(data, columns):
+    with open(RUN_DV, "rb") as f_in:
+        run_dv = pickle.load(f_in)
+    check_encoder_parity(data, run_dv, columns)
@@ -0,0 +1,48 @@
+import asyncio
+
+import aiohttp
+import pytest
+from gql.transport.exceptions import TransportQueryError, TransportServerError
+
+from fetch_data import TokenBucket, is_retryable
+
+
+@pytest.mark.parametrize(
+    "error, retryable",
+    [
+        (aiohttp.ClientConnectionError(), True),
+        (asyncio.TimeoutError(), True),
+        (TransportServerError("Bad gateway", 502), True),
+        (TransportServerError("Too many requests", 429), True),
+        (TransportServerError("Bad request", 400), False),
+        (TransportQueryError("Unknown field"), False),
+    ],
+)
+def test_is_retryable(error, retryable):
+    assert is_retryable(error) == retryable
+
+
+def test_token_bucket_rate():
+    now = 0.0
+    waits = []
+
+    async def sleep(seconds: float) -> None:
+        waits.append(seconds)
+
+    bucket = TokenBucket(rate=50, capacity=5, clock=lambda: now, sleep=sleep)
+
+    async def acquire(n: int) -> None:
+        await asyncio.gather(*(bucket.acquire() for _ in range(n)))
+
+    async def acquire_all() -> None:
+        nonlocal now
+        # The burst of 5 is free, the 25 others wait their turn at 50 per second
+        await acquire(30)
+        assert waits == pytest.approx([k / 50 for k in range(1, 26)])
+        # Long after, the bucket is full again but holds `capacity` tokens only
+        now = 10.0
+        waits.clear()
+        await acquire(6)
+        assert waits == pytest.approx([1 / 50])
+
+    asyncio.run(acquire_all())
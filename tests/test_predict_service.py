@@ -0,0 +1,103 @@
+import asyncio
+from contextlib import suppress
+
+import predict_service
+from predict_service import MicroBatcher
+
+
+def double(rows: list) -> list:
+    return [2 * row["x"] for row in rows]
+
+
+async def with_batcher(batcher: MicroBatcher, scenario):
+    """Run `scenario` while the worker of `batcher` predicts"""
+    worker = asyncio.create_task(batcher.run())
+    try:
+        return await scenario
+    finally:
+        worker.cancel()
+        with suppress(asyncio.CancelledError):
+            await worker
+
+
+def test_results_go_back_to_their_request():
+    batcher = MicroBatcher(double, max_batch_size=100, max_wait=1)
+    requests = [[{"x": 1}, {"x": 2}], [{"x": 3}], [{"x": 4}, {"x": 5}, {"x": 6}]]
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.predict(rows) for rows in requests))
+
+    results = asyncio.run(with_batcher(batcher, scenario()))
+    assert results == [[2, 4], [6], [8, 10, 12]]
+    # Queued together, the requests are predicted at once
+    assert list(batcher.batch_sizes) == [6]
+
+
+def test_batches_stop_at_max_batch_size():
+    batcher = MicroBatcher(double, max_batch_size=4, max_wait=0.05)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.predict([{"x": x}]) for x in range(10)))
+
+    results = asyncio.run(with_batcher(batcher, scenario()))
+    assert results == [[2 * x] for x in range(10)]
+    assert list(batcher.batch_sizes) == [4, 4, 2]
+
+
+def test_batches_wait_until_the_deadline_only():
+    batcher = MicroBatcher(double, max_batch_size=100, max_wait=0.05)
+
+    async def scenario():
+        first = asyncio.create_task(batcher.predict([{"x": 1}]))
+        await asyncio.sleep(0.5)
+        # Predicted alone once its wait was over, before the next request
+        assert first.done()
+        return [await first, await batcher.predict([{"x": 2}])]
+
+    assert asyncio.run(with_batcher(batcher, scenario())) == [[2], [4]]
+    assert list(batcher.batch_sizes) == [1, 1]
+
+
+def test_a_failed_prediction_reaches_every_request():
+    calls = []
+
+    def fail_once(rows: list) -> list:
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise ValueError("booster failed")
+        return double(rows)
+
+    batcher = MicroBatcher(fail_once, max_batch_size=100, max_wait=1)
+
+    async def scenario():
+        failed = await asyncio.gather(
+            *(batcher.predict([{"x": x}]) for x in range(3)), return_exceptions=True
+        )
+        # The worker keeps serving the next requests
+        return failed, await batcher.predict([{"x": 5}])
+
+    failed, result = asyncio.run(with_batcher(batcher, scenario()))
+    assert all(isinstance(error, ValueError) for error in failed)
+    assert len(failed) == 3
+    assert result == [10]
+    assert calls == [3, 1]
+
+
+class DoublingModel:
+    def predict(self, data):
+        return 2 * data["superficie"]
+
+
+def test_lifespan_stops_the_worker(monkeypatch):
+    monkeypatch.setattr(
+        predict_service.BoosterModel, "load", lambda *args: DoublingModel()
+    )
+    app = predict_service.app
+
+    async def serve():
+        async with predict_service.lifespan(app):
+            price = await app.state.batcher.predict([{"superficie": 60.0}])
+        # The worker is done once the application shut down
+        return price, asyncio.all_tasks() - {asyncio.current_task()}
+
+    assert asyncio.run(serve()) == ([120.0], set())
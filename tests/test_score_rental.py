@@ -0,0 +1,41 @@
+import json
+from datetime import datetime
+
+import numpy as np
+
+from clean_data import clean_chunk, rental_rows_to_raw
+from score_rental import score_rows
+from tests.synthetic import make_announcements
+from utils import transform_annonce_data
+
+
+class ConstantModel:
+    def predict(self, data):
+        return np.ones(len(data))
+
+
+def rental_row(annonce: dict) -> dict:
+    """An announcement as read from the rental table"""
+    row = transform_annonce_data(annonce)
+    return {
+        **row,
+        "id": int(row["id"]),
+        "created_at": datetime.fromisoformat(row["created_at"].rstrip("Z")),
+        "specs": json.loads(row["specs"]) if row["specs"] else None,
+    }
+
+
+def test_score_rows_skips_the_superficie_outliers():
+    rows = [rental_row(annonce) for annonce in make_announcements(300)]
+    unbounded = score_rows(ConstantModel(), rows)
+    bounds = {"price": [0, 1e9], "superficie": [50, 150]}
+    bounded = score_rows(ConstantModel(), rows, bounds)
+
+    superficie = clean_chunk(rental_rows_to_raw(rows))["superficie"]
+    inside = [
+        id_
+        for (id_, _, price), value in zip(unbounded, superficie)
+        if price is not None and 50 <= value <= 150
+    ]
+    assert 0 < len(inside) < sum(price is not None for _, _, price in unbounded)
+    assert [id_ for id_, _, price in bounded if price is not None] == inside
@@ -0,0 +1,32 @@
+import os
+
+import pandas as pd
+
+from tests.helpers import clean_serial
+from tests.synthetic import make_announcements
+from train_model import feature_engineering, prune_cache
+
+
+def test_prune_cache_keeps_the_most_recent(tmp_path):
+    for age, name in enumerate(["d", "c", "b", "a"]):
+        (tmp_path / name).mkdir()
+        os.utime(tmp_path / name, (1000 - age, 1000 - age))
+    (tmp_path / "e.tmp").mkdir()
+    prune_cache(tmp_path, keep=2)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["c", "d", "e.tmp"]
+
+
+def test_feature_engineering_reuses_the_outlier_bounds(tmp_path):
+    path = tmp_path / "cleaned.parquet"
+    clean_serial(make_announcements(3000), 1000).to_parquet(path)
+    data, bounds = feature_engineering.fn(path)
+    assert list(bounds) == ["price", "superficie"]
+    since = data["createdAt"].quantile(0.9)
+    new_data, new_bounds = feature_engineering.fn(path, since=since, bounds=bounds)
+    assert new_bounds == bounds
+    # The same announcements as filtered with the whole history
+    columns = list(data.columns)
+    pd.testing.assert_frame_equal(
+        new_data.sort_values(columns).reset_index(drop=True),
+        data[data["createdAt"] >= since].sort_values(columns).reset_index(drop=True),
+    )
@@ -1,23 +1,53 @@
-import pickle
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date
 from pathlib import Path
 
 import mlflow
 import numpy as np
 import pandas as pd
 import scipy
-import sklearn
 import xgboost as xgb
-from hyperopt import STATUS_OK, Trials, fmin, hp, tpe
+from hyperopt import JOB_STATE_DONE, STATUS_OK, Trials, fmin, hp, space_eval, tpe
+from hyperopt.base import Domain
 from hyperopt.pyll import scope
+from mlflow.exceptions import MlflowException
 from prefect import flow, task
-from sklearn.feature_extraction import DictVectorizer
 from sklearn.metrics import mean_absolute_percentage_error, mean_squared_error
 
+from clean_data import read_cleaned_data
+from encoder import ENCODER_VERSION, ColumnEncoder
+from instrumentation import instrument, instrument_flow
+from model_registry import (
+    EXPERIMENT_NAME,
+    alias_run,
+    load_run_model,
+    register_best_model,
+    resolve_model,
+)
+
+categorical = ["category", "commune"]
+numerical = ["location_duree", "superficie", "pieces", "etages"]
+
+# The encoded training data, saved once for each version of the cleaned data
+# and of the encoding (see training_cache_dir)
+CACHE_DIR = Path("data/cache")
+# The number of cache directories kept, the least recently used are deleted
+CACHE_KEEP = 3
+
 
 @task
+@instrument()
 def feature_engineering(
-    path_cleaned_data=Path("data/1_cleaned_data.parquet"),
-) -> pd.DataFrame:
+    path_cleaned_data=Path("data/1_cleaned_data"),
+    months: int | None = None,
+    since: pd.Timestamp | None = None,
+    bounds: dict | None = None,
+) -> (pd.DataFrame, dict):
     """
     Prepare the data for machines learning models. More precisely:
         - Choose the target and features
@@ -25,28 +55,45 @@ def feature_engineering(
         - Dealing with outliers
 
     Args:
-        path_cleaned_data: The path of the 1_cleaned_data file
+        path_cleaned_data: The path of the 1_cleaned_data dataset
+        months: Only keep the announcements of the last `months` months
+        since: Only keep the announcements created after `since`
+        bounds: The outlier bounds to apply, those of the model trained on
+            (see outlier_bounds), computed on the data when not given
 
     Returns:
         data: The cleaned dataframe.
+        bounds: The outlier bounds applied
 
     TODO:
         - improving outliers dealing methode
         - make some transformation on the target and some features
     """
+    # Choose the target and features
+    target = ["price"]
+    features_num = ["location_duree", "superficie", "pieces", "etages"]
+    features_cat = ["category", "wilaya", "commune"]
 
-    # Prepare data
-    data_cleaned = pd.read_parquet(path_cleaned_data)
+    # Prepare data, reading only the needed columns and months
+    if months is not None:
+        since = pd.Timestamp.now(tz="UTC") - pd.DateOffset(months=months)
+    data_cleaned = read_cleaned_data(
+        path_cleaned_data,
+        columns=[
+            "createdAt",
+            "priceUnit",
+            *features_num,
+            *features_cat,
+            *target,
+        ],
+        since=since,
+    )
 
     # Keep only annoncement with "priceUnit == MILLION"
     data_cleaned = data_cleaned[data_cleaned["priceUnit"] == "MILLION"]
 
     # Delete ligne where the price == 1
     data_cleaned = data_cleaned[(data_cleaned["price"] > 1)]
-    # Choose the target and features
-    target = ["price"]
-    features_num = ["location_duree", "superficie", "pieces", "etages"]
-    features_cat = ["category", "wilaya", "commune"]
 
     # Create new data frame with selected features
     data = data_cleaned[["createdAt"] + features_num + features_cat + target]
@@ -55,15 +102,10 @@ def feature_engineering(
     data.dropna(inplace=True)
 
     # Dealing with outliers
-    factor = 1.5
+    if bounds is None:
+        bounds = outlier_bounds(data)
     replace_with = None
-    for feature in ["price", "superficie"]:
-        Q1 = data[feature].quantile(0.25)
-        Q3 = data[feature].quantile(0.75)
-        IQR = Q3 - Q1
-        lower_bound = Q1 - factor * IQR
-        upper_bound = Q3 + factor * IQR
-
+    for feature, (lower_bound, upper_bound) in bounds.items():
         # Identify and potentially replace outliers
         outliers = (data[feature] < lower_bound) | (
             data[feature] > upper_bound
@@ -74,10 +116,33 @@ def feature_engineering(
             data = data[~outliers]
 
     data.sort_values(by="createdAt", ascending=True, inplace=True)
-    return data
+    return data, bounds
+
+
+def outlier_bounds(data: pd.DataFrame, factor: float = 1.5) -> dict:
+    """
+    The bounds beyond which the values of the price and of the superficie
+    are outliers: `factor` IQR below the first quartile or above the third
+    """
+    bounds = {}
+    for feature in ["price", "superficie"]:
+        Q1 = data[feature].quantile(0.25)
+        Q3 = data[feature].quantile(0.75)
+        IQR = Q3 - Q1
+        bounds[feature] = [float(Q1 - factor * IQR), float(Q3 + factor * IQR)]
+    return bounds
+
+
+def run_outlier_bounds(run_id: str) -> dict | None:
+    """The outlier bounds logged by a training run, None for the older runs"""
+    try:
+        return mlflow.artifacts.load_dict(f"runs:/{run_id}/outlier_bounds.json")
+    except (MlflowException, OSError):
+        return None
 
 
 @task
+@instrument(rows="data")
 def prepare_data(
     data: pd.DataFrame,
 ) -> (
@@ -85,7 +150,7 @@ def prepare_data(
     scipy.sparse._csr.csr_matrix,
     np.ndarray,
     np.ndarray,
-    sklearn.feature_extraction.DictVectorizer,
+    ColumnEncoder,
 ):
     """
     Prepare the data for the XGboost model
@@ -102,57 +167,285 @@ def prepare_data(
     df_val = data[num_rows_train:]
     df_val.to_parquet("data/reference_data.parquet")
 
-    categorical = ["category", "commune"]
-    numerical = ["location_duree", "superficie", "pieces", "etages"]
-
     # Vectorize categorical values in order to prepare data for xgboost
-    dv = DictVectorizer()
-    train_dicts = df_train[categorical + numerical].to_dict(orient="records")
-    X_train = dv.fit_transform(train_dicts)
-    val_dicts = df_val[categorical + numerical].to_dict(orient="records")
-    X_val = dv.transform(val_dicts)
+    encoder = ColumnEncoder.fit(df_train, categorical + numerical)
+    X_train = encoder.transform(df_train)
+    X_val = encoder.transform(df_val)
     y_train = df_train["price"].values
     y_val = df_val["price"].values
-    return X_train, X_val, y_train, y_val, dv
+    return X_train, X_val, y_train, y_val, encoder
 
 
-def objective(params, train, valid, y_val):
+def training_cache_dir(
+    path_cleaned_data=Path("data/1_cleaned_data"), months: int | None = None
+) -> Path:
     """
-    Create an objectif func for hypt in ordre to found best hyperparameters
+    The cache directory of the training data prepared from
+    `path_cleaned_data`, named after a fingerprint of its files (name, size
+    and modification time) and of the encoding
     """
+    path = Path(path_cleaned_data)
+    files = sorted(path.rglob("*.parquet")) if path.is_dir() else [path]
+    fingerprint = hashlib.sha256()
+    for file in files:
+        stat = file.stat()
+        name = file.relative_to(path) if path.is_dir() else file.name
+        fingerprint.update(
+            f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode()
+        )
+    config = {
+        "encoder": ENCODER_VERSION,
+        "categorical": categorical,
+        "numerical": numerical,
+        "months": months,
+        # The caches written before outlier_bounds.json are not reused
+        "outlier_bounds": True,
+        # The last `months` months change every day
+        "today": str(date.today()) if months is not None else None,
+    }
+    fingerprint.update(json.dumps(config).encode())
+    return CACHE_DIR / fingerprint.hexdigest()[:16]
+
+
+@task
+def save_training_data(
+    cache_dir: Path,
+    X_train: scipy.sparse._csr.csr_matrix,
+    X_val: scipy.sparse._csr.csr_matrix,
+    y_train: np.ndarray,
+    y_val: np.ndarray,
+    encoder: ColumnEncoder,
+    bounds: dict,
+) -> Path:
+    """
+    Save the training and validation data as XGBoost binary buffers in
+    `cache_dir`, with the encoder, the outlier bounds and the reference data
+    of monitoring
+    """
+    tmp_dir = cache_dir.with_name(f"{cache_dir.name}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    xgb.DMatrix(X_train, label=y_train).save_binary(
+        str(tmp_dir / "train.buffer")
+    )
+    xgb.DMatrix(X_val, label=y_val).save_binary(str(tmp_dir / "valid.buffer"))
+    # The labels of the buffers are float32, the metrics use the originals
+    np.save(tmp_dir / "y_val.npy", y_val)
+    encoder.save(tmp_dir / "encoder.json")
+    with open(tmp_dir / "outlier_bounds.json", "w") as f_out:
+        json.dump(bounds, f_out)
+    shutil.copy("data/reference_data.parquet", tmp_dir)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    tmp_dir.rename(cache_dir)
+    prune_cache(cache_dir.parent)
+    return cache_dir
+
+
+def prune_cache(cache_root: Path = CACHE_DIR, keep: int = CACHE_KEEP) -> None:
+    """
+    Delete the cache directories of `cache_root` but the `keep` most recently
+    written or used (the ones still being written are left alone)
+    """
+    cache_dirs = [
+        path
+        for path in cache_root.iterdir()
+        if path.is_dir() and path.suffix != ".tmp"
+    ]
+    cache_dirs.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in cache_dirs[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_training_data(
+    cache_dir: Path,
+) -> (xgb.DMatrix, xgb.DMatrix, np.ndarray):
+    """The training and validation DMatrix saved in `cache_dir`, and y_val"""
+    train = xgb.DMatrix(str(cache_dir / "train.buffer"))
+    valid = xgb.DMatrix(str(cache_dir / "valid.buffer"))
+    return train, valid, np.load(cache_dir / "y_val.npy")
+
+
+# Successive halving: at each rung (number of boosting rounds), a trial only
+# goes on if its validation rmse is in the best 1 / PRUNING_ETA of the ones
+# the previous trials had at this rung
+PRUNING_RUNGS = (25, 75, 225, 675)
+PRUNING_ETA = 3
+
+
+class RungPruner(xgb.callback.TrainingCallback):
+    """Stop the training of a trial whose score is losing at a rung"""
+
+    def __init__(self, thresholds: dict):
+        self.thresholds = thresholds
+        self.scores = {}
+        self.pruned = False
+
+    def after_iteration(self, model, epoch, evals_log) -> bool:
+        rounds = epoch + 1
+        if rounds in PRUNING_RUNGS:
+            score = list(evals_log["validation"].values())[-1][-1]
+            self.scores[rounds] = score
+            if score > self.thresholds.get(rounds, float("inf")):
+                self.pruned = True
+                return True
+        return False
+
+
+def rung_thresholds(rung_scores: dict) -> dict:
+    """The score to beat at each rung, once enough trials reached it"""
+    return {
+        rung: float(np.quantile(scores, 1 / PRUNING_ETA))
+        for rung, scores in rung_scores.items()
+        if len(scores) >= PRUNING_ETA
+    }
+
+
+def train_trial(
+    params, train, valid, y_val, thresholds: dict, verbose_eval=True
+) -> dict:
+    """Train and evaluate the model of a trial, pruned when losing"""
+    pruner = RungPruner(thresholds)
+    booster = xgb.train(
+        params=params,
+        dtrain=train,
+        num_boost_round=1000,
+        evals=[(valid, "validation")],
+        early_stopping_rounds=50,
+        # early_stopping_rounds=2
+        callbacks=[pruner],
+        verbose_eval=verbose_eval,
+    )
+    y_pred = booster.predict(valid)
+    rmse = mean_squared_error(y_val, y_pred, squared=False)
+    mape = mean_absolute_percentage_error(y_val, y_pred)
+    return {
+        "loss": rmse,
+        "mape": mape,
+        "status": STATUS_OK,
+        "pruned": pruner.pruned,
+        "rung_scores": pruner.scores,
+    }
+
+
+def log_trial(params: dict, result: dict, rung_scores: dict) -> dict:
+    """Log a trial in its own MLflow run and keep its scores at the rungs"""
+    for rung, score in result.pop("rung_scores").items():
+        rung_scores.setdefault(rung, []).append(score)
     with mlflow.start_run():
         mlflow.set_tag("model", "xgboost")
+        mlflow.set_tag("pruned", result["pruned"])
         mlflow.log_params(params)
-        booster = xgb.train(
-            params=params,
-            dtrain=train,
-            num_boost_round=1000,
-            evals=[(valid, "validation")],
-            early_stopping_rounds=50
-            # early_stopping_rounds=2
-        )
-        y_pred = booster.predict(valid)
-        rmse = mean_squared_error(y_val, y_pred, squared=False)
-        mape = mean_absolute_percentage_error(y_val, y_pred)
-        mlflow.log_metric("mape", mape)
-        mlflow.log_metric("rmse", rmse)
+        mlflow.log_metric("mape", result["mape"])
+        mlflow.log_metric("rmse", result["loss"])
+    return result
 
-    return {"loss": rmse, "mape": mape, "status": STATUS_OK}
+
+@instrument()
+def objective(params, train, valid, y_val, rung_scores: dict, prune=True):
+    """
+    Create an objectif func for hypt in ordre to found best hyperparameters
+    """
+    thresholds = rung_thresholds(rung_scores) if prune else {}
+    result = train_trial(params, train, valid, y_val, thresholds)
+    return log_trial(params, result, rung_scores)
+
+
+# The training data of the trials run by a worker process of parallel_search
+_trial_data = {}
+
+
+def _init_trial_worker(cache_dir: Path) -> None:
+    train, valid, y_val = load_training_data(cache_dir)
+    _trial_data.update(train=train, valid=valid, y_val=y_val)
+
+
+def run_trial(params: dict, thresholds: dict) -> dict:
+    """Train a trial of parallel_search in a worker process"""
+    return train_trial(
+        params,
+        _trial_data["train"],
+        _trial_data["valid"],
+        _trial_data["y_val"],
+        thresholds,
+        verbose_eval=False,
+    )
+
+
+def parallel_search(
+    search_space: dict,
+    cache_dir: Path,
+    max_evals: int,
+    n_workers: int,
+    prune: bool = True,
+) -> dict:
+    """
+    TPE search with `n_workers` trials trained at once in a process pool.
+
+    The trials are asked to hyperopt one at a time as workers free up (the
+    running ones count as infinite losses for TPE), and told their result
+    when done. Each trial is pruned with the rung scores of the trials done
+    before it started.
+    """
+    domain = Domain(lambda params: None, search_space)
+    trials = Trials()
+    rng = np.random.default_rng(42)
+    rung_scores = {}
+    pending = {}
+    with ProcessPoolExecutor(
+        n_workers,
+        # Forking a process which already used OpenMP can hang xgboost
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_trial_worker,
+        initargs=(cache_dir,),
+    ) as pool:
+        while pending or len(trials.trials) < max_evals:
+            while len(pending) < n_workers and len(trials.trials) < max_evals:
+                [trial] = tpe.suggest(
+                    trials.new_trial_ids(1),
+                    domain,
+                    trials,
+                    rng.integers(2**31 - 1),
+                )
+                trials.insert_trial_docs([trial])
+                trials.refresh()
+                vals = {k: v[0] for k, v in trial["misc"]["vals"].items() if v}
+                params = space_eval(search_space, vals)
+                thresholds = rung_thresholds(rung_scores) if prune else {}
+                future = pool.submit(run_trial, params, thresholds)
+                pending[future] = trial, params
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial, params = pending.pop(future)
+                trial["result"] = log_trial(
+                    params, future.result(), rung_scores
+                )
+                trial["state"] = JOB_STATE_DONE
+            trials.refresh()
+    pruned = sum(trial["result"]["pruned"] for trial in trials.trials)
+    print(f"{pruned}/{len(trials.trials)} trials pruned")
+    return trials.argmin
 
 
 @task(log_prints=True)
+@instrument()
 def found_best_model(
-    X_train: scipy.sparse._csr.csr_matrix,
-    X_val: scipy.sparse._csr.csr_matrix,
-    y_train: np.ndarray,
-    y_val: np.ndarray,
+    cache_dir: Path,
+    max_evals: int = 50,
+    n_workers: int = 1,
+    nthread: int | None = None,
+    prune: bool = True,
 ) -> dict:
     """
     Found the best xgboost hyperparameters
-    """
-    train = xgb.DMatrix(X_train, label=y_train)
-    valid = xgb.DMatrix(X_val, label=y_val)
 
+    Args:
+        cache_dir: The training data saved by save_training_data
+        max_evals: Number of trials
+        n_workers: Number of trials trained at once, in worker processes
+        nthread: Threads of each trial, the cores shared between the
+            workers by default
+        prune: Stop the trials which are losing at a rung (PRUNING_RUNGS)
+    """
     search_space = {
         "max_depth": scope.int(hp.quniform("max_depth", 2, 200, 1)),
         "learning_rate": hp.loguniform("learning_rate", -10, 0),
@@ -166,31 +459,48 @@ def found_best_model(
         ),  # Ajouter colsample_bytree
         "gamma": hp.loguniform("gamma", -5, 1),  # Ajouter gamma
     }
+    if n_workers > 1 and nthread is None:
+        nthread = max(1, (os.cpu_count() or 1) // n_workers)
+    if nthread is not None:
+        search_space["nthread"] = nthread
+
+    if n_workers > 1:
+        return parallel_search(
+            search_space,
+            cache_dir,
+            max_evals,
+            n_workers,
+            prune,
+        )
 
+    train, valid, y_val = load_training_data(cache_dir)
+    rung_scores = {}
     # Saving best results
     best_params = fmin(
-        fn=lambda params: objective(params, train, valid, y_val),
+        fn=lambda params: objective(
+            params, train, valid, y_val, rung_scores, prune
+        ),
         space=search_space,
         algo=tpe.suggest,
-        max_evals=50,
+        max_evals=max_evals,
         trials=Trials(),
     )
     return best_params
 
 
 @task(log_prints=True)
-def train_best_model(
-    X_train: scipy.sparse._csr.csr_matrix,
-    X_val: scipy.sparse._csr.csr_matrix,
-    y_train: np.ndarray,
-    y_val: np.ndarray,
-    dv: sklearn.feature_extraction.DictVectorizer,
-    best_params: dict,
-) -> None:
+@instrument()
+def train_best_model(cache_dir: Path, best_params: dict) -> None:
     """train a model with best hyperparams and write everything out"""
-    train = xgb.DMatrix(X_train, label=y_train)
-    valid = xgb.DMatrix(X_val, label=y_val)
+    train, valid, y_val = load_training_data(cache_dir)
+    encoder = ColumnEncoder.load(cache_dir / "encoder.json")
+    # The date of the last announcement trained on, incremental_flow
+    # continues from it
+    train_until = pd.read_parquet(
+        cache_dir / "reference_data.parquet", columns=["createdAt"]
+    )["createdAt"].max()
     with mlflow.start_run():
+        mlflow.set_tag("train_until", train_until.isoformat())
         mlflow.log_params(best_params)
         booster = xgb.train(
             params=best_params,
@@ -207,40 +517,191 @@ def train_best_model(
         mlflow.log_metric("mape", mape)
 
         Path("models").mkdir(exist_ok=True)
-        with open("models/DictVectorizer.b", "wb") as f_out:
-            pickle.dump(dv, f_out)
+        encoder.save("models/encoder.json")
 
         # with open ('models/xgboost.bin', 'wb') as f_out:
         #     pickle.dump ( booster, f_out)
         mlflow.log_artifact(
-            "models/DictVectorizer.b", artifact_path="preprocessor"
+            "models/encoder.json", artifact_path="preprocessor"
         )
-        mlflow.xgboost.log_model(booster, artifact_path="models_mlflow")
+        # incremental_flow filters the new announcements with them
+        mlflow.log_artifact(cache_dir / "outlier_bounds.json")
+        model_info = mlflow.xgboost.log_model(
+            booster, artifact_path="models_mlflow"
+        )
+        # The alias only moves if the new model beats the current one on the
+        # same validation data
+        champion = alias_run()
+        if champion is not None:
+            df_val = pd.read_parquet(cache_dir / "reference_data.parquet")
+            rmse_champion = mean_squared_error(
+                y_val, load_run_model(champion).predict(df_val), squared=False
+            )
+            print(f"rmse of the current model {champion}: {rmse_champion:.2f}")
+        if champion is None or rmse < rmse_champion:
+            register_best_model(model_info.model_uri)
+        else:
+            print(f"Keeping the current model, rmse of the new one: {rmse:.2f}")
 
-    # this code is saving the  object (`dv`) and the trained XGBoost
-    # model (`booster`) as binary files using the pickle module.
+    # this code is saving the encoder (`encoder`) as json and the trained
+    # XGBoost model (`booster`) as an mlflow model.
 
     return None
 
 
+def run_params(run: mlflow.entities.Run) -> dict:
+    """The xgboost params logged by a run, parsed back from strings"""
+    params = {}
+    for name, value in run.data.params.items():
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+
+@task(log_prints=True)
+def warm_start_model(
+    run: mlflow.entities.Run,
+    data: pd.DataFrame,
+    bounds: dict,
+    num_boost_round: int = 200,
+    tolerance: float = 0.1,
+) -> bool:
+    """
+    Continue boosting the model of `run` on the new announcements `data`,
+    the last 20% of them held out for validation. The result is registered
+    if it improves on the model, with the outlier `bounds` data was
+    filtered with.
+
+    Returns:
+        False when the model degraded on the new announcements by more than
+        `tolerance` of its rmse, so that a full training is needed
+    """
+    # The vocabulary is kept, new communes are left to the next full training
+    model = load_run_model(run.info.run_id)
+    encoder, booster = model.encoder, model.booster
+
+    num_rows_train = int(0.8 * len(data))
+    df_train, df_val = data[:num_rows_train], data[num_rows_train:]
+    train = xgb.DMatrix(encoder.transform(df_train), label=df_train["price"])
+    valid = xgb.DMatrix(encoder.transform(df_val), label=df_val["price"])
+    y_val = df_val["price"].values
+
+    rmse_train = run.data.metrics["rmse"]
+    rmse_before = mean_squared_error(
+        y_val, booster.predict(valid), squared=False
+    )
+    print(
+        f"rmse of run {run.info.run_id}: {rmse_train:.2f} at training, "
+        f"{rmse_before:.2f} on the new announcements"
+    )
+    if rmse_before > (1 + tolerance) * rmse_train:
+        return False
+
+    params = run_params(run)
+    booster = xgb.train(
+        params=params,
+        dtrain=train,
+        num_boost_round=num_boost_round,
+        evals=[(valid, "validation")],
+        early_stopping_rounds=50,
+        xgb_model=booster,
+    )
+    y_pred = booster.predict(valid)
+    rmse = mean_squared_error(y_val, y_pred, squared=False)
+    print(f"rmse after {num_boost_round} more rounds: {rmse:.2f}")
+    if rmse >= rmse_before:
+        print("Keeping the current model")
+        return True
+
+    with mlflow.start_run():
+        mlflow.set_tag("warm_start_from", run.info.run_id)
+        mlflow.set_tag("train_until", data["createdAt"].max().isoformat())
+        mlflow.log_params(params)
+        mlflow.log_metric("rmse", rmse)
+        mlflow.log_metric(
+            "mape", mean_absolute_percentage_error(y_val, y_pred)
+        )
+        Path("models").mkdir(exist_ok=True)
+        encoder.save("models/encoder.json")
+        mlflow.log_artifact(
+            "models/encoder.json", artifact_path="preprocessor"
+        )
+        mlflow.log_dict(bounds, "outlier_bounds.json")
+        model_info = mlflow.xgboost.log_model(
+            booster, artifact_path="models_mlflow"
+        )
+        register_best_model(model_info.model_uri)
+    return True
+
+
+@flow
+def incremental_flow(
+    num_boost_round: int = 200, min_rows: int = 100, tolerance: float = 0.1
+) -> None:
+    """
+    The daily training pipeline: continue boosting the best model on the
+    announcements added since it was trained, falling back to main_flow
+    when it degraded on them
+    """
+    mlflow.set_experiment(EXPERIMENT_NAME)
+    run = mlflow.get_run(resolve_model())
+    # The runs logged before the train_until tag trained on everything
+    # fetched before they started
+    train_until = run.data.tags.get("train_until")
+    train_until = (
+        pd.Timestamp(train_until)
+        if train_until is not None
+        else pd.Timestamp(run.info.start_time, unit="ms", tz="UTC")
+    )
+    # The outliers are the ones of the model, not of the new announcements
+    bounds = run_outlier_bounds(run.info.run_id)
+    if bounds is None:
+        print("No outlier bounds logged by the run, computing them again")
+        _, bounds = feature_engineering()
+    data, _ = feature_engineering(since=train_until, bounds=bounds)
+    if len(data) < min_rows:
+        print(f"Only {len(data)} announcements since {train_until}, skipping")
+        return
+    if not warm_start_model(run, data, bounds, num_boost_round, tolerance):
+        print("The model degraded on the new announcements, retraining it")
+        main_flow()
+
+
 @flow
-def main_flow() -> None:
-    """The main training pipeline"""
+@instrument_flow
+def main_flow(months: int | None = None, n_workers: int = 1) -> None:
+    """
+    The main training pipeline, on the last `months` months if given, with
+    `n_workers` hyperparameter trials trained at once
+    """
 
     # MLflow settings
     # mlflow.set_tracking_uri("sqlite:///mlflow.db")
-    mlflow.set_experiment("project-train-best-model-experiment")
-    # Prepare data
-    data = feature_engineering(
-        path_cleaned_data=Path("data/1_cleaned_data.parquet")
-    )
-    X_train, X_val, y_train, y_val, dv = prepare_data(data)
+    mlflow.set_experiment(EXPERIMENT_NAME)
+    # Prepare data, unless it was already done for the same cleaned data
+    path_cleaned_data = Path("data/1_cleaned_data")
+    cache_dir = training_cache_dir(path_cleaned_data, months)
+    if cache_dir.exists():
+        print(f"Using the training data cached in {cache_dir}")
+        # Marked as used, for prune_cache
+        os.utime(cache_dir)
+        shutil.copy(cache_dir / "reference_data.parquet", "data")
+    else:
+        data, bounds = feature_engineering(
+            path_cleaned_data=path_cleaned_data, months=months
+        )
+        X_train, X_val, y_train, y_val, encoder = prepare_data(data)
+        save_training_data(
+            cache_dir, X_train, X_val, y_train, y_val, encoder, bounds
+        )
     # Found best params
-    best_params = found_best_model(X_train, X_val, y_train, y_val)
+    best_params = found_best_model(cache_dir, n_workers=n_workers)
     best_params["max_depth"] = int(best_params["max_depth"])
 
     # # Train the best model
-    train_best_model(X_train, X_val, y_train, y_val, dv, best_params)
+    train_best_model(cache_dir, best_params)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,20 @@
+import bisect
+import hashlib
 import json
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterable
 
 import psycopg
 from gql import gql
-from prefect import task
+from psycopg.rows import dict_row
+
+from instrumentation import instrument
 
 create_table_rental = """
     CREATE TABLE if not exists rental(
-        id SERIAL PRIMARY KEY,
+        id BIGINT PRIMARY KEY,
         title TEXT ,
         description TEXT ,
         show_analytics BOOLEAN ,
@@ -29,29 +37,53 @@ create_table_rental = """
         store_id INT ,
         store_name TEXT ,
         store_image_url TEXT,
-        user_id INT 
+        user_id INT ,
+        content_hash TEXT ,
+        slug TEXT ,
+        store_slug TEXT ,
+        specs JSONB,
+        updated_at TIMESTAMP DEFAULT now()
     );
+    ALTER TABLE rental ADD COLUMN IF NOT EXISTS content_hash TEXT;
+    ALTER TABLE rental ADD COLUMN IF NOT EXISTS slug TEXT;
+    ALTER TABLE rental ADD COLUMN IF NOT EXISTS store_slug TEXT;
+    ALTER TABLE rental ADD COLUMN IF NOT EXISTS specs JSONB;
+    ALTER TABLE rental ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now();
+    CREATE INDEX IF NOT EXISTS rental_content_hash_idx ON rental (content_hash);
+    CREATE INDEX IF NOT EXISTS rental_created_at_idx ON rental (created_at);
+    CREATE INDEX IF NOT EXISTS rental_updated_at_idx ON rental (updated_at, id);
 """
 
+# One row per crawl: `watermark` is the refresh date the running crawl stops
+# at, `high_watermark` the most recent one it has seen, and `last_page` /
+# `last_id` the last ingested annonce, where an interrupted crawl resumes
+create_table_crawl_state = """
+    CREATE TABLE if not exists crawl_state(
+        name TEXT PRIMARY KEY,
+        status TEXT ,
+        watermark TIMESTAMP ,
+        high_watermark TIMESTAMP ,
+        last_page INT ,
+        last_id BIGINT ,
+        updated_at TIMESTAMP DEFAULT now()
+    );
+"""
 
-@task
-def connect_to_database(db_params: dict):
-    """
-    Connect to the PostgreSQL database
-    """
-    try:
-        conn = psycopg.connect(
-            host=db_params["host"],
-            port=db_params["port"],
-            dbname=db_params["dbname"],
-            user=db_params["user"],
-            password=db_params["password"],
-            autocommit=True,
-        )
-        return conn
-    except psycopg.Error as e:
-        print("Error where connecting the the database:", e)
-        return None
+save_crawl_state_sql = """
+    INSERT INTO crawl_state(
+        name, status, watermark, high_watermark, last_page, last_id, updated_at
+    ) VALUES (
+        %(name)s, %(status)s, %(watermark)s, %(high_watermark)s,
+        %(last_page)s, %(last_id)s, now()
+    )
+    ON CONFLICT (name) DO UPDATE SET
+        status = EXCLUDED.status,
+        watermark = EXCLUDED.watermark,
+        high_watermark = EXCLUDED.high_watermark,
+        last_page = EXCLUDED.last_page,
+        last_id = EXCLUDED.last_id,
+        updated_at = EXCLUDED.updated_at
+"""
 
 
 def transform_annonce_data(raw_data: dict) -> dict:
@@ -69,8 +101,11 @@ def transform_annonce_data(raw_data: dict) -> dict:
         "is_from_store": raw_data["isFromStore"] if raw_data["isFromStore"] else None,
         "like_count": raw_data["likeCount"] if raw_data["likeCount"] else None,
         "status": raw_data["status"] if raw_data["status"] else None,
-        "price": raw_data["price"] if raw_data["price"] else None,
-        "price_preview": raw_data["pricePreview"] if raw_data["pricePreview"] else None,
+        # prices are bigint columns: round like the float -> bigint cast would
+        "price": round(raw_data["price"]) if raw_data["price"] else None,
+        "price_preview": round(raw_data["pricePreview"])
+        if raw_data["pricePreview"]
+        else None,
         "price_unit": raw_data["priceUnit"] if raw_data["priceUnit"] else None,
         "price_type": raw_data["priceType"] if raw_data["priceType"] else None,
         "exchange_type": raw_data["exchangeType"] if raw_data["exchangeType"] else None,
@@ -93,37 +128,262 @@ def transform_annonce_data(raw_data: dict) -> dict:
         "store_name": raw_data["store"]["name"] if raw_data["store"] else None,
         "store_image_url": raw_data["store"]["imageUrl"] if raw_data["store"] else None,
         "user_id": raw_data["user"]["id"] if raw_data["user"] else None,
+        "slug": raw_data["slug"] if raw_data["slug"] else None,
+        "store_slug": raw_data["store"]["slug"] if raw_data["store"] else None,
+        "specs": json.dumps(raw_data["specs"]) if raw_data["specs"] else None,
     }
+    transformed_data["content_hash"] = content_hash(transformed_data)
     return transformed_data
 
 
-def ingest_announce(conn, transformed_annonce_data: dict) -> None:
+def content_hash(transformed_annonce_data: dict) -> str:
     """
-    Insert a transformed annonce into the table
+    Hash the content of an annonce, leaving out the id and the fields that
+    change without the annonce being edited (refresh date, likes)
     """
-    ingest_announce_sql = f""" INSERT INTO rental(
-        id, title,
-        description, show_analytics, created_at, is_from_store,
-        like_count, status, price, price_preview, price_unit, price_type, exchange_type,
-        small_description, category_name, city_id, city_name, region_id,
-        region_name, media_url, store_id, store_name,
-        store_image_url, user_id
-    ) VALUES (
-        %(id)s, %(title)s, %(description)s, %(show_analytics)s, %(created_at)s, %(is_from_store)s,
-        %(like_count)s, %(status)s, %(price)s, %(price_preview)s,
-        %(price_unit)s, %(price_type)s, %(exchange_type)s, %(small_description)s,
-        %(category_name)s, %(city_id)s, %(city_name)s, %(region_id)s,
-        %(region_name)s,  %(media_url)s, %(store_id)s, %(store_name)s,
-        %(store_image_url)s, %(user_id)s
-    );
+    content = {
+        key: value
+        for key, value in transformed_annonce_data.items()
+        if key not in ("id", "created_at", "like_count", "content_hash")
+    }
+    return hashlib.md5(
+        json.dumps(content, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+RENTAL_COLUMNS = [
+    "id",
+    "title",
+    "description",
+    "show_analytics",
+    "created_at",
+    "is_from_store",
+    "like_count",
+    "status",
+    "price",
+    "price_preview",
+    "price_unit",
+    "price_type",
+    "exchange_type",
+    "small_description",
+    "category_name",
+    "city_id",
+    "city_name",
+    "region_id",
+    "region_name",
+    "media_url",
+    "store_id",
+    "store_name",
+    "store_image_url",
+    "user_id",
+    "content_hash",
+    "slug",
+    "store_slug",
+    "specs",
+]
+
+# A re-crawled annonce only rewrites its row when it was refreshed or edited,
+# `updated_at` is when its row was last written, the cleaning is keyed on it
+on_conflict_update_sql = f"""
+    ON CONFLICT (id) DO UPDATE SET
+        {", ".join(f"{c} = EXCLUDED.{c}" for c in RENTAL_COLUMNS if c != "id")},
+        updated_at = now()
+    WHERE rental.created_at IS DISTINCT FROM EXCLUDED.created_at
+        OR rental.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+"""
+
+ingest_announce_sql = f"""
+    INSERT INTO rental({", ".join(RENTAL_COLUMNS)})
+    VALUES ({", ".join(f"%({column})s" for column in RENTAL_COLUMNS)})
 """
+
+upsert_announce_sql = ingest_announce_sql + on_conflict_update_sql
+
+copy_announces_sql = f"COPY rental({', '.join(RENTAL_COLUMNS)}) FROM STDIN"
+
+# The stage has the columns copied, whatever other columns rental gains
+create_rental_stage = f"""
+    CREATE TEMP TABLE IF NOT EXISTS rental_stage ON COMMIT DELETE ROWS AS
+    SELECT {", ".join(RENTAL_COLUMNS)} FROM rental WITH NO DATA
+"""
+
+copy_stage_sql = f"COPY rental_stage({', '.join(RENTAL_COLUMNS)}) FROM STDIN"
+
+# Keep the last copy of an annonce sent twice in the same batch,
+# ON CONFLICT cannot update the same row twice in one statement
+upsert_stage_sql = f"""
+    INSERT INTO rental({", ".join(RENTAL_COLUMNS)})
+    SELECT DISTINCT ON (id) {", ".join(RENTAL_COLUMNS)}
+    FROM rental_stage
+    ORDER BY id, created_at DESC NULLS LAST
+    {on_conflict_update_sql}
+"""
+
+
+@instrument(rows=1)
+def ingest_announce(conn, transformed_annonce_data: dict, upsert: bool = True) -> None:
+    """
+    Insert a transformed annonce into the table
+    """
+    sql = upsert_announce_sql if upsert else ingest_announce_sql
     with conn.cursor() as curr:
         try:
-            curr.execute(ingest_announce_sql, transformed_annonce_data)
+            curr.execute(sql, transformed_annonce_data, prepare=True)
         except psycopg.Error as e:
             print(f"Error: {e} in annonce id={transformed_annonce_data['id']}")
 
 
+@instrument("ingest_rowwise", rows="batch")
+def _ingest_batch_rowwise(conn, batch: list, upsert: bool) -> (int, list):
+    """
+    Insert a batch row by row, each row under its own savepoint, so that a
+    bad row is rejected without losing the rest of the batch
+    """
+    sql = upsert_announce_sql if upsert else ingest_announce_sql
+    written = 0
+    rejected = []
+    with conn.transaction(), conn.cursor() as curr:
+        for annonce in batch:
+            try:
+                with conn.transaction():
+                    curr.execute(sql, annonce, prepare=True)
+                written += curr.rowcount
+            except psycopg.Error as e:
+                rejected.append({"annonce": annonce, "error": str(e)})
+    return written, rejected
+
+
+@instrument("ingest_copy", rows="batch")
+def _copy_batch(conn, batch: list, upsert: bool) -> int:
+    """
+    COPY a batch in one transaction and return the number of rows written.
+
+    In upsert mode the batch is copied into a temporary stage table and
+    merged into `rental` with a single INSERT ... ON CONFLICT.
+    """
+    with conn.transaction(), conn.cursor() as curr:
+        if upsert:
+            curr.execute(create_rental_stage)
+        with curr.copy(copy_stage_sql if upsert else copy_announces_sql) as copy:
+            for annonce in batch:
+                copy.write_row([annonce[column] for column in RENTAL_COLUMNS])
+        if not upsert:
+            return len(batch)
+        curr.execute(upsert_stage_sql, prepare=True)
+        return curr.rowcount
+
+
+def ingest_announces(
+    conn,
+    transformed_annonces: Iterable[dict],
+    batch_size: int = 1000,
+    upsert: bool = True,
+) -> dict:
+    """
+    Insert many transformed annonces, one COPY and one transaction per batch.
+
+    If the COPY of a batch fails, the batch is rolled back and replayed row
+    by row so that only the faulty rows end up in the reject list.
+
+    Args:
+        conn: An open psycopg connection
+        transformed_annonces: Iterable of `transform_annonce_data` outputs
+        batch_size: Number of rows sent per COPY
+        upsert: Update already stored annonces when they were refreshed or
+            edited and skip them otherwise. When False, plain inserts are
+            used and duplicated ids are rejected.
+
+    Returns:
+        report: Rows written, rows left unchanged, total time, per batch
+            timings and rejected rows
+    """
+    report = {
+        "rows": 0,
+        "unchanged": 0,
+        "seconds": 0.0,
+        "batches": [],
+        "rejected": [],
+    }
+    annonces = iter(transformed_annonces)
+    while batch := list(islice(annonces, batch_size)):
+        start = time.perf_counter()
+        try:
+            written, rejected, copied = _copy_batch(conn, batch, upsert), [], True
+        except psycopg.Error:
+            written, rejected = _ingest_batch_rowwise(conn, batch, upsert)
+            copied = False
+        seconds = time.perf_counter() - start
+        unchanged = len(batch) - written - len(rejected)
+        report["rows"] += written
+        report["unchanged"] += unchanged
+        report["seconds"] += seconds
+        report["rejected"].extend(rejected)
+        report["batches"].append(
+            {
+                "rows": written,
+                "unchanged": unchanged,
+                "rejected": len(rejected),
+                "seconds": seconds,
+                "copy": copied,
+            }
+        )
+    return report
+
+
+def get_crawl_state(conn, name: str = "rental") -> dict | None:
+    """
+    Read the persisted state of a crawl, None if it never ran
+    """
+    with conn.cursor(row_factory=dict_row) as curr:
+        curr.execute("SELECT * FROM crawl_state WHERE name = %s", (name,))
+        return curr.fetchone()
+
+
+def save_crawl_state(conn, state: dict) -> None:
+    """
+    Persist the state of a crawl
+    """
+    conn.execute(save_crawl_state_sql, state)
+
+
+def get_watermark(conn) -> datetime | None:
+    """
+    Refresh date of the most recent annonce in the table (index backed)
+    """
+    return conn.execute("SELECT max(created_at) FROM rental").fetchone()[0]
+
+
+def parse_created_at(created_at: str) -> datetime:
+    """
+    Parse the `createdAt` of an annonce (eg: 2023-08-10T12:00:00.000Z)
+    """
+    return datetime.fromisoformat(created_at.removesuffix("Z"))
+
+
+def count_newer(data_page: list, watermark: datetime) -> int:
+    """
+    Number of annonces of a page refreshed after the watermark.
+
+    Pages are sorted from the most to the least recently refreshed annonce,
+    so a binary search parses only a handful of dates per page.
+    """
+    return bisect.bisect_left(
+        data_page,
+        timedelta(0),
+        key=lambda annonce: watermark - parse_created_at(annonce["createdAt"]),
+    )
+
+
+def skip_ingested(data_page: list, last_id: int | None) -> list:
+    """
+    Drop the annonces of a page up to the last ingested one, if present
+    """
+    ids = [int(annonce["id"]) for annonce in data_page]
+    if last_id is None or last_id not in ids:
+        return data_page
+    return data_page[ids.index(last_id) + 1 :]
+
+
 def load_query(path):
     with open(path) as f:
         return gql(f.read())